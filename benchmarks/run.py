@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+"""End-to-end benchmarks of the idli command line against local stub servers.
+
+    $ python benchmarks/run.py --backends redmine,trac --sizes 100,10000 --latency 20
+    $ python benchmarks/run.py --save-baseline          # record benchmarks/baseline.json
+    $ python benchmarks/run.py                          # compare against it
+
+Each operation runs the real `idli` script in a fresh process, with its own
+HOME and project directory, against a stub seeded with `size` synthetic
+issues. For every backend, size and operation the suite records wall time,
+the number of requests the stub answered, peak RSS of the idli process and
+time to first row of output. Results are compared to the baseline, and
+anything slower or chattier than allowed is reported as a regression."""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IDLI_SCRIPT = os.path.join(ROOT, "scripts", "idli")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+OPERATIONS = ("list", "show", "comment", "resolve", "assign")
+
+# Runs the idli script and reports its peak RSS on the way out. Linux carries the
+# high-water mark of the process which forked over exec, so rusage from wait4()
+# would include the benchmark's own memory; VmHWM belongs to the new program.
+BOOTSTRAP = """
+import sys, runpy, resource
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(script, run_name="__main__")
+finally:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmHWM:"):
+                peak = int(line.split()[1])
+    except IOError:
+        pass
+    sys.stderr.write("\\n%s %d\\n" % ("idli-benchmark-peak-rss-kb", peak))
+"""
+PEAK_RSS_MARKER = "idli-benchmark-peak-rss-kb "
+
+def operation_argv(op, issue_id, user):
+    if op == "list":
+        return ["list", "--fresh"]
+    if op == "show":
+        return ["show", str(issue_id), "--fresh"]
+    if op == "comment":
+        return ["comment", str(issue_id), "--body", "Benchmark comment."]
+    if op == "resolve":
+        return ["resolve", str(issue_id), "--message", "Resolved by the benchmark."]
+    if op == "assign":
+        return ["assign", str(issue_id), user, "--message", "Assigned by the benchmark."]
+    raise ValueError(op)
+
+def write_project(stub, directory):
+    """Create a project directory and HOME for idli pointing at the stub."""
+    home = os.path.join(directory, "home")
+    project = os.path.join(directory, "project")
+    os.makedirs(home)
+    os.makedirs(project)
+    section, values = stub.config()
+    with open(os.path.join(project, ".idli"), "w") as f:
+        f.write("[project]\ntype = " + stub.name + "\n\n[" + section + "]\n")
+        for (k, v) in sorted(values.items()):
+            f.write(k + " = " + v + "\n")
+    return (home, project)
+
+def run_idli(argv, home, project):
+    """Run idli once. Returns a dict of measurements."""
+    env = dict(os.environ)
+    env.update({ "HOME" : home, "PWD" : project, "PYTHONPATH" : ROOT, "IDLI_NO_DAEMON" : "1", "EDITOR" : "true" })
+    env.pop("IDLI_TRACE", None)
+    stderr = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", BOOTSTRAP, IDLI_SCRIPT] + argv, cwd=project, env=env,
+                            stdout=subprocess.PIPE, stderr=stderr)
+    first_row = None
+    lines = []
+    for line in proc.stdout:
+        lines.append(line)
+        # A listing starts with a header line; everything else with its first line.
+        if (first_row is None) and (len(lines) >= (2 if argv[0] == "list" else 1)):
+            first_row = time.perf_counter() - started
+    proc.stdout.close()
+    proc.wait()
+    wall = time.perf_counter() - started
+    stderr.seek(0)
+    errors = stderr.read().decode("utf-8", "replace")
+    stderr.close()
+    peak_rss = None
+    for line in errors.split("\n"):
+        if line.startswith(PEAK_RSS_MARKER):
+            peak_rss = int(line[len(PEAK_RSS_MARKER):])
+    errors = "\n".join([l for l in errors.split("\n") if not l.startswith(PEAK_RSS_MARKER)])
+    output = b"".join(lines).decode("utf-8", "replace")
+    result = { "wall_ms" : round(wall * 1000.0, 1),
+               "first_row_ms" : round(first_row * 1000.0, 1) if first_row is not None else None,
+               "peak_rss_kb" : peak_rss,
+               "rows" : max(len(lines) - 1, 0) if argv[0] == "list" else None,
+               "status" : "ok" }
+    if "not implemented" in output:
+        result["status"] = "unsupported"
+    elif (proc.returncode != 0) or ("Traceback" in errors):
+        result["status"] = "error"
+        result["error"] = (errors or output).strip().split("\n")[-1]
+    return result
+
+def benchmark(backend, size, operations, repeat, latency, bandwidth):
+    """Yield (key, measurements) for each operation against a fresh stub."""
+    stub = stubs.STUBS[backend](size, latency=latency, bandwidth=bandwidth).start()
+    directory = tempfile.mkdtemp(prefix="idli-bench-")
+    try:
+        home, project = write_project(stub, directory)
+        issue_id = (size // 2) - ((size // 2) % 3) + 1 # An open issue in the middle of the project
+        for op in operations:
+            runs = []
+            for r in range(repeat):
+                before = stub.requests()
+                result = run_idli(operation_argv(op, issue_id, stub.user()), home, project)
+                result["requests"] = stub.requests() - before
+                runs.append(result)
+                if result["status"] != "ok":
+                    break
+            result = sorted(runs, key=lambda r: r["wall_ms"])[len(runs) // 2]
+            result["runs"] = len(runs)
+            yield (backend + "/" + str(size) + "/" + op, result)
+    finally:
+        stub.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def regressions(results, baseline, tolerance):
+    """Return (key, metric, baseline value, new value) for everything which got worse.
+
+    Any increase in requests counts; timings and memory may grow by `tolerance`."""
+    found = []
+    for key, result in sorted(results.items()):
+        old = baseline.get(key)
+        if (old is None) or (result["status"] != "ok"):
+            if (old is not None) and (old["status"] == "ok"):
+                found.append((key, "status", old["status"], result["status"]))
+            continue
+        if result["requests"] > old["requests"]:
+            found.append((key, "requests", old["requests"], result["requests"]))
+        for metric in ("wall_ms", "first_row_ms", "peak_rss_kb"):
+            if (old.get(metric) is None) or (result.get(metric) is None):
+                continue
+            if result[metric] > old[metric] * (1.0 + tolerance):
+                found.append((key, metric, old[metric], result[metric]))
+    return found
+
+def print_table(results, baseline):
+    print("benchmark".ljust(28) + "status".ljust(12) + "wall ms".rjust(10) + "base".rjust(10) + "first row".rjust(11)
+          + "requests".rjust(10) + "base".rjust(6) + "rss KB".rjust(10) + "rows".rjust(8))
+    for key, r in sorted(results.items(), key=lambda kv: __sort_key(kv[0])):
+        old = baseline.get(key, {})
+        print(key.ljust(28) + r["status"].ljust(12) + __fmt(r["wall_ms"]).rjust(10) + __fmt(old.get("wall_ms")).rjust(10)
+              + __fmt(r["first_row_ms"]).rjust(11) + __fmt(r["requests"]).rjust(10) + __fmt(old.get("requests")).rjust(6)
+              + __fmt(r["peak_rss_kb"]).rjust(10) + __fmt(r["rows"]).rjust(8))
+        if r.get("error"):
+            print("    " + r["error"])
+
+def __sort_key(key):
+    backend, size, op = key.split("/")
+    return (backend, int(size), OPERATIONS.index(op) if op in OPERATIONS else op)
+
+def __fmt(value):
+    return "-" if value is None else str(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark idli against local stub servers.")
+    parser.add_argument("--backends", default=",".join(sorted(stubs.STUBS)), help="Comma separated backends to benchmark.")
+    parser.add_argument("--sizes", default="100,10000,100000", help="Comma separated numbers of issues in the stub project.")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="Comma separated operations to run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation; the median is reported.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds added to every reply.")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Reply bandwidth in KB/s (0 for unlimited).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare with.")
+    parser.add_argument("--save-baseline", action="store_true", default=False, help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slow-down before a timing counts as a regression (0.25 is 25%%).")
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for backend in [b for b in args.backends.split(",") if b]:
+        for size in [int(s) for s in args.sizes.split(",") if s]:
+            for key, result in benchmark(backend, size, [o for o in args.ops.split(",") if o], args.repeat,
+                                         args.latency / 1000.0, args.bandwidth * 1024.0):
+                results[key] = result
+                sys.stderr.write(key + ": " + result["status"] + " " + str(result["wall_ms"]) + " ms\n")
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+    settings = { "latency_ms" : args.latency, "bandwidth_kbs" : args.bandwidth, "repeat" : args.repeat, "python" : sys.version.split()[0] }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({ "settings" : settings, "results" : results }, f, indent=1, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({ "settings" : settings, "results" : results }, f, indent=1, sort_keys=True)
+        print("Baseline written to " + args.baseline)
+        return 0
+
+    found = regressions(results, baseline, args.tolerance)
+    for (key, metric, old, new) in found:
+        print("REGRESSION " + key + " " + metric + ": " + str(old) + " -> " + str(new))
+    return 1 if found else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,592 @@
+"""Local stand-ins for the bug trackers idli talks to, for benchmarking.
+
+Every stub serves the same synthetic project: issues 1..size, generated on
+demand from their number so that 100,000 issues cost no memory, plus any
+changes clients make. Each stub counts the requests it answers and can add
+latency and a bandwidth limit to every reply."""
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+import socketserver
+import xmlrpc.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+BASE_TIME = datetime.datetime(2020, 1, 1)
+USERS = [ "user%d" % n for n in range(1, 51) ]
+TAGS = [ "db", "ui", "api", "docs", "build" ]
+
+class Dataset(object):
+    """Issues 1..size. Issue n is closed if n % 3 == 0, owned by someone if n % 5 == 0,
+    and starts with n % 4 comments."""
+    def __init__(self, size):
+        self.size = size
+        self.__changes = {}
+        self.__created = {}
+        self.__lock = threading.Lock()
+
+    def exists(self, n):
+        return (1 <= n <= self.size) or (n in self.__created)
+
+    def ids(self, is_open=None):
+        result = range(1, self.size + 1)
+        if self.__created:
+            result = list(result) + sorted(self.__created)
+        if is_open is None:
+            return list(result)
+        if not self.__changes:
+            return [n for n in result if ((n % 3) != 0) == is_open]
+        return [n for n in result if self.issue(n)["open"] == is_open]
+
+    def issue(self, n):
+        if n in self.__created:
+            result = dict(self.__created[n])
+        else:
+            created = BASE_TIME + datetime.timedelta(minutes=n)
+            result = { "id" : n,
+                       "title" : "Synthetic issue %d" % n,
+                       "body" : ("Issue %d describes a problem in some detail. " % n) * 4,
+                       "creator" : USERS[n % len(USERS)],
+                       "owner" : USERS[(n // 5) % len(USERS)] if (n % 5) == 0 else None,
+                       "open" : (n % 3) != 0,
+                       "tags" : [TAGS[n % len(TAGS)]],
+                       "created" : created,
+                       "modified" : created + datetime.timedelta(hours=n % 48),
+                       "comments" : [ { "author" : USERS[(n + k) % len(USERS)], "body" : "Comment %d on issue %d." % (k, n),
+                                        "date" : created + datetime.timedelta(hours=k + 1) } for k in range(n % 4) ],
+                       }
+        change = self.__changes.get(n)
+        if change:
+            result.update(dict([(k, v) for (k, v) in change.items() if k != "comments"]))
+            result["comments"] = result["comments"] + change.get("comments", [])
+        return result
+
+    def change(self, n, **fields):
+        with self.__lock:
+            change = self.__changes.setdefault(n, {})
+            change.update(fields)
+            change["modified"] = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def add_comment(self, n, author, body):
+        with self.__lock:
+            change = self.__changes.setdefault(n, {})
+            change.setdefault("comments", []).append({ "author" : author, "body" : body, "date" : datetime.datetime.utcnow().replace(microsecond=0) })
+            change["modified"] = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def add_issue(self, title, body, creator):
+        with self.__lock:
+            n = max([self.size] + list(self.__created.keys())) + 1
+            now = datetime.datetime.utcnow().replace(microsecond=0)
+            self.__created[n] = { "id" : n, "title" : title, "body" : body, "creator" : creator, "owner" : None, "open" : True,
+                                  "tags" : [], "created" : now, "modified" : now, "comments" : [] }
+            return n
+
+class Throttle(object):
+    """Injected latency (seconds per request) and bandwidth (bytes per second, 0 for unlimited)."""
+    def __init__(self, latency=0.0, bandwidth=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self.__lock = threading.Lock()
+
+    def reply(self, num_bytes):
+        with self.__lock:
+            self.requests += 1
+            self.bytes_sent += num_bytes
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(num_bytes) / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+class StubServer(object):
+    """Base class: runs a server in a background thread on a free local port."""
+    name = None
+    rate_limit = None # Requests allowed per rate_window seconds, reported in X-RateLimit headers
+    rate_window = 3600
+
+    def __init__(self, size, latency=0.0, bandwidth=0):
+        self.data = Dataset(size)
+        self.throttle = Throttle(latency, bandwidth)
+        self.server = None
+        self.thread = None
+        self.remaining = self.rate_limit
+        self.reset = int(time.time()) + self.rate_window
+        self.__lock = threading.Lock()
+
+    def take_request(self):
+        """Count a request against the rate limit. Returns False once it is used up."""
+        if self.rate_limit is None:
+            return True
+        with self.__lock:
+            if time.time() >= self.reset:
+                self.remaining, self.reset = self.rate_limit, int(time.time()) + self.rate_window
+            if self.remaining == 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def rate_limit_headers(self):
+        if self.rate_limit is None:
+            return []
+        return [ ("X-RateLimit-Limit", str(self.rate_limit)), ("X-RateLimit-Remaining", str(self.remaining)),
+                 ("X-RateLimit-Reset", str(self.reset)) ]
+
+    def requests(self):
+        return self.throttle.requests
+
+    def start(self):
+        self.server = self.make_server()
+        self.thread = threading.Thread(target=self.server.serve_forever, name="stub-" + self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def port(self):
+        return self.server.server_address[1]
+
+    def make_server(self):
+        raise NotImplementedError()
+
+    def config(self):
+        """Return (section, dict of values) for the project's .idli file."""
+        raise NotImplementedError()
+
+    def user(self):
+        """A user name `idli assign` can assign issues to."""
+        return USERS[7]
+
+class JsonHandler(BaseHTTPRequestHandler):
+    """Request handler for the REST stubs. Subclasses implement route(method, path, query, body)."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def handle_method(self, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.server.stub.take_request():
+            code, result = self.route(method, url.path, query, raw)
+        else: # As GitHub does when the rate limit is used up
+            code, result = (403, { "message" : "API rate limit exceeded" })
+        body = b"" if result is None else json.dumps(result).encode("utf-8")
+        etag = None
+        if (method == "GET") and (code == 200):
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag: # Unchanged since the client's copy
+                code, body = 304, b""
+        self.server.stub.throttle.reply(len(body))
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        for (name, value) in self.server.stub.rate_limit_headers():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_HEAD(self):
+        self.handle_method("HEAD")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+    def data(self):
+        return self.server.stub.data
+
+def first(query, name, default=None):
+    return query.get(name, [default])[0]
+
+def form_or_json(raw):
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw.decode("utf-8"))
+    except ValueError:
+        return dict([(k, v[0]) for (k, v) in parse_qs(raw.decode("utf-8")).items()])
+
+# Redmine
+
+def redmine_time(d):
+    return d.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def redmine_issue(issue, journals=False):
+    result = { "id" : issue["id"], "subject" : issue["title"], "description" : issue["body"],
+               "author" : { "id" : USERS.index(issue["creator"]) + 1 if issue["creator"] in USERS else 1, "name" : issue["creator"] },
+               "status" : { "id" : 1, "name" : "New" } if issue["open"] else { "id" : 5, "name" : "Closed" },
+               "priority" : { "id" : 4, "name" : "Normal" },
+               "created_on" : redmine_time(issue["created"]), "updated_on" : redmine_time(issue["modified"]) }
+    if issue["owner"]:
+        result["assigned_to"] = { "id" : USERS.index(issue["owner"]) + 1 if issue["owner"] in USERS else 1, "name" : issue["owner"] }
+    if journals:
+        result["journals"] = [ { "id" : k + 1, "user" : { "name" : c["author"] }, "notes" : c["body"], "created_on" : redmine_time(c["date"]) }
+                               for (k, c) in enumerate(issue["comments"]) ]
+    return result
+
+def redmine_user(n):
+    return { "id" : n + 1, "login" : USERS[n], "mail" : USERS[n] + "@example.org", "firstname" : "First%d" % n, "lastname" : "Last%d" % n }
+
+class RedmineHandler(JsonHandler):
+    MAX_LIMIT = 100 # Redmine's default cap on page sizes
+    issue_re = re.compile(r'^/issues/(\d+)\.json$')
+
+    def route(self, method, path, query, raw):
+        data = self.data()
+        m = self.issue_re.match(path)
+        if m:
+            n = int(m.group(1))
+            if not data.exists(n):
+                return (404, { "errors" : [ "Not found" ] })
+            if method == "PUT":
+                fields = form_or_json(raw).get("issue", {})
+                if fields.get("notes"):
+                    data.add_comment(n, USERS[1], fields["notes"])
+                if "status_id" in fields:
+                    data.change(n, open=(int(fields["status_id"]) == 1))
+                if "assigned_to_id" in fields:
+                    data.change(n, owner=USERS[(int(fields["assigned_to_id"]) - 1) % len(USERS)])
+                return (204, None)
+            return (200, { "issue" : redmine_issue(data.issue(n), first(query, "include") == "journals") })
+        if path == "/issues/bulk_update.json" and method == "POST":
+            body = form_or_json(raw)
+            ids = [int(n) for n in body.get("ids", [])]
+            if [n for n in ids if not data.exists(n)]:
+                return (404, { "errors" : [ "Not found" ] })
+            fields = body.get("issue", {})
+            for n in ids:
+                if body.get("notes"):
+                    data.add_comment(n, USERS[1], body["notes"])
+                if "status_id" in fields:
+                    data.change(n, open=(int(fields["status_id"]) == 1))
+                if "assigned_to_id" in fields:
+                    data.change(n, owner=USERS[(int(fields["assigned_to_id"]) - 1) % len(USERS)])
+            return (204, None)
+        if path == "/issues.json" and method == "POST":
+            fields = form_or_json(raw).get("issue", {})
+            n = data.add_issue(fields.get("subject", ""), fields.get("description", ""), USERS[1])
+            return (201, { "issue" : redmine_issue(data.issue(n)) })
+        if path == "/issues.json":
+            status = first(query, "status_id", "open")
+            if status == "*":
+                ids = data.ids()
+            elif status in ("open", "closed"):
+                ids = data.ids(status == "open")
+            else: # Like Redmine, which knows no status called True
+                return (422, { "errors" : [ "Status is invalid" ] })
+            offset = int(first(query, "offset", 0))
+            limit = min(int(first(query, "limit", 25)), self.MAX_LIMIT)
+            page = [ redmine_issue(data.issue(n)) for n in ids[offset:offset + limit] ]
+            return (200, { "issues" : page, "total_count" : len(ids), "offset" : offset, "limit" : limit })
+        if path == "/users.json":
+            users = [ redmine_user(n) for n in range(len(USERS)) ]
+            name = first(query, "name")
+            if name: # Like Redmine, a case insensitive substring of login, names or mail
+                users = [ u for u in users if name.lower() in " ".join([u["login"], u["firstname"], u["lastname"], u["mail"]]).lower() ]
+            offset = int(first(query, "offset", 0))
+            limit = min(int(first(query, "limit", 25)), self.MAX_LIMIT)
+            return (200, { "users" : users[offset:offset + limit], "total_count" : len(users), "offset" : offset, "limit" : limit })
+        if path == "/users/current.json":
+            return (200, { "user" : redmine_user(1) })
+        if path.startswith("/users/") and path.endswith(".json"):
+            return (200, { "user" : redmine_user(int(path[7:-5]) - 1) })
+        if path == "/issue_statuses.json":
+            return (200, { "issue_statuses" : [ { "id" : 1, "name" : "New" }, { "id" : 5, "name" : "Closed", "is_closed" : True } ] })
+        if path == "/enumerations/issue_priorities.json":
+            return (200, { "issue_priorities" : [ { "id" : 3, "name" : "Low" }, { "id" : 4, "name" : "Normal", "is_default" : True } ] })
+        if path == "/trackers.json":
+            return (200, { "trackers" : [ { "id" : 1, "name" : "Bug" } ] })
+        return (404, { "errors" : [ "Not found" ] })
+
+class RedmineStub(StubServer):
+    name = "redmine"
+
+    def make_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RedmineHandler)
+        server.stub = self
+        return server
+
+    def config(self):
+        return ("Redmine", { "base_url" : "http://127.0.0.1:%d" % self.port(), "api_token" : "benchmark",
+                             "project_id" : "benchmark", "username" : USERS[1] })
+
+# Github (the v2 API which the github backend speaks)
+
+def github_time(d):
+    return d.strftime("%Y/%m/%d %H:%M:%S -0000")
+
+def github_issue(issue):
+    return { "number" : issue["id"], "title" : issue["title"], "body" : issue["body"], "user" : issue["creator"],
+             "comments" : len(issue["comments"]), "state" : "open" if issue["open"] else "closed", "labels" : issue["tags"],
+             "created_at" : github_time(issue["created"]), "updated_at" : github_time(issue["modified"]) }
+
+def github_comment(c):
+    return { "user" : c["author"], "body" : c["body"], "created_at" : github_time(c["date"]) }
+
+class GithubHandler(JsonHandler):
+    prefix = "/api/v2/json/"
+
+    def route(self, method, path, query, raw):
+        data = self.data()
+        if not path.startswith(self.prefix):
+            return (404, { "error" : "Not found" })
+        parts = path[len(self.prefix):].split("/")
+        params = dict([(k, v[0]) for (k, v) in query.items()])
+        if parts[0] == "user":
+            return (200, { "user" : { "login" : parts[-1] } })
+        if parts[0] == "repos":
+            return (200, { "repository" : { "name" : parts[-1] } })
+        if parts[0] != "issues" or len(parts) < 4:
+            return (404, { "error" : "Not found" })
+        action, rest = parts[1], parts[4:]
+        if action == "list":
+            if rest and rest[0] == "label":
+                issues = [ data.issue(n) for n in data.ids() ]
+                return (200, { "issues" : [ github_issue(i) for i in issues if rest[1] in i["tags"] ] })
+            ids = data.ids(rest[0] == "open")
+            return (200, { "issues" : [ github_issue(data.issue(n)) for n in ids ] })
+        if action == "open":
+            n = data.add_issue(params.get("title", ""), params.get("body", ""), USERS[1])
+            return (200, { "issue" : github_issue(data.issue(n)) })
+        if action == "label":
+            op, tag, n = parts[2], parts[5], int(parts[6])
+            if not data.exists(n):
+                return (404, { "error" : "Not found" })
+            tags = [t for t in data.issue(n)["tags"] if t != tag]
+            if op == "add":
+                tags.append(tag)
+            data.change(n, tags=tags)
+            return (200, { "labels" : tags })
+        n = int(rest[0])
+        if not data.exists(n):
+            return (404, { "error" : "Not found" })
+        if action == "show":
+            return (200, { "issue" : github_issue(data.issue(n)) })
+        if action == "comments":
+            return (200, { "comments" : [ github_comment(c) for c in data.issue(n)["comments"] ] })
+        if action == "comment":
+            data.add_comment(n, USERS[1], params.get("comment", ""))
+            return (200, { "comment" : github_comment(data.issue(n)["comments"][-1]) })
+        if action in ("close", "reopen"):
+            data.change(n, open=(action == "reopen"))
+            return (200, { "issue" : github_issue(data.issue(n)) })
+        return (404, { "error" : "Not found" })
+
+class GithubStub(StubServer):
+    name = "github"
+    rate_limit = 5000
+
+    def make_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), GithubHandler)
+        server.stub = self
+        return server
+
+    def config(self):
+        return ("Github", { "api_url" : "http://127.0.0.1:%d%s" % (self.port(), GithubHandler.prefix),
+                            "repo" : "benchmark", "owner" : USERS[0], "user" : USERS[1], "password" : "benchmark" })
+
+# Bitbucket (API 1.0)
+
+def bitbucket_time(d):
+    return d.strftime("%Y-%m-%d %H:%M:%S+00:00")
+
+def bitbucket_issue(issue):
+    result = { "local_id" : issue["id"], "title" : issue["title"], "content" : issue["body"],
+               "reported_by" : { "username" : issue["creator"] }, "status" : "open" if issue["open"] else "resolved",
+               "comment_count" : len(issue["comments"]),
+               "utc_created_on" : bitbucket_time(issue["created"]), "utc_last_updated" : bitbucket_time(issue["modified"]) }
+    if issue["owner"]:
+        result["responsible"] = { "username" : issue["owner"] }
+    return result
+
+def bitbucket_comment(c):
+    return { "author_info" : { "username" : c["author"] }, "content" : c["body"], "utc_created_on" : bitbucket_time(c["date"]) }
+
+class BitbucketHandler(JsonHandler):
+    MAX_LIMIT = 50
+    issues_re = re.compile(r'^/1\.0/repositories/[^/]+/[^/]+/issues/?(\d+)?/?(comments)?/?$')
+
+    def route(self, method, path, query, raw):
+        data = self.data()
+        if path.startswith("/1.0/users/"):
+            return (200, { "user" : { "username" : path.split("/")[3] } })
+        if path.startswith("/1.0/privileges/"):
+            return (200, [ { "privilege" : "write", "user" : { "username" : u, "display_name" : u.capitalize() } } for u in USERS[1:] ])
+        m = self.issues_re.match(path)
+        if m is None:
+            if path.startswith("/1.0/repositories/"):
+                return (200, { "repository" : { "slug" : path.split("/")[4] } })
+            return (404, { "error" : "Not found" })
+        fields = form_or_json(raw)
+        if m.group(1) is None:
+            if method == "POST":
+                n = data.add_issue(fields.get("title", ""), fields.get("content", ""), USERS[1])
+                return (200, bitbucket_issue(data.issue(n)))
+            statuses = query.get("status", [])
+            ids = data.ids()
+            if statuses:
+                ids = data.ids(("new" in statuses) or ("open" in statuses))
+            start = int(first(query, "start", 0))
+            limit = min(int(first(query, "limit", 15)), self.MAX_LIMIT)
+            return (200, { "count" : len(ids), "issues" : [ bitbucket_issue(data.issue(n)) for n in ids[start:start + limit] ] })
+        n = int(m.group(1))
+        if not data.exists(n):
+            return (404, { "error" : "Not found" })
+        if m.group(2):
+            if method == "POST":
+                data.add_comment(n, USERS[1], fields.get("content", ""))
+                return (200, bitbucket_comment(data.issue(n)["comments"][-1]))
+            return (200, [ bitbucket_comment(c) for c in data.issue(n)["comments"] ])
+        if method == "PUT":
+            if "status" in fields:
+                data.change(n, open=fields["status"] in ("new", "open"))
+            if "responsible" in fields:
+                data.change(n, owner=fields["responsible"])
+        return (200, bitbucket_issue(data.issue(n)))
+
+class BitbucketStub(StubServer):
+    name = "bitbucket"
+
+    def make_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BitbucketHandler)
+        server.stub = self
+        return server
+
+    def config(self):
+        return ("Bitbucket", { "api_url" : "http://127.0.0.1:%d/{version}" % self.port(),
+                               "repo" : "benchmark", "owner" : USERS[0], "user" : USERS[1], "password" : "benchmark" })
+
+# Trac (the XmlRpcPlugin API)
+
+class TracRequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/trac/login/xmlrpc",)
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        response = SimpleXMLRPCServer._marshaled_dispatch(self, data, dispatch_method, path)
+        self.stub.throttle.reply(len(response))
+        return response
+
+class TracTicketApi(object):
+    """The ticket.* methods. Trac returns at most 100 tickets from a query unless told max=N (0 for all)."""
+    DEFAULT_MAX = 100
+
+    def __init__(self, data):
+        self.data = data
+
+    def query(self, qstr="status!=closed"):
+        ids = None
+        limit = self.DEFAULT_MAX
+        for clause in qstr.split("&"):
+            if clause == "status!=closed":
+                ids = self.data.ids(True)
+            elif clause == "status=closed":
+                ids = self.data.ids(False)
+            elif clause.startswith("max="):
+                limit = int(clause[4:])
+            elif clause.startswith("id="):
+                ids = [int(n) for n in clause[3:].split("|") if self.data.exists(int(n))]
+        if ids is None:
+            ids = self.data.ids()
+        if limit:
+            ids = ids[0:limit]
+        return ids
+
+    def get(self, n):
+        n = int(n)
+        if not self.data.exists(n):
+            raise xmlrpc.client.Fault(404, "Ticket %d does not exist." % n)
+        return self.__ticket(n)
+
+    def changeLog(self, n):
+        issue = self.data.issue(int(n))
+        return [ [c["date"], c["author"], "comment", str(k + 1), c["body"], 1] for (k, c) in enumerate(issue["comments"]) ]
+
+    def getActions(self, n):
+        return [ ["leave", "leave", "", []], ["resolve", "resolve", "", []], ["reassign", "reassign", "", []] ]
+
+    def update(self, n, comment, attributes, notify=False):
+        n = int(n)
+        if not self.data.exists(n):
+            raise xmlrpc.client.Fault(404, "Ticket %d does not exist." % n)
+        if comment:
+            self.data.add_comment(n, USERS[1], comment)
+        if attributes.get("action") == "resolve":
+            self.data.change(n, open=False)
+        if attributes.get("action") == "reopen":
+            if self.data.issue(n)["open"]:
+                raise xmlrpc.client.Fault(1, "Ticket %d: invalid action 'reopen'." % n)
+            self.data.change(n, open=True)
+        if "owner" in attributes:
+            self.data.change(n, owner=attributes["owner"])
+        return self.__ticket(n)
+
+    def create(self, summary, description, attributes={}, notify=False):
+        return self.data.add_issue(summary, description, USERS[1])
+
+    def getRecentChanges(self, since):
+        return self.data.ids()
+
+    def __ticket(self, n):
+        issue = self.data.issue(n)
+        attrs = { "summary" : issue["title"], "description" : issue["body"], "reporter" : issue["creator"],
+                  "owner" : issue["owner"] or "somebody", "status" : "new" if issue["open"] else "closed",
+                  "keywords" : " ".join(issue["tags"]) }
+        return [n, issue["created"], issue["modified"], attrs]
+
+class TracStub(StubServer):
+    name = "trac"
+
+    def make_server(self):
+        server = ThreadingXMLRPCServer(("127.0.0.1", 0), requestHandler=TracRequestHandler, logRequests=False, allow_none=True)
+        server.stub = self
+        server.register_instance(TracApi(self.data))
+        server.register_multicall_functions()
+        return server
+
+    def config(self):
+        return ("Trac", { "server" : "127.0.0.1:%d" % self.port(), "path" : "trac", "user" : USERS[1], "password" : "benchmark", "use_https" : "false" })
+
+class TracApi(object):
+    def __init__(self, data):
+        self.ticket = TracTicketApi(data)
+
+    def _dispatch(self, method, params):
+        obj = self
+        for part in method.split("."):
+            if part.startswith("_"):
+                raise xmlrpc.client.Fault(1, "No such method: " + method)
+            obj = getattr(obj, part, None)
+            if obj is None:
+                raise xmlrpc.client.Fault(1, "No such method: " + method)
+        return obj(*params)
+
+STUBS = { "redmine" : RedmineStub,
+          "trac" : TracStub,
+          "github" : GithubStub,
+          "bitbucket" : BitbucketStub,
+          }
@@ -4,14 +4,27 @@ _status_mapping = {"open" : True,
                    "false" : False
                    }
 
+_status_loader = None
+
 def set_status_mapping(d):
-    global _status_mapping
-    _status_mapping = {}
+    global _status_mapping, _status_loader
+    mapping = {}
     for k in list(d.keys()):
-        _status_mapping[k.lower()] = d[k]
+        mapping[k.lower()] = d[k]
+    _status_mapping, _status_loader = mapping, None
+
+def set_status_loader(loader):
+    """Have the status mapping come from loader() the first time it is needed.
+
+    Backends whose statuses come from the server use this, so that commands
+    which never look at a status never ask for them."""
+    global _status_loader
+    _status_loader = loader
 
 def get_status_mapping():
-    global _status_mapping
+    global _status_mapping, _status_loader
+    if _status_loader is not None:
+        set_status_mapping(_status_loader())
     return _status_mapping
 
 class User(object):
@@ -73,22 +86,24 @@ class Backend(object):
         print("Initializing " + self.name + " project.")
         import idli.config as cfg
 
-        if(self.args.no_verify):
-            cfg.set_config_value(section_name, 'verify_ssl', "False", global_val=False)
+        with cfg.batch():
+            if(self.args.no_verify):
+                cfg.set_config_value(section_name, 'verify_ssl', "False", global_val=False)
 
-        for (name, help) in self.init_names:
-            cfg.set_config_value(section_name, name, self.args.__dict__[name], global_val=False)
+            for (name, help) in self.init_names:
+                cfg.set_config_value(section_name, name, self.args.__dict__[name], global_val=False)
 
-        cfg.set_config_value("project", "type", self.name, global_val=False)
+            cfg.set_config_value("project", "type", self.name, global_val=False)
         print("Wrote configuration to " + cfg.local_config_filename())
 
     def configure(self):
         section_name = self.config_section or self.name
         print("Configuring backend  " + self.name)
         import idli.config as cfg
-        for (name,help) in self.config_names:
-            cfg.set_config_value(section_name, name, self.args.__dict__[name], global_val=not self.args.local_only)
-        cfg.set_config_value("project", "type", self.name, global_val=not self.args.local_only)
+        with cfg.batch():
+            for (name,help) in self.config_names:
+                cfg.set_config_value(section_name, name, self.args.__dict__[name], global_val=not self.args.local_only)
+            cfg.set_config_value("project", "type", self.name, global_val=not self.args.local_only)
         if (not self.args.local_only):
             print("Wrote configuration to " + cfg.global_config_filename())
         else:
@@ -103,17 +118,83 @@ class Backend(object):
     def issue_list(self, state=True):
         raise IdliNotImplementedException("issue_list is not implemented by this backend.")
 
-    def filtered_issue_list(self, state=True, mine=False, tag=None):
+    def iter_issues(self, state=True, limit=None, filters=None):
+        """Yield issues one at a time, stopping after `limit` of them.
+
+        Backends which page through results should override this to fetch
+        pages lazily, so that a small limit costs a small download. `filters`
+        is whatever this backend's plan_query() returned."""
         issues = self.issue_list(state)
-        if mine:
-            issues = [i for i in issues if i.owner == self.username()]
-        if tag:
-            issues = [i for i in issues if tag in i.tags]
+        if limit is not None:
+            issues = issues[0:limit]
+        for i in issues:
+            yield i
+
+    def issues_since(self, since=None):
+        """Return open and closed issues modified since the datetime `since` (all issues if None).
+
+        Backends whose servers can filter by modification time should override this."""
+        issues = self.issue_list(True) + self.issue_list(False)
+        if since is not None:
+            issues = [i for i in issues if (i.last_modified is None) or (i.last_modified >= since)]
         return issues
 
+    def issue_ids(self):
+        """Return the ids of every issue on the server, open or closed.
+
+        idli sync uses this to find deleted issues. Backends which can list ids
+        without fetching whole issues should override it."""
+        raise IdliNotImplementedException("issue_ids is not implemented by this backend.")
+
+    def filtered_issue_list(self, state=True, mine=False, tag=None):
+        import idli.query
+        return list(self.query_issues(state, idli.query.from_flags(mine, tag)))
+
+    def plan_query(self, query):
+        """Split an idli.query.Query into (filters, remainder).
+
+        `filters` is passed to iter_issues for the server to apply, and the
+        remainder is evaluated locally. Backends whose servers can filter
+        should override this; by default everything is done locally."""
+        return (None, query)
+
+    def query_issues(self, state=True, query=None, limit=None):
+        """Yield up to `limit` issues matching `query`, letting the server filter where it can.
+
+        `state` may be True or False, or "open" or "closed" as given on the command line;
+        iter_issues is always given True or False."""
+        import idli.query
+        state = state in (True, "open")
+        filters, remainder = self.plan_query(query or idli.query.Query())
+        if not remainder:
+            for i in self.iter_issues(state, limit=limit, filters=filters):
+                yield i
+            return
+        username = None
+        if "me" in [c.value for c in remainder.conditions]:
+            username = self.username()
+        count = 0
+        for i in self.iter_issues(state, filters=filters):
+            if (limit is not None) and (count >= limit):
+                return
+            if remainder.matches(i, username):
+                count += 1
+                yield i
+
     def get_issue(self, issue_id):
         raise IdliNotImplementedException("get_issue is not implemented by this backend.")
 
+    def check_issue_exists(self, issue_id):
+        """Raise an IdliException unless the issue exists.
+
+        Used before opening an editor, so that the user does not write a comment
+        for nothing. Backends should override this with something cheaper than
+        get_issue, such as a HEAD request."""
+        self.get_issue(issue_id)
+
+    # resolve_issue, add_comment, tag_issue and assign_issue return (issue, comments)
+    # when the server's reply describes the updated issue, and None otherwise. Callers
+    # which need the new state fetch it with get_issue only in the latter case.
     def resolve_issue(self, issue_id, status = "closed", message = None):
         raise IdliNotImplementedException("resolve_issue resolve_issue is not implemented by this backend.")
 
@@ -123,9 +204,32 @@ class Backend(object):
     def assign_issue(self, issue_id, user, message):
         raise IdliNotImplementedException("assign_issue is not implemented by this backend.")
 
+    def bulk_update(self, issue_ids, op):
+        """Apply one operation to every issue in issue_ids with a single request.
+
+        `op` is an operation as read by `idli batch`, without its id. Backends whose
+        servers have a bulk endpoint override this; when it raises
+        IdliNotImplementedException the issues are changed one at a time instead."""
+        raise IdliNotImplementedException("bulk_update is not implemented by this backend.")
+
     def username(self):
         raise IdliNotImplementedException("username is not implemented by this backend.")
 
+    def users_list(self):
+        raise IdliNotImplementedException("users_list is not implemented by this backend.")
+
+    def search_users(self, text):
+        """Return the users whose login, mail or name contain `text`, searched for on the server.
+
+        Backends which can do this should override it, so that looking up
+        one user does not download all of them."""
+        raise IdliNotImplementedException("search_users is not implemented by this backend.")
+
+    def find_user(self, text):
+        """Return the one user `text` names, by id, mail, login, name or a unique partial match."""
+        import idli.users
+        return idli.users.directory(self).find(text)
+
     def verify_ssl(self):
         try:
             if self._verify_ssl is not None:
@@ -146,10 +250,71 @@ class Backend(object):
         return self._verify_ssl
 
 
+    def async_backend(self):
+        """Return an idli.AsyncBackend for this backend.
+
+        By default every call is run in an executor; backends with a native
+        asyncio implementation override this."""
+        import idli.aio
+        return idli.aio.ExecutorAsyncBackend(self)
+
+    def metadata(self):
+        """The idli.metadata.MetadataCache of this project, for statuses, priorities and the like."""
+        import idli.metadata
+        if getattr(self, "_metadata", None) is None:
+            self._metadata = idli.metadata.MetadataCache(self.config_section or self.name)
+        return self._metadata
+
+    # Values used by the configuration section when the files do not set them.
+    config_defaults = {}
+
+    @property
+    def settings(self):
+        """This backend's section of the configuration, read as attributes, e.g. self.settings.repo."""
+        import idli.config as cfg
+        return cfg.section(self.config_section or self.name, self.config_defaults)
+
     #Utilities
-    def get_config(self, name):
+    def get_config(self, name, default=None):
         import idli.config as cfg
-        return cfg.get_config_value(self.config_section, name)
+        try:
+            return cfg.get_config_value(self.config_section, name)
+        except cfg.IdliMissingConfigException:
+            if default is None:
+                raise
+            return default
+
+class AsyncBackend(object):
+    """Asynchronous counterpart of Backend: the same operations, as coroutines.
+
+    Native implementations wrap the synchronous backend they were built from
+    (self.backend) for configuration. See idli.aio for adapters."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def issue_list(self, state=True):
+        raise IdliNotImplementedException("issue_list is not implemented by this backend.")
+
+    async def get_issue(self, issue_id):
+        raise IdliNotImplementedException("get_issue is not implemented by this backend.")
+
+    async def add_issue(self, title, body, tags=[]):
+        raise IdliNotImplementedException("add_issue is not implemented by this backend.")
+
+    async def add_comment(self, issue_id, body):
+        raise IdliNotImplementedException("add_comment is not implemented by this backend.")
+
+    async def resolve_issue(self, issue_id, status = "closed", message = None):
+        raise IdliNotImplementedException("resolve_issue is not implemented by this backend.")
+
+    async def tag_issue(self, issue_id, add_tags, remove_tags=False):
+        raise IdliNotImplementedException("tag_issue is not implemented by this backend.")
+
+    async def assign_issue(self, issue_id, user, message):
+        raise IdliNotImplementedException("assign_issue is not implemented by this backend.")
+
+    async def aclose(self):
+        pass
 
 class IdliException(Exception):
     def __init__(self, value):
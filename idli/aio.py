@@ -0,0 +1,37 @@
+import asyncio
+import functools
+
+import idli
+
+class ExecutorAsyncBackend(idli.AsyncBackend):
+    """Presents a synchronous backend as an AsyncBackend by running each call in an executor.
+
+    Used for backends without a native asyncio implementation, such as trac."""
+    def __init__(self, backend, executor=None):
+        idli.AsyncBackend.__init__(self, backend)
+        self.executor = executor
+
+    async def __run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def issue_list(self, state=True):
+        return await self.__run(self.backend.issue_list, state)
+
+    async def get_issue(self, issue_id):
+        return await self.__run(self.backend.get_issue, issue_id)
+
+    async def add_issue(self, title, body, tags=[]):
+        return await self.__run(self.backend.add_issue, title, body, tags=tags)
+
+    async def add_comment(self, issue_id, body):
+        return await self.__run(self.backend.add_comment, issue_id, body)
+
+    async def resolve_issue(self, issue_id, status = "closed", message = None):
+        return await self.__run(self.backend.resolve_issue, issue_id, status=status, message=message)
+
+    async def tag_issue(self, issue_id, add_tags, remove_tags=False):
+        return await self.__run(self.backend.tag_issue, issue_id, add_tags, remove_tags)
+
+    async def assign_issue(self, issue_id, user, message):
+        return await self.__run(self.backend.assign_issue, issue_id, user, message)
@@ -0,0 +1,211 @@
+"""Moving whole projects between backends: `idli export` and `idli import`.
+
+An archive is JSON lines. The first line describes the archive, and every
+other line is one issue, as `idli show --format jsonl` prints it: fields,
+body and comments. Archives whose names end in .zst are compressed with
+zstandard (an optional dependency).
+
+Export streams issues from the backend to the archive, and import streams
+them from the archive to the backend, so neither holds the project in memory.
+Import records its progress in two files next to the archive: the ID map
+(tab separated old and new IDs, one line per issue created) and a checkpoint
+of the steps done for each issue, so an interrupted import resumes where it
+stopped."""
+import io
+import os
+import sys
+import json
+import datetime
+import threading
+
+import idli
+import idli.output
+import idli.concurrency
+
+ARCHIVE_FORMAT = "idli-export"
+ARCHIVE_VERSION = 1
+
+def open_archive(filename, mode):
+    """A text stream reading ("r") or writing ("w") the archive filename; "-" is stdin or stdout."""
+    if filename == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    try:
+        if filename.endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                raise idli.IdliException("Archives ending in .zst need the zstandard module. Install it, or use a name without .zst.")
+            raw = open(filename, mode + "b")
+            if mode == "r":
+                return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding="utf-8")
+            return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding="utf-8")
+        return open(filename, mode, encoding="utf-8")
+    except IOError as e:
+        raise idli.IdliException("Could not open " + filename + ": " + str(e))
+
+def export_issues(backend, out, states=(True, False), workers=idli.concurrency.DEFAULT_WORKERS):
+    """Write the issues of backend in the given states to the archive stream out.
+
+    Each issue is fetched with its comments, `workers` at a time. Returns (issues, comments) written."""
+    header = { "format" : ARCHIVE_FORMAT, "version" : ARCHIVE_VERSION, "backend" : backend.name,
+               "exported" : datetime.datetime.utcnow().replace(microsecond=0).isoformat() }
+    writer = idli.output.Writer(out)
+    writer.line(json.dumps(header))
+    def issues():
+        for state in states:
+            for i in backend.iter_issues(state):
+                yield i.id
+    (num_issues, num_comments) = (0, 0)
+    for (issue, comments) in idli.concurrency.bounded_map(backend.get_issue, issues(), workers):
+        writer.line(idli.output.dumps(idli.output.issue_record(issue, comments)))
+        num_issues += 1
+        num_comments += len(comments)
+    writer.flush()
+    return (num_issues, num_comments)
+
+def read_archive(stream):
+    """Check the first line of an archive, returning an iterator over its issue records."""
+    try:
+        header = json.loads(stream.readline())
+    except ValueError:
+        header = None
+    if not (isinstance(header, dict) and header.get("format") == ARCHIVE_FORMAT):
+        raise idli.IdliException("This is not an idli export archive.")
+    if header.get("version", 0) > ARCHIVE_VERSION:
+        raise idli.IdliException("The archive was written by a newer idli (version " + str(header["version"]) + ").")
+    def records():
+        for n, line in enumerate(stream, 2):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise idli.IdliException("Line " + str(n) + " of the archive is not valid JSON: " + str(e))
+    return records()
+
+class ImportProgress(object):
+    """The ID map and checkpoint of one import, appended to as issues are created and changed."""
+    def __init__(self, map_filename, checkpoint_filename):
+        self.map_filename = map_filename
+        self.checkpoint_filename = checkpoint_filename
+        self.new_ids = {}
+        self.done = {}
+        if os.path.exists(map_filename):
+            with open(map_filename) as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if line.endswith("\n") and (len(parts) == 2): # Not a line cut short, whose new ID may be too
+                        self.new_ids[parts[0]] = parts[1]
+        if os.path.exists(checkpoint_filename):
+            with open(checkpoint_filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.done[entry["id"]] = max(self.done.get(entry["id"], 0), entry["done"])
+                    except (ValueError, KeyError, TypeError): # A line cut short by the interruption
+                        pass
+        self.__map = self.__append(map_filename)
+        self.__checkpoint = self.__append(checkpoint_filename)
+        self.__lock = threading.Lock()
+
+    def __append(self, filename):
+        # Open filename for appending, ending a line cut short so that it is not joined to the next.
+        f = open(filename, "a+")
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+        return f
+
+    def created(self, old_id, new_id):
+        with self.__lock:
+            self.new_ids[old_id] = new_id
+            self.__map.write(old_id + "\t" + new_id + "\n")
+            self.__map.flush()
+
+    def step_done(self, old_id, steps):
+        """Record that the first `steps` steps of importing old_id are done."""
+        with self.__lock:
+            self.done[old_id] = steps
+            self.__checkpoint.write(json.dumps({ "id" : old_id, "done" : steps }) + "\n")
+            self.__checkpoint.flush()
+
+    def close(self):
+        self.__map.close()
+        self.__checkpoint.close()
+
+def import_steps(record):
+    """The changes which recreate an archived issue, in order, as (kind, argument) pairs."""
+    steps = [ ("create", None) ]
+    if record.get("tags"):
+        steps.append(("tag", record["tags"]))
+    for c in record.get("comments") or []:
+        steps.append(("comment", c))
+    if record.get("owner"):
+        steps.append(("assign", record["owner"]))
+    if record.get("state") == "closed":
+        steps.append(("resolve", None))
+    return steps
+
+def import_issues(backend, records, progress, workers=idli.concurrency.DEFAULT_WORKERS):
+    """Recreate archived issues in backend, `workers` issues at a time, yielding a result dict per issue.
+
+    Issue creation, comments and resolution must succeed; an issue whose step fails is
+    reported as an error and picked up at that step by the next run. Tags and owners are
+    best effort, since the new backend may not support them or know the user."""
+    warned = set()
+    def import_one(record):
+        old_id = str(record["id"])
+        result = { "id" : old_id, "warnings" : [] }
+        steps = import_steps(record)
+        done = progress.done.get(old_id, 0)
+        new_id = progress.new_ids.get(old_id)
+        if new_id is None: # Not created yet, whatever the checkpoint says
+            done = 0
+        else: # Created, though perhaps interrupted before the checkpoint said so
+            done = max(done, 1)
+        if done >= len(steps):
+            result.update(status="skipped", new_id=new_id)
+            return result
+        try:
+            for n in range(done, len(steps)):
+                (kind, argument) = steps[n]
+                try:
+                    if kind == "create":
+                        issue, comments = backend.add_issue(record["title"], imported_body(record))
+                        new_id = issue.id
+                        progress.created(old_id, new_id)
+                    elif kind == "tag":
+                        backend.tag_issue(new_id, argument)
+                    elif kind == "comment":
+                        backend.add_comment(new_id, imported_comment(argument))
+                    elif kind == "assign":
+                        backend.assign_issue(new_id, argument, "")
+                    elif kind == "resolve":
+                        backend.resolve_issue(new_id, status="closed", message="Closed in the project this issue was imported from.")
+                except idli.IdliException as e:
+                    if not (kind in ("tag", "assign")):
+                        raise
+                    message = kind + " skipped: " + str(e.value)
+                    if isinstance(e, idli.IdliNotImplementedException): # The same for every issue, so say it once
+                        if message in warned:
+                            message = None
+                        else:
+                            warned.add(message)
+                    if message:
+                        result["warnings"].append(message)
+                progress.step_done(old_id, n + 1)
+            result["status"] = "ok"
+        except Exception as e: # One failed issue must not stop the rest of the import
+            result["status"] = "error"
+            result["error"] = str(e.value) if isinstance(e, idli.IdliException) else str(e)
+        result["new_id"] = new_id
+        return result
+    for result in idli.concurrency.bounded_map(import_one, records, workers):
+        yield result
+
+def imported_body(record):
+    return (record.get("body") or "") + "\n\n(Imported from issue " + str(record["id"]) + ", opened by " + str(record.get("creator")) + " on " + str(record.get("created")) + ".)"
+
+def imported_comment(comment):
+    return "On " + str(comment.get("date")) + ", " + str(comment.get("creator")) + " wrote:\n\n" + (comment.get("body") or "")
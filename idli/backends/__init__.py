@@ -1,22 +1,82 @@
-from . import github
-from . import trac
-from . import redmine
-from . import bitbucket
 import sys
+import importlib
 import idli.config as cfg
+import idli.backends.names as names
 from idli.commands import configure_subparser, init_subparser
 
+ENTRY_POINT_GROUP = "idli.backends"
+
+class BackendSpec(object):
+    """Everything idli needs to know about a backend without importing it.
+
+    `path` is "module:ClassName". The module is only imported when the backend
+    is actually used, by load(). `init_names` and `config_names` default to
+    those of the backend class, which are only needed by idli init and idli config."""
+    def __init__(self, name, path, init_names=None, config_names=None):
+        self.name = name
+        self.path = path
+        self.__init_names = init_names
+        self.__config_names = config_names
+        self.__backend = None
+
+    def load(self):
+        if self.__backend is None:
+            module_name, class_name = self.path.split(":")
+            self.__backend = getattr(importlib.import_module(module_name), class_name)
+        return self.__backend
+
+    @property
+    def init_names(self):
+        if self.__init_names is None:
+            return self.load().init_names
+        return self.__init_names
+
+    @property
+    def config_names(self):
+        if self.__config_names is None:
+            return self.load().config_names
+        return self.__config_names
+
+    @classmethod
+    def from_backend(cls, backend):
+        spec = cls(backend.name, backend.__module__ + ":" + backend.__name__, backend.init_names, backend.config_names)
+        spec.__backend = backend
+        return spec
+
+builtin_backends = {
+    "github" : BackendSpec("github", "idli.backends.github:GithubBackend", names.github_init_names, names.github_config_names),
+    "trac" : BackendSpec("trac", "idli.backends.trac:TracBackend", names.trac_init_names, names.trac_config_names),
+    "redmine" : BackendSpec("redmine", "idli.backends.redmine:RedmineBackend", names.redmine_init_names, names.redmine_config_names),
+    "bitbucket" : BackendSpec("bitbucket", "idli.backends.bitbucket:BitbucketBackend", names.bitbucket_init_names, names.bitbucket_config_names),
+    }
+
 backend_list = { }
+__unconfigured_parsers = { } # Backend name to its (config parser, init parser), still without arguments
 
 def register_backend(backend):
-    #We must add parser options for each of init_names
+    """Register a backend, given either a BackendSpec or an idli.Backend subclass."""
+    if not isinstance(backend, BackendSpec):
+        backend = BackendSpec.from_backend(backend)
+    if backend.name in backend_list:
+        return
     config_parser = configure_subparser.add_parser(backend.name, help="Configure " + backend.name + " backend.")
-    __add_items_to_parser(backend.config_names, config_parser)
     init_parser = init_subparser.add_parser(backend.name, help="Configure " + backend.name + " backend.")
-    __add_items_to_parser(backend.init_names, init_parser)
-
+    __unconfigured_parsers[backend.name] = (config_parser, init_parser)
     backend_list[backend.name] = backend
 
+def add_backend_arguments():
+    """Add the arguments of idli init and idli config for every backend, plugins included.
+    This may import every backend, so only those two commands do it."""
+    register_plugin_backends()
+    #We must add parser options for each of init_names
+    for (name, (config_parser, init_parser)) in list(__unconfigured_parsers.items()):
+        try:
+            __add_items_to_parser(backend_list[name].config_names, config_parser)
+            __add_items_to_parser(backend_list[name].init_names, init_parser)
+        except Exception as e:
+            print("Could not load idli backend '" + name + "': " + str(e))
+        del __unconfigured_parsers[name]
+
 def __add_items_to_parser(items, parser):
     if items.__class__ == dict:
         for (cmd, help) in items.items():
@@ -25,22 +85,42 @@ def __add_items_to_parser(items, parser):
         for (cmd, help) in items:
             parser.add_argument(cmd, help=help)
 
+__plugins_loaded = False
+
+def register_plugin_backends():
+    """Register third party backends advertised under the 'idli.backends' entry point group.
+
+    An entry point may name either a BackendSpec (cheap to import) or an
+    idli.Backend subclass. Scanning installed packages is not free, so this
+    only happens when a command needs to know about every backend."""
+    global __plugins_loaded
+    if __plugins_loaded:
+        return
+    __plugins_loaded = True
+    from importlib.metadata import entry_points
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        if ep.name in backend_list:
+            continue
+        try:
+            register_backend(ep.load())
+        except Exception as e:
+            print("Could not load idli backend '" + ep.name + "' from " + ep.value + ": " + str(e))
 
 def get_backend_or_fail(backend_name = None):
     try:
         backend_name = backend_name or cfg.get_config_value("project", "type").lower()
-        return backend_list[backend_name]
-    except cfg.IdliMissingConfigException as e:
+        if not (backend_name in backend_list):
+            register_plugin_backends()
+        return backend_list[backend_name].load()
+    except cfg.IdliMissingConfigException:
         print("Could not find idli configuration file. Run 'idli init' in the project root directory.")
         sys.exit(0)
-    except KeyError as e:
+    except KeyError:
         print("No such backend '" + cfg.get_config_value("project", "type") + ". Check the configuration file " + cfg.local_config_filename() + " for errors.")
         sys.exit(0)
     except Exception as e:
         print("Failed: " + str(e))
         sys.exit(0)
 
-register_backend(github.GithubBackend)
-register_backend(trac.TracBackend)
-register_backend(redmine.RedmineBackend)
-register_backend(bitbucket.BitbucketBackend)
+for spec in builtin_backends.values():
+    register_backend(spec)
@@ -1,15 +1,16 @@
-import datetime
-import json
 import logging
-import urllib.request, urllib.parse, urllib.error
-
-import requests
 
 import idli
+import idli.query
+import idli.concurrency
+import idli.trace
+import idli.decode
 import idli.config as cfg
+import idli.backends.names as names
+from idli.decode import parse_date
+from idli.transport import get_transport, get_async_transport, HttpRequestException
 
 bitbucket_base_api_url = "https://api.bitbucket.org/{version}"
-dateformat = "%Y-%m-%d %H:%M:%S"
 bitbucket_status_mapping = {
     'new': True,
     'open': True,
@@ -23,8 +24,8 @@ bitbucket_status_mapping = {
 bitbucket_status_reverse_mapping = {
     True: ['new', 'open'],
     'open': ['new', 'open'],
-    False: ['resovled', 'on hold', 'invalid', 'duplicate', 'wontfix', 'closed'],
-    'closed': ['resovled', 'on hold', 'invalid', 'duplicate', 'wontfix', 'closed']
+    False: ['resolved', 'on hold', 'invalid', 'duplicate', 'wontfix', 'closed'],
+    'closed': ['resolved', 'on hold', 'invalid', 'duplicate', 'wontfix', 'closed']
 }
 
 idli_has_logging = not not logging.getLogger('idli').handlers
@@ -37,15 +38,6 @@ if not idli_has_logging:
     logger.addHandler(handler)
     logger.warn('No global logging detected, using local settings')
 
-class HttpRequestException(Exception):
-    def __init__(self, value, status_code):
-        super(HttpRequestException, self).__init__(value)
-        self.value = value
-        self.status_code = status_code
-
-    def __str__(self):
-        return "HttpError: " + str(self.status_code) + ", " + str(self.value)
-
 def catch_url_error(func):
     def wrapped_func(*args, **kwargs):
         try:
@@ -77,12 +69,9 @@ def catch_missing_config(func):
 class BitbucketBackend(idli.Backend):
     name = "bitbucket"
     config_section = "Bitbucket"
-    init_names = [ ("repo", "Name of repository"),
-                   ("owner", "Owner of repository (Bitbucket username).")
-                   ]
-    config_names = [ ("user", "Bitbucket username"),
-                     ("password", "Bitbucket password"),
-                     ]
+    init_names = names.bitbucket_init_names
+    config_names = names.bitbucket_config_names
+    config_defaults = { "api_url" : bitbucket_base_api_url }
 
     def __init__(self, args, repo=None, auth=None):
         logger.debug("__init__ args:%s repo:%s", args, repo)
@@ -95,19 +84,23 @@ class BitbucketBackend(idli.Backend):
             self.__user, self.__password = None, None
         else:
             self.__user, self.__password = auth
-        idli.set_status_mapping(bitbucket_status_mapping)
+        idli.set_status_loader(self.status_mapping)
+
+    # Bitbucket's statuses are fixed, and API 1.0 has no call to list them.
+    def status_mapping(self):
+        return bitbucket_status_mapping
 
     def repo(self):
-        return self.__repo or self.get_config("repo")
+        return self.__repo or self.settings.repo
 
     def repo_owner(self):
-        return self.__repo_owner or self.get_config("owner")
+        return self.__repo_owner or self.settings.owner
 
     def username(self):
-        return self.__user or self.get_config("user")
+        return self.__user or self.settings.user
 
     def password(self):
-        return self.__password or self.get_config("password")
+        return self.__password or self.settings.password
 
     def auth(self):
         if self.username() and self.password():
@@ -115,7 +108,7 @@ class BitbucketBackend(idli.Backend):
         return None
     
     def url(self, endpoint='repositories/{account_name}/{repo_slug}/issues', component=None, version='1.0', **kwargs):
-        url_elements = [bitbucket_base_api_url, endpoint]
+        url_elements = [self.settings.api_url, endpoint]
         if component:
             url_elements.append(component)
         url = '/'.join(url_elements)
@@ -130,7 +123,7 @@ class BitbucketBackend(idli.Backend):
         logging.debug('add_issue, title: %s', title)
         url = self.url()
         result = self.__url_request('post', url, {'title': title, 'content': body})
-        issue = self.__parse_issue(result)
+        issue = parse_issue(result)
         if tags:
             raise idli.IdliNotImplementedException('Tagging not supported')
         return (issue, [])
@@ -152,12 +145,65 @@ class BitbucketBackend(idli.Backend):
     @catch_HTTPError
     def issue_list(self, state=True):
         logging.debug('issue_list, state: %s', state)
+        return list(self.iter_issues(state))
+
+    def iter_issues(self, state=True, limit=None, filters=None):
+        logging.debug('iter_issues, state: %s, limit: %s, filters: %s', state, limit, filters)
+        params = {'status': bitbucket_status_reverse_mapping[state], 'limit': 50, 'start': 0}
+        params.update(filters or {})
+        count = 0
+        while True:
+            if limit is not None:
+                params['limit'] = min(50, limit - count)
+            result = self.__issue_page(params)
+            for i in result['issues']:
+                yield parse_issue(i)
+            count += len(result['issues'])
+            params['start'] += len(result['issues'])
+            if (not result['issues']) or (params['start'] >= result['count']) or ((limit is not None) and count >= limit):
+                return
+
+    def plan_query(self, query):
+        filters = {}
+        remainder = []
+        for c in query.conditions:
+            value = c.value
+            if value == "me" and c.field in ("owner", "creator"):
+                value = self.username()
+            if c.field == "owner" and c.op == "=" and not ('responsible' in filters):
+                filters['responsible'] = value
+            elif c.field == "creator" and c.op == "=" and not ('reported_by' in filters):
+                filters['reported_by'] = value
+            elif c.field == "title" and c.op == "~" and not ('title' in filters):
+                filters['title'] = "~" + value
+                remainder.append(c) # Case sensitivity may differ
+            else:
+                remainder.append(c)
+        return (filters, idli.query.Query(remainder))
+
+    # Errors raised inside a generator escape the decorators, so each page is fetched here.
+    @catch_url_error
+    @catch_HTTPError
+    def __issue_page(self, params):
+        return self.__url_request('get', self.url(), params)
+
+    @catch_url_error
+    @catch_HTTPError
+    def issues_since(self, since=None):
+        logging.debug('issues_since, since: %s', since)
         url = self.url()
-        result = self.__url_request('get', url, {'status': bitbucket_status_reverse_mapping[state]})
         issues = []
-        for i in result['issues']:
-            issues.append(self.__parse_issue(i))
-        return issues 
+        params = {'sort': '-utc_last_updated', 'limit': 50, 'start': 0}
+        while True:
+            result = self.__url_request('get', url, params)
+            for i in result['issues']:
+                issue = parse_issue(i)
+                if (since is not None) and (issue.last_modified < since): # Sorted by update time, so we are done
+                    return issues
+                issues.append(issue)
+            params['start'] += len(result['issues'])
+            if (not result['issues']) or (params['start'] >= result['count']):
+                return issues
 
     @catch_url_error
     def get_issue(self, issue_id, get_comments=True):
@@ -165,27 +211,34 @@ class BitbucketBackend(idli.Backend):
         issue_url = self.url(component='{issue_id}', issue_id=issue_id)
         comment_url = self.url(component='{issue_id}/comments', issue_id=issue_id)
         try:
-            issue_as_json = self.__url_request('get', issue_url)
-            comments_as_json = self.__url_request('get', comment_url)
-        except urllib2.HTTPError as e:
+            if get_comments: # The issue and its comments are independent requests, so make them at once.
+                issue_as_json, comments_as_json = idli.concurrency.both(lambda: self.__url_request('get', issue_url),
+                                                                        lambda: self.__url_request('get', comment_url))
+            else:
+                issue_as_json, comments_as_json = self.__url_request('get', issue_url), []
+        except HttpRequestException as e:
+            if (e.status_code != 404):
+                raise
             self.validate()
             raise idli.IdliException("Could not find issue with id '" + issue_id + "'")
 
-        issue = self.__parse_issue(issue_as_json)
+        issue = parse_issue(issue_as_json)
         comments = []
         for c in comments_as_json:
-            comments.append(self.__parse_comment(issue, c))
+            comments.append(parse_comment(issue, c))
         return (issue, comments)
 
+    def check_issue_exists(self, issue_id):
+        self.get_issue(issue_id, get_comments=False)
+
     @catch_missing_config
     @catch_HTTPError
     @catch_url_error
     def add_comment(self, issue_id, body):
         logging.debug('add_comment, issue_id: %s', issue_id)
         url = self.url(component='{issue_id}/comments', issue_id=issue_id)
-        result = self.__url_request('post', url, {'content': body})
-        comment = self.__parse_comment(None, result)
-        return comment
+        self.__url_request('post', url, {'content': body})
+        return None
 
     @catch_missing_config
     @catch_url_error
@@ -195,9 +248,36 @@ class BitbucketBackend(idli.Backend):
         if message:
             self.add_comment(issue_id, message)
         url = self.url(component='{issue_id}', issue_id=issue_id)
-        response = self.__url_request('put', url, {"status": status})
-        issue = self.__parse_issue(response)
-        return issue
+        self.__url_request('put', url, {"status": status})
+        return None # The reply has the issue, but not its comments
+
+    @catch_missing_config
+    @catch_url_error
+    @catch_HTTPError
+    def assign_issue(self, issue_id, user, message):
+        logging.debug('assign_issue, issue_id: %s, user: %s', issue_id, user)
+        username = self.username() if user == "me" else self.find_user(user).shortname
+        if message:
+            self.add_comment(issue_id, message)
+        url = self.url(component='{issue_id}', issue_id=issue_id)
+        self.__url_request('put', url, {"responsible": username})
+        return None
+
+    # The users who may be assigned issues: the repository's owner, and everyone it is shared with.
+    @catch_url_error
+    @catch_HTTPError
+    def users_list(self):
+        result = self.__url_request('get', self.url(endpoint='privileges/{account_name}/{repo_slug}'))
+        users = [ parse_user(p['user']) for p in result ]
+        if not (self.repo_owner() in [u.shortname for u in users]):
+            users.append(idli.User(self.repo_owner(), "", self.repo_owner()))
+        return users
+
+    def async_backend(self):
+        try:
+            return AsyncBitbucketBackend(self)
+        except ImportError: # No httpx
+            return idli.Backend.async_backend(self)
 
     #Validation queries
     def validate(self):
@@ -208,46 +288,113 @@ class BitbucketBackend(idli.Backend):
     def __validate_user(self):
         test_url = self.url(endpoint='users', component='{account_name}')
         try:
-            result = json.loads(urllib.request.urlopen(test_url).read())
+            result = get_transport().get(test_url).json()
             return result['user']
-        except urllib.error.HTTPError as e:
+        except HttpRequestException as e:
             raise idli.IdliException("Can not find user " + self.repo_owner() + " on github.")
 
     @catch_url_error
     def __validate_repo(self):
         test_url = self.url(endpoint='repositories', component='{account_name}/{repo_slug}')
         try:
-            result = json.loads(urllib.request.urlopen(test_url).read())
+            result = get_transport().get(test_url).json()
             return result['repository']
-        except urllib.error.HTTPError as e:
+        except HttpRequestException as e:
             raise idli.IdliException("Can not find repository " + self.repo() + " on github.")
 
     #Utilities
     def __url_request(self, method, url, data=None):
         logger.debug('__url_request, method: %s, url: %s, data: %s', method, url, data)
         if method.lower() == 'get':
-            response = requests.get(url, auth=self.auth(), params=data)
+            response = get_transport().get(url, auth=self.auth(), params=data)
         else:
-            response = requests.request(method, url, auth=self.auth(), data=data)
+            response = get_transport().request(method, url, auth=self.auth(), data=data)
         logger.debug('__url_request, status_code: %s, response: %s', response.status_code, response.content)
-        if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
-            raise HttpRequestException("HTTP error", response.status_code)
-        return response.json()
+        with idli.trace.span("decode json", "decode", bytes=len(response.content)):
+            return idli.decode.loads(response.content)
 
-    def __parse_comment(self, issue, cdict):
-        return idli.IssueComment(issue, cdict["author_info"]["username"], "", cdict["content"], self.__parse_date(cdict["utc_created_on"]))
+class AsyncBitbucketBackend(idli.AsyncBackend):
+    """Native asyncio implementation of BitbucketBackend."""
+    def __init__(self, backend):
+        idli.AsyncBackend.__init__(self, backend)
+        self.transport = get_async_transport()
 
-    def __parse_issue(self, issue_dict):
-        #TODO: timezones
-        create_time = self.__parse_date(issue_dict["utc_created_on"])
-        comment_count = issue_dict.get("comment_count", 0)
-        #TODO: pseudotags for fields
-        return idli.Issue(issue_dict["title"], issue_dict["content"],
-                            issue_dict["local_id"], issue_dict["reported_by"]["username"],
-                            num_comments = comment_count, status = issue_dict["status"],
-                            create_time=create_time, tags=[])
+    async def add_issue(self, title, body, tags=[]):
+        if tags:
+            raise idli.IdliNotImplementedException('Tagging not supported')
+        result = await self.__url_request('post', self.backend.url(), {'title': title, 'content': body})
+        return (parse_issue(result), [])
 
-    def __parse_date(self, datestr):
-        return datetime.datetime.strptime(datestr[0:19], dateformat)
+    async def tag_issue(self, issue_id, tags, remove_tags=False):
+        raise idli.IdliNotImplementedException('Tagging not supported')
+
+    async def issue_list(self, state=True):
+        result = await self.__url_request('get', self.backend.url(), {'status': bitbucket_status_reverse_mapping[state]})
+        return [parse_issue(i) for i in result['issues']]
+
+    async def get_issue(self, issue_id):
+        import asyncio
+        # The issue and its comments are independent requests, so make them at once.
+        issue_as_json, comments_as_json = await asyncio.gather(
+            self.__url_request('get', self.backend.url(component='{issue_id}', issue_id=issue_id)),
+            self.__url_request('get', self.backend.url(component='{issue_id}/comments', issue_id=issue_id)))
+        issue = parse_issue(issue_as_json)
+        return (issue, [parse_comment(issue, c) for c in comments_as_json])
+
+    async def add_comment(self, issue_id, body):
+        await self.__url_request('post', self.backend.url(component='{issue_id}/comments', issue_id=issue_id), {'content': body})
+        return None
 
+    async def resolve_issue(self, issue_id, status = "closed", message = None):
+        if message:
+            await self.add_comment(issue_id, message)
+        await self.__url_request('put', self.backend.url(component='{issue_id}', issue_id=issue_id), {"status": status})
+        return None
 
+    async def assign_issue(self, issue_id, user, message):
+        if user == "me":
+            username = self.backend.username()
+        else:
+            import asyncio # The user directory is SQLite, so it is used from a thread
+            username = (await asyncio.get_running_loop().run_in_executor(None, self.backend.find_user, user)).shortname
+        if message:
+            await self.add_comment(issue_id, message)
+        await self.__url_request('put', self.backend.url(component='{issue_id}', issue_id=issue_id), {"responsible": username})
+        return None
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def __url_request(self, method, url, data=None):
+        try:
+            if method.lower() == 'get':
+                response = await self.transport.get(url, auth=self.backend.auth(), params=data)
+            else:
+                response = await self.transport.request(method, url, auth=self.backend.auth(), data=data)
+        except HttpRequestException as e:
+            if (e.status_code == 401):
+                raise idli.IdliException("Authentication failed. Check the 'user' and 'password' variables in the [Bitbucket] section of your idli configuration.\n\n" + str(e))
+            if (e.status_code == 404):
+                raise idli.IdliException("Not found on Bitbucket: " + url)
+            raise idli.IdliException("Could not connect to Bitbucket. Error: " + str(e))
+        return idli.decode.loads(response.content)
+
+def parse_comment(issue, cdict):
+    return idli.IssueComment(issue, cdict["author_info"]["username"], "", cdict["content"], parse_date(cdict["utc_created_on"]))
+
+def parse_user(udict):
+    return idli.User(udict["username"], "", udict["username"], udict.get("display_name") or udict["username"])
+
+def parse_issue(issue_dict):
+    #TODO: timezones
+    create_time = parse_date(issue_dict["utc_created_on"])
+    last_modified = parse_date(issue_dict.get("utc_last_updated") or issue_dict["utc_created_on"])
+    comment_count = issue_dict.get("comment_count", 0)
+    owner = None
+    if issue_dict.get("responsible"):
+        owner = issue_dict["responsible"]["username"]
+    #TODO: pseudotags for fields
+    return idli.Issue(issue_dict["title"], issue_dict["content"],
+                        issue_dict["local_id"], issue_dict["reported_by"]["username"],
+                        num_comments = comment_count, status = issue_dict["status"],
+                        create_time=create_time, last_modified=last_modified, owner=owner, tags=[])
@@ -1,22 +1,14 @@
-import urllib.request, urllib.parse, urllib.error
-import json
-import datetime
-import requests
-
 import idli
+import idli.query
+import idli.concurrency
+import idli.trace
+import idli.decode
 import idli.config as cfg
+import idli.backends.names as names
+from idli.decode import parse_date
+from idli.transport import get_transport, get_async_transport, HttpRequestException
 
 github_base_api_url = "http://github.com/api/v2/json/"
-dateformat = "%Y/%m/%d %H:%M:%S"
-
-class HttpRequestException(Exception):
-    def __init__(self, value, status_code):
-        super(HttpRequestException, self).__init__(value)
-        self.value = value
-        self.status_code = status_code
-
-    def __str__(self):
-        return "HttpError: " + str(self.status_code) + ", " + str(self.value)
 
 def catch_url_error(func):
     def wrapped_func(*args, **kwargs):
@@ -51,12 +43,10 @@ CONFIG_SECTION = "Github"
 class GithubBackend(idli.Backend):
     name = "github"
     config_section = "Github"
-    init_names = [ ("repo", "Name of repository"),
-                   ("owner", "Owner of repository (github username).")
-                   ]
-    config_names = [ ("user", "Github username"),
-                     ("password", "Github password"),
-                     ]
+    init_names = names.github_init_names
+    config_names = names.github_config_names
+    # api_url is overridable for stand-in servers such as the benchmark stubs.
+    config_defaults = { "api_url" : github_base_api_url }
 
     def __init__(self, args, repo=None, auth = None):
         self.args = args
@@ -70,16 +60,19 @@ class GithubBackend(idli.Backend):
             self.__user, self.__password = auth
 
     def repo(self):
-        return self.__repo or self.get_config("repo")
+        return self.__repo or self.settings.repo
+
+    def api_url(self):
+        return self.settings.api_url
 
     def repo_owner(self):
-        return self.__repo_owner or self.get_config("owner")
+        return self.__repo_owner or self.settings.owner
 
     def username(self):
-        return self.__user or self.get_config("user")
+        return self.__user or self.settings.user
 
     def password(self):
-        return self.__password or self.get_config("password")
+        return self.__password or self.settings.password
 
     def auth(self):
         if self.username() and self.password():
@@ -90,64 +83,106 @@ class GithubBackend(idli.Backend):
     @catch_url_error
     @catch_HTTPError
     def add_issue(self, title, body, tags=[]):
-        url = github_base_api_url + "issues/open/" + self.repo_owner() + "/" + self.repo()
+        url = self.api_url() + "issues/open/" + self.repo_owner() + "/" + self.repo()
         result = self.__url_request(url, title=title, body=body)
-        issue = self.__parse_issue(json.loads(result)["issue"])
-        if tags:
-            self.tag_issue(issue.id, tags)
-            issue = self.get_issue(issue.id)
+        issue = parse_issue(idli.decode.loads(result)["issue"])
+        if tags: # The label replies give the final list of labels, so there is no need to fetch the issue again
+            issue.tags = self.__apply_labels(issue.id, tags)
         return (issue, [])
 
     @catch_missing_config
     @catch_url_error
     @catch_HTTPError
     def tag_issue(self, issue_id, tags, remove_tags=False):
+        self.__apply_labels(issue_id, tags, remove_tags)
+        return None
+
+    def __apply_labels(self, issue_id, tags, remove_tags=False):
+        # Returns the issue's labels after the last change.
+        labels = None
         for t in tags:
             url = self.__add_label_url(issue_id, t, remove_tags)
-            result = json.loads(self.__url_request(url))
+            result = idli.decode.loads(self.__url_request(url))
             if (not (t in result['labels'])) and (not remove_tags):
                 raise idli.IdliException("Failed to add tag to issue " + str(issue_id) + ". The issue list may be in an inconsistent state.")
-        return self.get_issue(issue_id)
+            labels = result['labels']
+        return labels
 
     @catch_url_error
     @catch_HTTPError
     def issue_list(self, state=True):
-        url = github_base_api_url + "issues/list/" + self.repo_owner() + "/" + self.repo() + "/" + self.__state_to_gh_state(state)
-        result = self.__url_request(url)
-        issue_as_json = json.loads(result)
-        result = []
-        for i in issue_as_json["issues"]:
-            result.append(self.__parse_issue(i))
-        return result
+        url = self.api_url() + "issues/list/" + self.repo_owner() + "/" + self.repo() + "/" + self.__state_to_gh_state(state)
+        return list(self.__iter_issue_list(url))
+
+    def iter_issues(self, state=True, limit=None, filters=None):
+        if not filters:
+            issues = self.__iter_issue_list(self.issue_url("list", self.__state_to_gh_state(state)))
+        else:
+            issues = (i for i in self.__iter_issue_list(self.issue_url("list", "label", filters["label"])) if i.status == state)
+        count = 0
+        for i in issues:
+            if (limit is not None) and (count >= limit):
+                return
+            count += 1
+            yield i
+
+    # The v2 API can only filter by a single label, which returns issues of both states.
+    def plan_query(self, query):
+        for c in query.conditions:
+            if c.field == "tag" and c.op == "=":
+                return ({ "label" : c.value }, idli.query.Query([d for d in query.conditions if d is not c]))
+        return (None, query)
+
+    # The v2 API lists every issue in one reply, so the issues are decoded as it arrives.
+    def __iter_issue_list(self, url):
+        response = self.__open_issue_list(url)
+        try:
+            for i in idli.decode.ArrayStream(response.iter_content(idli.decode.CHUNK_SIZE), "issues"):
+                yield parse_issue(i)
+        finally:
+            response.close()
+
+    # Errors raised inside a generator escape the decorators, so the request is made here.
+    @catch_url_error
+    @catch_HTTPError
+    def __open_issue_list(self, url):
+        return get_transport().get(url, auth=self.auth(), stream=True)
 
     @catch_url_error
     def get_issue(self, issue_id, get_comments=True):
-        issue_url = github_base_api_url + "issues/show/" + self.repo_owner() + "/" + self.repo() + "/" + issue_id
-        comment_url = github_base_api_url + "issues/comments/" + self.repo_owner() + "/" + self.repo() + "/" + issue_id
+        issue_url = self.api_url() + "issues/show/" + self.repo_owner() + "/" + self.repo() + "/" + issue_id
+        comment_url = self.api_url() + "issues/comments/" + self.repo_owner() + "/" + self.repo() + "/" + issue_id
         try:
-            issue_as_json = json.loads(self.__url_request(issue_url))
-            comments_as_json = json.loads(self.__url_request(comment_url))
-        except urllib.error.HTTPError as e:
+            if get_comments: # The issue and its comments are independent requests, so make them at once.
+                issue_as_json, comments_as_json = idli.concurrency.both(lambda: self.__decode(self.__url_request(issue_url)),
+                                                                        lambda: self.__decode(self.__url_request(comment_url)))
+            else:
+                issue_as_json, comments_as_json = self.__decode(self.__url_request(issue_url)), { "comments" : [] }
+        except HttpRequestException as e:
+            if (e.status_code != 404):
+                raise
             self.validate()
             raise idli.IdliException("Could not find issue with id '" + issue_id + "'")
 
         js_issue = issue_as_json["issue"]
-        date = self.__parse_date(js_issue["created_at"])
-        issue = self.__parse_issue(issue_as_json["issue"])
+        date = parse_date(js_issue["created_at"])
+        issue = parse_issue(issue_as_json["issue"])
         comments_list = comments_as_json["comments"]
         comment_result = []
         for c in comments_list:
-            comment_result.append(self.__parse_comment(issue, c))
+            comment_result.append(parse_comment(issue, c))
         return (issue, comment_result)
 
+    def check_issue_exists(self, issue_id):
+        self.get_issue(issue_id, get_comments=False)
+
     @catch_missing_config
     @catch_HTTPError
     @catch_url_error
     def add_comment(self, issue_id, body):
-        url = github_base_api_url + "issues/comment/" + self.repo_owner() + "/" + self.repo() + "/" + str(issue_id)
-        result_str = self.__url_request(url, comment=body)
-        comment = self.__parse_comment(None, json.loads(result_str)['comment'])
-        return comment
+        url = self.api_url() + "issues/comment/" + self.repo_owner() + "/" + self.repo() + "/" + str(issue_id)
+        self.__url_request(url, comment=body)
+        return None
 
     @catch_missing_config
     @catch_url_error
@@ -155,11 +190,20 @@ class GithubBackend(idli.Backend):
     def resolve_issue(self, issue_id, status = "closed", message = None):
         self.add_comment(issue_id, message)
         status_url = self.__resolution_code_to_url[status]
-        url = github_base_api_url + "issues/" + status_url + "/" + self.repo_owner() + "/" + self.repo() + "/" + str(issue_id)
-        issue = self.__parse_issue(json.loads(self.__url_request(url))["issue"])
-        return issue
+        url = self.api_url() + "issues/" + status_url + "/" + self.repo_owner() + "/" + self.repo() + "/" + str(issue_id)
+        self.__url_request(url)
+        return None # The reply has the issue, but not its comments
     __resolution_code_to_url = { "closed" : "close", "open" : "reopen" }
 
+    def async_backend(self):
+        try:
+            return AsyncGithubBackend(self)
+        except ImportError: # No httpx
+            return idli.Backend.async_backend(self)
+
+    def issue_url(self, action, *parts):
+        return self.api_url() + "issues/" + action + "/" + "/".join([self.repo_owner(), self.repo()] + [str(p) for p in parts])
+
     #Github queries
     def validate(self):
         self.__validate_user()
@@ -167,38 +211,29 @@ class GithubBackend(idli.Backend):
 
     @catch_url_error
     def __validate_user(self):
-        test_url = github_base_api_url + "user/show/" + self.repo_owner()
+        test_url = self.api_url() + "user/show/" + self.repo_owner()
         try:
-            result = json.loads(urllib.request.urlopen(test_url).read())
+            result = idli.decode.loads(get_transport().get(test_url).content)
             return result["user"]
-        except urllib.error.HTTPError as e:
+        except HttpRequestException as e:
             raise idli.IdliException("Can not find user " + self.repo_owner() + " on github.")
 
     @catch_url_error
     def __validate_repo(self):
-        test_url = github_base_api_url + "repos/show/" + self.repo_owner() + "/" + self.repo()
+        test_url = self.api_url() + "repos/show/" + self.repo_owner() + "/" + self.repo()
         try:
-            result = json.loads(urllib.request.urlopen(test_url).read())
+            result = idli.decode.loads(get_transport().get(test_url).content)
             return result["repository"]
-        except urllib.error.HTTPError as e:
+        except HttpRequestException as e:
             raise idli.IdliException("Can not find repository " + self.repo() + " on github.")
 
     #Utilities
     def __url_request(self, url, **kwargs):
-        response = requests.get(url, auth=self.auth(), params=kwargs)
-        if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
-            raise HttpRequestException("HTTP error", response.status_code)
-        return response.content
-
-    def __parse_comment(self, issue, cdict):
-        return idli.IssueComment(issue, cdict["user"], "", cdict["body"], self.__parse_date(cdict["created_at"]))
+        return get_transport().get(url, auth=self.auth(), params=kwargs).content
 
-    def __parse_issue(self, issue_dict):
-        create_time = self.__parse_date(issue_dict["created_at"])
-        return idli.Issue(issue_dict["title"], issue_dict["body"],
-                            issue_dict["number"], issue_dict["user"],
-                            num_comments = issue_dict["comments"], status = issue_dict["state"],
-                            create_time=create_time, tags=issue_dict["labels"])
+    def __decode(self, body):
+        with idli.trace.span("decode json", "decode", bytes=len(body)):
+            return idli.decode.loads(body)
 
     def __state_to_gh_state(self, state):
         if (state):
@@ -207,7 +242,7 @@ class GithubBackend(idli.Backend):
             return "closed"
 
     def __add_label_url(self, issue_id, tag, remove=False):
-        url = github_base_api_url + "issues/label"
+        url = self.api_url() + "issues/label"
         if (remove):
             url += "/remove"
         else:
@@ -215,7 +250,78 @@ class GithubBackend(idli.Backend):
         url += "/" + self.repo_owner() + "/" + self.repo() + "/" + tag + "/" + str(issue_id)
         return url
 
-    def __parse_date(self, datestr):
-        return datetime.datetime.strptime(datestr[0:19], dateformat)
+class AsyncGithubBackend(idli.AsyncBackend):
+    """Native asyncio implementation of GithubBackend."""
+    def __init__(self, backend):
+        idli.AsyncBackend.__init__(self, backend)
+        self.transport = get_async_transport()
+
+    async def add_issue(self, title, body, tags=[]):
+        result = await self.__url_request(self.backend.issue_url("open"), title=title, body=body)
+        issue = parse_issue(result["issue"])
+        if tags:
+            issue.tags = await self.__apply_labels(issue.id, tags)
+        return (issue, [])
 
+    async def tag_issue(self, issue_id, tags, remove_tags=False):
+        await self.__apply_labels(issue_id, tags, remove_tags)
+        return None
 
+    async def __apply_labels(self, issue_id, tags, remove_tags=False):
+        action = "label/remove" if remove_tags else "label/add"
+        labels = None
+        for t in tags:
+            result = await self.__url_request(self.backend.issue_url(action, t, issue_id))
+            if (not (t in result['labels'])) and (not remove_tags):
+                raise idli.IdliException("Failed to add tag to issue " + str(issue_id) + ". The issue list may be in an inconsistent state.")
+            labels = result['labels']
+        return labels
+
+    async def issue_list(self, state=True):
+        result = await self.__url_request(self.backend.issue_url("list", "open" if state else "closed"))
+        return [parse_issue(i) for i in result["issues"]]
+
+    async def get_issue(self, issue_id):
+        import asyncio
+        # The issue and its comments are independent requests, so make them at once.
+        issue_as_json, comments_as_json = await asyncio.gather(self.__url_request(self.backend.issue_url("show", issue_id)),
+                                                               self.__url_request(self.backend.issue_url("comments", issue_id)))
+        issue = parse_issue(issue_as_json["issue"])
+        return (issue, [parse_comment(issue, c) for c in comments_as_json["comments"]])
+
+    async def add_comment(self, issue_id, body):
+        await self.__url_request(self.backend.issue_url("comment", issue_id), comment=body)
+        return None
+
+    async def resolve_issue(self, issue_id, status = "closed", message = None):
+        await self.add_comment(issue_id, message)
+        action = { "closed" : "close", "open" : "reopen" }[status]
+        await self.__url_request(self.backend.issue_url(action, issue_id))
+        return None
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def __url_request(self, url, **kwargs):
+        try:
+            response = await self.transport.get(url, auth=self.backend.auth(), params=kwargs)
+        except HttpRequestException as e:
+            if (e.status_code == 401):
+                raise idli.IdliException("Authentication failed. Check the 'user' and 'password' variables in the [Github] section of your idli configuration.\n\n" + str(e))
+            if (e.status_code == 404):
+                raise idli.IdliException("Not found on github: " + url)
+            raise idli.IdliException("Could not connect to github. Error: " + str(e))
+        return idli.decode.loads(response.content)
+
+def parse_comment(issue, cdict):
+    return idli.IssueComment(issue, cdict["user"], "", cdict["body"], parse_date(cdict["created_at"]))
+
+def parse_issue(issue_dict):
+    create_time = parse_date(issue_dict["created_at"])
+    last_modified = None
+    if issue_dict.get("updated_at"):
+        last_modified = parse_date(issue_dict["updated_at"])
+    return idli.Issue(issue_dict["title"], issue_dict["body"],
+                        issue_dict["number"], issue_dict["user"],
+                        num_comments = issue_dict["comments"], status = issue_dict["state"],
+                        create_time=create_time, last_modified=last_modified, tags=issue_dict["labels"])
@@ -0,0 +1,31 @@
+# The arguments of idli init and idli config for each built-in backend, as
+# (name, help) pairs. They live here, apart from the backends, so that the
+# command line can be built without importing any backend.
+
+github_init_names = [ ("repo", "Name of repository"),
+                      ("owner", "Owner of repository (github username).")
+                      ]
+github_config_names = [ ("user", "Github username"),
+                        ("password", "Github password"),
+                        ]
+
+trac_init_names = [ ("server", "URL of trac server."),
+                    ("path", "Name of repository")
+                    ]
+trac_config_names = [ ("user", "Trac username"),
+                      ("password", "Trac login password.")
+                      ]
+
+redmine_init_names = [ ("base_url", "Base URL to access"),
+                       ("api_token", "Redmine API token"),
+                       ("project_id", "Project ID"),
+                       ("username", "Real name, as given in redmine. E.g., Chris Stucchio"),
+                       ]
+redmine_config_names = [  ]
+
+bitbucket_init_names = [ ("repo", "Name of repository"),
+                         ("owner", "Owner of repository (Bitbucket username).")
+                         ]
+bitbucket_config_names = [ ("user", "Bitbucket username"),
+                           ("password", "Bitbucket password"),
+                           ]
@@ -1,34 +1,19 @@
 import json
-import datetime
-import time
-import requests
 
 import idli
-import idli.config as cfg
-
-github_base_api_url = "http://github.com/api/v2/json/"
-dateformat = "%Y/%m/%d %H:%M:%S"
-
-class HttpRequestException(Exception):
-    def __init__(self, value, status_code, body = None):
-        super(HttpRequestException, self).__init__(value)
-        self.value = value
-        self.status_code = status_code
-        self.body = body
-
-    def __str__(self):
-        return "HttpError: " + str(self.status_code) + ", " + str(self.value) + ", " + self.body
-
+import idli.concurrency
+import idli.query
+import idli.trace
+import idli.decode
+import idli.backends.names as names
+from idli.decode import parse_date
+from idli.transport import get_transport, get_async_transport, HttpRequestException
 
 class RedmineBackend(idli.Backend):
     name = "redmine"
     config_section = "Redmine"
-    init_names = [ ("base_url", "Base URL to access"),
-                   ("api_token", "Redmine API token"),
-                   ("project_id", "Project ID"),
-                   ("username", "Real name, as given in redmine. E.g., Chris Stucchio"),
-                   ]
-    config_names = [  ]
+    init_names = names.redmine_init_names
+    config_names = names.redmine_config_names
 
     def __init__(self, args, base_url=None, token=None, project_id=None, username=None):
         self.args = args
@@ -36,231 +21,423 @@ class RedmineBackend(idli.Backend):
         self.__token = token
         self.__project_id = project_id
         self.__username = username
-
-        self.__get_statuses()
+        idli.set_status_loader(self.status_mapping)
 
     def base_url(self):
-        return self.__base_url or self.get_config("base_url")
+        return self.__base_url or self.settings.base_url
 
     def token(self):
-        return self.__token or self.get_config("api_token")
+        return self.__token or self.settings.api_token
 
     def project_id(self):
-        return self.__project_id or self.get_config("project_id")
+        return self.__project_id or self.settings.project_id
 
     def username(self):
-        return self.__username or self.get_config("username")
+        return self.__username or self.settings.username
 
     def issue_list(self, state=True):
-        params = { 'project_id' : self.project_id(), 'limit' : 100,  'status_id' : state, }
-        issues = []
-        result = json.loads(self.__url_request("/issues.json", params = params) )
-        total_results = result['total_count']
-        json_results = result['issues']
-        while (len(json_results) < total_results):
-            params = { 'project_id' : self.project_id(), 'limit' : 100, 'offset' : len(json_results), 'status_id' : state }
-            result = json.loads(self.__url_request("/issues.json", params = params) )
-            json_results += result['issues']
-            total_results = result['total_count']
-
-        return [self.__parse_issue(i) for i in json_results]
+        params = { 'project_id' : self.project_id(), 'status_id' : status_filter(state), }
+        return [parse_issue(i) for i in self.__paged_request("/issues.json", "issues", params)]
+
+    def iter_issues(self, state=True, limit=None, filters=None):
+        params = { 'project_id' : self.project_id(), 'status_id' : status_filter(state), }
+        params.update(filters or {})
+        for i in self.__iter_paged("/issues.json", "issues", params, limit):
+            yield parse_issue(i)
+
+    def issues_since(self, since=None):
+        params = { 'project_id' : self.project_id(), 'status_id' : '*', }
+        if since is not None:
+            params['updated_on'] = '>=' + since.strftime('%Y-%m-%dT%H:%M:%SZ')
+        return [parse_issue(i) for i in self.__paged_request("/issues.json", "issues", params)]
 
     # Get the users list
     # TODO filter with groups
     def users_list(self):
+        params = { 'project_id' : self.project_id() }
+        return [parse_user(u) for u in self.__paged_request("/users.json", "users", params)]
 
-        # Get the first 100 users
-        params = { 'project_id' : self.project_id(), 'limit' : 100 }
-        result = json.loads(self.__url_request("/users.json", params=params) )
-        total_results = result['total_count']
-        json_results = result['users']
-
-        # Get the rest (>100 users)
-        while (len(json_results) < total_results):
-            params = { 'project_id' : self.project_id(), 'limit' : 100, 'offset' : len(json_results) }
-            result = json.loads(self.__url_request("/users.json", params = params) )
-            json_results += result['users']
-            total_results = result['total_count']
-
-        return [self.__parse_user(u) for u in json_results]
+    def search_users(self, text):
+        # Redmine matches 'name' against login, first and last names and mail.
+        params = { 'project_id' : self.project_id(), 'name' : text }
+        return [parse_user(u) for u in self.__paged_request("/users.json", "users", params)]
 
     def get_issue(self, issue_id, get_comments=True):
-        result = json.loads(self.__url_request("/issues/"+str(issue_id)+".json", params={ 'include' : 'journals' }))
-        issue = self.__parse_issue(result['issue'])
+        try:
+            result = self.__decode(self.__url_request("/issues/"+str(issue_id)+".json", params={ 'include' : 'journals' }))
+        except HttpRequestException as e:
+            if (e.status_code != 404):
+                raise
+            raise idli.IdliException("Could not find issue with id '" + str(issue_id) + "'")
+        issue = parse_issue(result['issue'])
         journals = result['issue']['journals']
-        comment_result = [ self.__parse_comment(issue, j) for j in journals if 'notes' in j ]
+        comment_result = [ parse_comment(issue, j) for j in journals if 'notes' in j ]
         return (issue, comment_result)
 
+    def check_issue_exists(self, issue_id):
+        auth = (self.token(), "null")
+        try:
+            get_transport().head(self.base_url() + "/issues/" + str(issue_id) + ".json", auth=auth, verify=self.verify_ssl())
+        except HttpRequestException as e:
+            if (e.status_code != 404):
+                raise
+            raise idli.IdliException("Could not find issue with id '" + str(issue_id) + "'")
+
     def get_user(self, user_id):
-        result = json.loads(self.__url_request("/users/"+str(user_id)+".json", params={ 'include' : 'groups' }))
-        user = self.__parse_user(result['user'])
+        result = idli.decode.loads(self.__url_request("/users/"+str(user_id)+".json", params={ 'include' : 'groups' }))
+        user = parse_user(result['user'])
         return user
 
     def add_issue(self, title, body, tags=[]):
         data = { "issue" : { 'project_id' : self.project_id(),
                              'subject' : title,
-                             'priority_id' : 4,
                              'description' : body,
                              }
                  }
-        response = json.loads(self.__url_post('/issues.json', data=data, method='post'))
-        return (self.__parse_issue(response['issue']), [])
+        data['issue'].update(self.new_issue_fields())
+        response = idli.decode.loads(self.__url_post('/issues.json', data=data, method='post'))
+        return (parse_issue(response['issue']), [])
 
     def resolve_issue(self, issue_id, status="Closed", message=None):
-        if idli.get_status_mapping()[status.lower()]:
-            status_id = 1
-        else:
-            status_id = 5
-        data = { 'issue' : { 'status_id' : status_id,
+        data = { 'issue' : { 'status_id' : self.status_id(status),
                              'notes' : message,
                              }
                  }
-        result = self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
-        return self.get_issue(issue_id)
+        self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None # Redmine answers updates with an empty body
 
     def add_comment(self, issue_id, body):
         data = { 'issue' : { 'notes' : body, } }
-        result = self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
-        return self.get_issue(issue_id)
+        self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None
 
     # Backend override
     def assign_issue(self, issue_id, user, message):
-
-        # Find the user matching user
-        definitive_user = None
-
         # If user is 'me', we assume we mean the current user
         if user == "me":
             definitive_user = self.get_user("current")
         else:
-            users = self.users_list()
-            possible_users = []
-            for u in users:
-                if ( str(user) == u.id or
-                     str(user) == u.mail or
-                     str(user) == u.shortname or
-                     str(user) == u.longname ):
-
-                    definitive_user = u
-                    break
-
-                if ( str(user) in u.mail or
-                     str(user) in u.shortname or
-                     str(user) in u.longname ):
-                    possible_users += [ u ]
-
-            # Check that we found only one matching user
-            if definitive_user is None:
-                if len(possible_users) == 1:
-                    definitive_user = possible_users[0]
-
-                elif len(possible_users) == 0:
-                    raise Exception("No user matching '" + user + "'")
-
-                else:
-                    raise Exception("Multiple users matching '" + user + "'")
+            definitive_user = self.find_user(user)
 
         # Do the issue update API request
         data = { 'issue' : { 'notes' : message, 'assigned_to_id' : definitive_user.id, } }
-        result = self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
-        return self.get_issue(issue_id)
-
-
-    def __parse_comment(self, issue, journal):
-        return idli.IssueComment(issue=issue, creator=journal['user']['name'], body=journal['notes'], date=self.__parse_date(journal['created_on']), title="")
-
-
-    def filtered_issue_list(self, state=True, mine=False, tag=None):
-        issues = self.issue_list(state)
-        if mine:
-            issues = [i for i in issues if i.owner == self.username()]
-        if tag:
-            issues = [i for i in issues if tag in i.tags]
-        return issues
-
-    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
-    def __parse_date(self, d):
-        #tz_delta = datetime.timedelta(hours=int(d[-6:])/100) ???
-        return datetime.datetime.strptime(d[0:19], self.DATE_FORMAT)# + tz_delta
-
-    # Parse an issue from Redmine's json to idli 'Issue'
-    def __parse_issue(self, i):
-        issue = idli.Issue(
-                i['subject'],
-                i['description'],
-                i['id'],
-                i['author']['name'],
-                status=i['status']['name'],
-                create_time=self.__parse_date(i['created_on']) )
-
-        if 'assigned_to' in i:
-            issue.owner = i['assigned_to']['name']
-
-        if 'journals' in i:
-            print("journals")
-            issue.num_comment = len(i['journals'])
-
-        return issue
-
-    # Parse a user from Redmine's json to idli 'User'
-    def __parse_user(self, u):
-        user = idli.User(
-                u['id'],
-                u['mail'],
-                u['login'],
-                u['firstname'] + " " + u['lastname'] )
-        return user
+        self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None
+
+    def bulk_update(self, issue_ids, op):
+        invalid = [i for i in issue_ids if not str(i).isdigit()]
+        if invalid:
+            raise idli.IdliException("Invalid issue ID(s): " + ", ".join(invalid) + ". Redmine issue IDs are numbers.")
+        if op["op"] == "resolve":
+            fields = { 'status_id' : self.status_id(op.get("state", "closed")) }
+        elif op["op"] == "assign":
+            user = self.get_user("current") if op["user"] == "me" else self.find_user(op["user"])
+            fields = { 'assigned_to_id' : user.id }
+        else:
+            raise idli.IdliNotImplementedException("bulk_update cannot " + op["op"] + " issues.")
+        data = { 'ids' : [int(i) for i in issue_ids], 'issue' : fields, 'notes' : op.get("message") or "" }
+        try:
+            self.__url_post('/issues/bulk_update.json', data=data, method='post')
+        except HttpRequestException as e:
+            # Many servers only allow bulk updates from a browser session, not with an API key.
+            if e.status_code in (401, 403, 404, 405, 406):
+                raise idli.IdliNotImplementedException("This server does not accept bulk updates.")
+            # Redmine saves the issues one by one, so some may have changed; trying each again could repeat them.
+            raise idli.IdliException("Could not update issues " + ", ".join(issue_ids) + " at once: " + str(e) + ". Some of them may have been changed.")
+        return None
+
+    # Redmine filter parameters for query fields; 'me' is understood by the server.
+    query_params = { "owner" : "assigned_to_id", "creator" : "author_id", "id" : "issue_id",
+                     "created" : "created_on", "modified" : "updated_on", "title" : "subject" }
+
+    def plan_query(self, query):
+        filters = {}
+        remainder = []
+        for c in query.conditions:
+            param = self.query_params.get(c.field)
+            value = None
+            exact = True
+            if (param is None) or (param in filters):
+                pass
+            elif c.field in ("owner", "creator") and c.value == "me" and c.op in ("=", "!="):
+                value = ("!" if c.op == "!=" else "") + "me"
+            elif c.field == "id" and c.op == "=":
+                value = c.value
+            elif c.field in ("created", "modified") and c.op in (">", ">=", "<", "<="):
+                # Redmine compares whole days, so narrow on the server and check exactly here.
+                value = c.op[0] + "=" + c.value.strftime("%Y-%m-%d")
+                exact = False
+            elif c.field == "title" and c.op == "~":
+                value = "~" + c.value
+                exact = False
+            if value is None:
+                remainder.append(c)
+                continue
+            filters[param] = value
+            if not exact:
+                remainder.append(c)
+        return (filters, idli.query.Query(remainder))
+
+    # Server metadata comes from the project's idli.metadata cache, and only when a command needs it.
+    # Redmine's out of the box statuses stand in if we may not list them.
+    DEFAULT_STATUSES = [ { 'id' : 1, 'name' : 'New' }, { 'id' : 2, 'name' : 'In Progress' },
+                         { 'id' : 3, 'name' : 'Resolved', 'is_closed' : True }, { 'id' : 4, 'name' : 'Feedback' },
+                         { 'id' : 5, 'name' : 'Closed', 'is_closed' : True }, { 'id' : 6, 'name' : 'Rejected', 'is_closed' : True } ]
+
+    def statuses(self):
+        return self.metadata().get("statuses", lambda: self.__decode(self.__url_request("/issue_statuses.json"))['issue_statuses'],
+                                   fallback=self.DEFAULT_STATUSES)
+
+    def status_mapping(self):
+        return dict([ (s['name'], not s.get('is_closed', False)) for s in self.statuses() ])
+
+    def status_id(self, status):
+        """The id of the status called `status`, or else of the first open ("open") or closed (anything else) status."""
+        statuses = self.statuses()
+        for s in statuses:
+            if s['name'].lower() == status.lower():
+                return s['id']
+        is_open = status.lower() in ("open", "true")
+        for s in statuses:
+            if (not s.get('is_closed', False)) == is_open:
+                return s['id']
+        raise idli.IdliException("Redmine has no " + ("open" if is_open else "closed") + " status.")
+
+    def priorities(self):
+        return self.metadata().get("priorities", lambda: self.__decode(self.__url_request("/enumerations/issue_priorities.json"))['issue_priorities'])
+
+    def trackers(self):
+        return self.metadata().get("trackers", lambda: self.__decode(self.__url_request("/trackers.json"))['trackers'])
+
+    def new_issue_fields(self):
+        """Fields for new issues. The server picks the priority and tracker, unless the
+        configuration names them with 'priority' and 'tracker'."""
+        fields = {}
+        for (name, key, values) in (("priority", "priority_id", self.priorities), ("tracker", "tracker_id", self.trackers)):
+            wanted = self.get_config(name, "")
+            if not wanted:
+                continue
+            matches = [ v['id'] for v in values() if v['name'].lower() == wanted.lower() ]
+            if not matches:
+                raise idli.IdliException("Redmine has no " + name + " called '" + wanted + "'. Check the '" + name + "' variable in the [Redmine] section of your idli configuration.")
+            fields[key] = matches[0]
+        return fields
+
+    def async_backend(self):
+        try:
+            return AsyncRedmineBackend(self)
+        except ImportError: # No httpx
+            return idli.Backend.async_backend(self)
+
+    # Paging parameters. The first page asks for MAX_PAGE_SIZE items, which
+    # tells us the server's own cap on 'limit'. The remaining pages are sized
+    # so each carries roughly TARGET_PAGE_BYTES, and fetched concurrently.
+    MAX_PAGE_SIZE = 500
+    MIN_PAGE_SIZE = 25
+    TARGET_PAGE_BYTES = 512*1024
+
+    # Fetch every page of a paginated collection, e.g. /issues.json, in ID order
+    def __paged_request(self, suffix, key, params={}):
+        return sorted(self.__iter_paged(suffix, key, params), key=lambda r: r['id'])
+
+    # Yield the items of a paginated collection as pages arrive, stopping after 'limit' items.
+    def __iter_paged(self, suffix, key, params={}, limit=None):
+        page_size = int(self.get_config("page_size", self.MAX_PAGE_SIZE))
+        if limit is not None:
+            page_size = min(page_size, limit)
+        params = dict(params, sort='id', limit=page_size)
+        # Pages are decoded as they arrive, so only one item at a time is held as both text and objects.
+        (response, first_page) = self.__url_stream(suffix, key, params = params)
+        latency = response.elapsed.total_seconds()
+        seen = set()
+        with response:
+            for r in first_page:
+                if (limit is not None) and (len(seen) >= limit):
+                    return
+                seen.add(r['id'])
+                yield r
+        total_results = first_page.rest['total_count']
+        if limit is not None:
+            total_results = min(total_results, limit)
+        if len(seen) >= total_results or not seen:
+            return
+
+        if len(seen) < page_size: # The server capped the page size
+            page_size = self.__next_page_size(len(seen), first_page.size, latency)
+        offsets = range(len(seen), total_results, page_size)
+        def fetch_page(offset):
+            (response, page) = self.__url_stream(suffix, key, params = dict(params, offset=offset, limit=page_size))
+            with response:
+                return list(page)
+
+        # The collection may change between requests; drop anything seen twice.
+        count = len(seen)
+        workers = min(int(self.get_config("workers", idli.concurrency.DEFAULT_WORKERS)), len(offsets))
+        for page in idli.concurrency.bounded_map(fetch_page, offsets, workers):
+            for r in page:
+                if (r['id'] in seen) or (count >= total_results):
+                    continue
+                seen.add(r['id'])
+                count += 1
+                yield r
+
+    def __next_page_size(self, server_limit, num_bytes, latency):
+        # The server returned fewer items than asked for, so that is its cap.
+        item_bytes = max(num_bytes // server_limit, 1)
+        page_size = max(self.MIN_PAGE_SIZE, self.TARGET_PAGE_BYTES // item_bytes)
+        if latency > 1.0: # Slow server: prefer fewer, larger pages
+            page_size *= 2
+        return min(page_size, server_limit)
+
+    def __decode(self, body):
+        with idli.trace.span("decode json", "decode", bytes=len(body)):
+            return idli.decode.loads(body)
 
     def __url_post(self, suffix, data={}, method='post'):
         headers = { 'Content-Type' : 'application/json',
                     }
         auth = (self.token(), "null")
-        if method == 'post':
-            response = requests.post(self.base_url() + suffix, auth=auth, data=json.dumps(data), headers=headers, verify=self.verify_ssl())
-        if method == 'put':
-            response = requests.put(self.base_url() + suffix, auth=auth, data=json.dumps(data), headers=headers, verify=self.verify_ssl())
-        if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
-            raise HttpRequestException("HTTP error", response.status_code, response.content)
+        response = get_transport().request(method, self.base_url() + suffix, auth=auth, data=json.dumps(data), headers=headers, verify=self.verify_ssl())
         return response.content.decode('utf-8')
 
 
     def __url_request(self, suffix, params={}):
         headers = { 'Content-Type' : 'application/json' }
         auth = (self.token(), "null")
-        response = requests.get(self.base_url() + suffix, auth=auth, params=params, headers=headers, verify=self.verify_ssl())
-        if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
-            raise HttpRequestException("HTTP error", response.status_code, response.content)
+        response = get_transport().get(self.base_url() + suffix, auth=auth, params=params, headers=headers, verify=self.verify_ssl())
         return response.content.decode('utf-8')
 
+    # The response, with a stream of the items under 'key' in its body
+    def __url_stream(self, suffix, key, params={}):
+        headers = { 'Content-Type' : 'application/json' }
+        auth = (self.token(), "null")
+        response = get_transport().get(self.base_url() + suffix, auth=auth, params=params, headers=headers, verify=self.verify_ssl(), stream=True)
+        return (response, idli.decode.ArrayStream(response.iter_content(idli.decode.CHUNK_SIZE), key))
+
 
-    STATUS_CHECK_INTERVAL = 60*60
-    def __get_statuses(self):
-        try: #If we are properly configured, try to get statuses
-            self.token()
-        except cfg.IdliMissingConfigException:
-            pass
+# Redmine's status_id filter takes "open", "closed", "*" or a status id, not True or False.
+def status_filter(state):
+    return "open" if state in (True, "open") else "closed"
 
-        try:
-            if float(cfg.get_config_value(self.config_section, "last_status_list_time")) + self.STATUS_CHECK_INTERVAL > time.time():
-                idli.set_status_mapping(json.loads(cfg.get_config_value(self.config_section, "last_status_list")))
-                return
-        except cfg.IdliMissingConfigException:
-            pass
-        try:
-            result = json.loads(self.__url_request("/issue_statuses.json"))
-            statuses_list = result['issue_statuses']
-            statuses = {}
-            for s in statuses_list:
-                statuses[s['name'].lower()] = not ('is_closed' in s and s['is_closed'])
-            cfg.set_config_value(self.config_section, "last_status_list", json.dumps(statuses), global_val=False)
-            cfg.set_config_value(self.config_section, "last_status_list_time", str(time.time()))
-            idli.set_status_mapping(statuses)
-        except HttpRequestException as e:
-            mapping = { 'New' : True, 'Closed' : False, 'In Progress' : True, 'Rejected' : False, 'Resolved' : False, 'Feedback' : True }
-            cfg.set_config_value(self.config_section, "last_status_list", json.dumps(mapping), global_val=False)
-            cfg.set_config_value(self.config_section, "last_status_list_time", float(time.time()), global_val=False)
-            idli.set_status_mapping(mapping)
-        except cfg.IdliMissingConfigException:
-            pass
+def parse_comment(issue, journal):
+    return idli.IssueComment(issue=issue, creator=journal['user']['name'], body=journal['notes'], date=parse_date(journal['created_on']), title="")
+
+# Parse an issue from Redmine's json to idli 'Issue'
+def parse_issue(i):
+    issue = idli.Issue(
+            i['subject'],
+            i['description'],
+            i['id'],
+            i['author']['name'],
+            status=i['status']['name'],
+            create_time=parse_date(i['created_on']),
+            last_modified=parse_date(i['updated_on']) if 'updated_on' in i else None )
+
+    if 'assigned_to' in i:
+        issue.owner = i['assigned_to']['name']
+
+    if 'journals' in i:
+        issue.num_comments = len(i['journals'])
+
+    return issue
+
+class AsyncRedmineBackend(idli.AsyncBackend):
+    """Native asyncio implementation of RedmineBackend."""
+    def __init__(self, backend):
+        idli.AsyncBackend.__init__(self, backend)
+        self.transport = get_async_transport()
+
+    async def issue_list(self, state=True):
+        params = { 'project_id' : self.backend.project_id(), 'status_id' : status_filter(state), }
+        return [parse_issue(i) for i in await self.__paged_request("/issues.json", "issues", params)]
+
+    async def users_list(self):
+        params = { 'project_id' : self.backend.project_id() }
+        return [parse_user(u) for u in await self.__paged_request("/users.json", "users", params)]
+
+    async def get_issue(self, issue_id):
+        result = await self.__url_request("/issues/"+str(issue_id)+".json", params={ 'include' : 'journals' })
+        issue = parse_issue(result['issue'])
+        return (issue, [ parse_comment(issue, j) for j in result['issue']['journals'] if 'notes' in j ])
+
+    async def get_user(self, user_id):
+        result = await self.__url_request("/users/"+str(user_id)+".json", params={ 'include' : 'groups' })
+        return parse_user(result['user'])
+
+    async def add_issue(self, title, body, tags=[]):
+        data = { "issue" : { 'project_id' : self.backend.project_id(),
+                             'subject' : title,
+                             'description' : body,
+                             }
+                 }
+        data['issue'].update(await self.__metadata(self.backend.new_issue_fields))
+        response = idli.decode.loads(await self.__url_post('/issues.json', data=data, method='post'))
+        return (parse_issue(response['issue']), [])
+
+    async def resolve_issue(self, issue_id, status="Closed", message=None):
+        data = { 'issue' : { 'status_id' : await self.__metadata(self.backend.status_id, status), 'notes' : message, } }
+        await self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None
+
+    async def add_comment(self, issue_id, body):
+        data = { 'issue' : { 'notes' : body, } }
+        await self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None
+
+    async def assign_issue(self, issue_id, user, message):
+        if user == "me":
+            definitive_user = await self.get_user("current")
+        else:
+            import asyncio # The user directory is SQLite, so it is used from a thread
+            definitive_user = await asyncio.get_running_loop().run_in_executor(None, self.backend.find_user, user)
+        data = { 'issue' : { 'notes' : message, 'assigned_to_id' : definitive_user.id, } }
+        await self.__url_post('/issues/' + str(issue_id) + '.json', data=data, method='put')
+        return None
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def __metadata(self, func, *args):
+        import asyncio # The metadata cache reads a file and may fetch, so it is used from a thread
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def __paged_request(self, suffix, key, params={}):
+        import asyncio
+        params = dict(params, sort='id', limit=int(self.backend.get_config("page_size", RedmineBackend.MAX_PAGE_SIZE)))
+        result = await self.__url_request(suffix, params = params)
+        json_results = result[key]
+        if len(json_results) >= result['total_count'] or not json_results:
+            return json_results
+        page_size = len(json_results)
+        workers = asyncio.Semaphore(int(self.backend.get_config("workers", idli.concurrency.DEFAULT_WORKERS)))
+        async def fetch_page(offset):
+            async with workers:
+                return (await self.__url_request(suffix, params = dict(params, offset=offset, limit=page_size)))[key]
+        pages = await asyncio.gather(*[ fetch_page(o) for o in range(page_size, result['total_count'], page_size) ])
+        unique_results = {}
+        for r in json_results + [r for page in pages for r in page]:
+            unique_results[r['id']] = r
+        return [ unique_results[i] for i in sorted(unique_results) ]
+
+    async def __url_post(self, suffix, data={}, method='post'):
+        headers = { 'Content-Type' : 'application/json', }
+        auth = (self.backend.token(), "null")
+        response = await self.transport.request(method, self.backend.base_url() + suffix, auth=auth, data=json.dumps(data), headers=headers, verify=self.backend.verify_ssl())
+        return response.content.decode('utf-8')
+
+    async def __url_request(self, suffix, params={}):
+        headers = { 'Content-Type' : 'application/json' }
+        auth = (self.backend.token(), "null")
+        response = await self.transport.get(self.backend.base_url() + suffix, auth=auth, params=params, headers=headers, verify=self.backend.verify_ssl())
+        return idli.decode.loads(response.content)
+
+# Parse a user from Redmine's json to idli 'User'
+def parse_user(u):
+    user = idli.User(
+            u['id'],
+            u['mail'],
+            u['login'],
+            u['firstname'] + " " + u['lastname'] )
+    return user
 
 # vim: set sw=4 ts=4 expandtab:
@@ -1,13 +1,24 @@
 from datetime import datetime
 import xmlrpc.client
 import socket
+import threading
+import re
 
 import idli
+import idli.query
+import idli.trace
+import idli.concurrency
 import idli.config as cfg
+import idli.backends.names as names
 
 trac_suffix_url = "/login/xmlrpc"
 
 CONFIG_SECTION = "Trac"
+trac_config_defaults = { "use_https" : "false", "chunk_size" : "250", "gzip_requests" : "false" }
+
+# Requests larger than this are gzipped, if gzip_requests is set. Replies are
+# gzipped whenever the server is willing.
+GZIP_THRESHOLD = 1400
 
 def catch_socket_errors(func):
     def __wrapped(*args, **kwargs):
@@ -26,52 +37,153 @@ def catch_socket_errors(func):
             raise idli.IdliException("Protocol error. This probably means that the XmlRpc plugin for trac is not enabled. Follow the instructions here to install it:\nhttp://trac-hacks.org/wiki/XmlRpcPlugin\n\n"+str(e))
     return __wrapped
 
+class TracingMixin(object):
+    """Records a span for each XML-RPC call. Only used when tracing is on."""
+    __method_re = re.compile(rb'<methodName>([^<]*)</methodName>')
+
+    def request(self, host, handler, request_body, verbose=False):
+        m = self.__method_re.search(request_body)
+        method = m.group(1).decode("utf-8") if m else "?"
+        with idli.trace.span("xmlrpc", "xmlrpc", method=method, url=handler, sent_bytes=len(request_body)):
+            return super(TracingMixin, self).request(host, handler, request_body, verbose)
+
+    def parse_response(self, response):
+        with idli.trace.span("decode xmlrpc", "decode", bytes=int(response.getheader("Content-Length", 0) or 0)):
+            return super(TracingMixin, self).parse_response(response)
+
+class TracingTransport(TracingMixin, xmlrpc.client.Transport):
+    pass
+
+class TracingSafeTransport(TracingMixin, xmlrpc.client.SafeTransport):
+    pass
+
+def trac_transport(url):
+    if idli.trace.enabled():
+        transport_class = TracingSafeTransport if url.startswith("https:") else TracingTransport
+    else:
+        transport_class = xmlrpc.client.SafeTransport if url.startswith("https:") else xmlrpc.client.Transport
+    # Built-in types give us datetime and bytes instead of xmlrpc's DateTime and Binary wrappers.
+    transport = transport_class(use_builtin_types=True)
+    if cfg.section(CONFIG_SECTION, trac_config_defaults).gzip_requests.lower() == "true":
+        transport.encode_threshold = GZIP_THRESHOLD
+    return transport
+
 class TracBackend(idli.Backend):
     config_section = CONFIG_SECTION
     name = "trac"
-    init_names = [ ("server", "URL of trac server."),
-                   ("path", "Name of repository")
-                   ]
-    config_names = [("user", "Trac username"),
-                    ("password", "Trac login password.")
-                    ]
+    init_names = names.trac_init_names
+    config_names = names.trac_config_names
+    config_defaults = trac_config_defaults
 
     def __init__(self, args):
         self.args = args
-        self.__connection = None
+        self.__local = threading.local()
 
-    @catch_socket_errors
     def issue_list(self, state=True, mine=None):
-        ticket_id_list = []
-        if (state):
-            ticket_id_list = self.ticket_api().query("status!=closed")
-        else:
-            ticket_id_list = self.ticket_api().query("status=closed")
-        multicall = xmlrpc.client.MultiCall(self.connection()) # We try to get actual tickets in one http request
-        for ticket in ticket_id_list:
-            multicall.ticket.get(ticket)
-        issues = [self.__convert_issue(t) for t in multicall()]
+        issues = list(self.iter_issues(state))
         if mine:
             issues = [i for i in issues if i.owner == self.username()]
         return issues
 
+    def iter_issues(self, state=True, limit=None, filters=None):
+        query = "status!=closed" if state else "status=closed"
+        for f in (filters or []):
+            query += "&" + f
+        # Trac returns 100 tickets unless told otherwise; max=0 means all of them.
+        query += "&max=" + str(int(limit or 0))
+        for t in self.__iter_tickets(self.__query(query)):
+            yield self.__convert_issue(t)
+
+    # Trac query fields for query fields. $USER is the user we log in as.
+    query_fields = { "owner" : "owner", "creator" : "reporter", "id" : "id", "tag" : "keywords",
+                     "title" : "summary", "created" : "time", "modified" : "changetime" }
+
+    def plan_query(self, query):
+        filters = []
+        remainder = []
+        for c in query.conditions:
+            field = self.query_fields[c.field] if c.field in self.query_fields else None
+            value = c.value
+            if isinstance(value, datetime):
+                value = value.strftime("%Y-%m-%d")
+            elif value == "me" and c.field in ("owner", "creator"):
+                value = "$USER"
+            if (field is None) or ("&" in str(value)) or ("|" in str(value)):
+                remainder.append(c)
+            elif c.field in ("owner", "creator", "id") and c.op in ("=", "!="):
+                filters.append(field + c.op + str(value))
+            elif c.field in ("tag", "title") and c.op in ("=", "~"):
+                # Substring matches on the server, exact ones here.
+                filters.append(field + "~=" + value)
+                remainder.append(c)
+            elif c.field in ("created", "modified") and c.op in (">", ">="):
+                filters.append(field + "=" + value + "..")
+                remainder.append(c)
+            elif c.field in ("created", "modified") and c.op in ("<", "<="):
+                filters.append(field + "=.." + value)
+                remainder.append(c)
+            else:
+                remainder.append(c)
+        return (filters, idli.query.Query(remainder))
+
+    # Errors raised inside a generator escape the decorator, so the calls are made here.
+    @catch_socket_errors
+    def __query(self, query):
+        return self.ticket_api().query(query)
+
+    # Tickets are fetched chunk_size at a time, one system.multicall per chunk, over
+    # several connections at once. A chunk is decoded and yielded as soon as it and
+    # the chunks before it have arrived, so the first rows print early and a huge
+    # project never has to fit in one reply.
+    def __iter_tickets(self, ticket_id_list):
+        chunk_size = max(int(self.settings.chunk_size), 1)
+        chunks = [ ticket_id_list[n:n + chunk_size] for n in range(0, len(ticket_id_list), chunk_size) ]
+        workers = min(int(self.get_config("workers", idli.concurrency.DEFAULT_WORKERS)), len(chunks))
+        for tickets in idli.concurrency.bounded_map(self.__get_tickets, chunks, workers):
+            for t in tickets:
+                yield t
+
+    @catch_socket_errors
+    def __get_tickets(self, ticket_id_list):
+        multicall = xmlrpc.client.MultiCall(self.connection())
+        for ticket in ticket_id_list:
+            multicall.ticket.get(ticket)
+        return list(multicall())
+
+    @catch_socket_errors
+    def issues_since(self, since=None):
+        if since is None:
+            return idli.Backend.issues_since(self)
+        return [self.__convert_issue(t) for t in self.__iter_tickets(self.ticket_api().getRecentChanges(since))]
+
+    @catch_socket_errors
+    def issue_ids(self):
+        return [str(n) for n in self.__query("max=0")]
+
     @catch_socket_errors
     def add_comment(self, issue_id, body):
-        self.ticket_api().update(int(issue_id), body, {})
+        return self.__update(issue_id, body, {}, "Failed to comment on issue " + str(issue_id) + ".")
 
     @catch_socket_errors
     def get_issue(self, issue_id):
-        issue = self.__convert_issue(self.ticket_api().get(int(issue_id)))
-        comments = [ self.__convert_comment(c, issue) for c in self.ticket_api().changeLog(int(issue_id)) if c[2] == 'comment']
-        return (issue, comments)
+        multicall = xmlrpc.client.MultiCall(self.connection())
+        multicall.ticket.get(int(issue_id))
+        multicall.ticket.changeLog(int(issue_id))
+        ticket, changes = tuple(multicall())
+        return self.__issue_and_comments(ticket, changes)
+
+    @catch_socket_errors
+    def check_issue_exists(self, issue_id):
+        # Trac has no cheap existence check, but this at least skips the change log.
+        self.ticket_api().get(int(issue_id))
 
     @catch_socket_errors
     def resolve_issue(self, issue_id, status = "closed", message = None):
-        actions = self.ticket_api().getActions(issue_id)
-        if ('resolve' in [a[0] for a in actions]):
-            ticket = self.ticket_api().update(int(issue_id), message, { 'status' : 'fixed', 'action' : 'resolve'})
-            return self.__convert_issue(ticket)
-        raise idli.IdliException("Can not resolve issue " + issue_id + ". Perhaps it is already resolved?")
+        if status == "open":
+            return self.__update(issue_id, message, { 'action' : 'reopen' },
+                                 "Can not reopen issue " + str(issue_id) + ". Perhaps it is not closed?")
+        return self.__update(issue_id, message, { 'status' : 'fixed', 'action' : 'resolve'},
+                             "Can not resolve issue " + str(issue_id) + ". Perhaps it is already resolved?")
 
     @catch_socket_errors
     def add_issue(self, title, body, tags=[]):
@@ -80,32 +192,53 @@ class TracBackend(idli.Backend):
 
     @catch_socket_errors
     def assign_issue(self, issue_id, user, message):
-        actions = self.ticket_api().getActions(issue_id)
-        if ('reassign' in [a[0] for a in actions]):
-            ticket = self.ticket_api().update(int(issue_id), message, { 'owner' : user, 'status' : 'assigned'})
-            return self.__convert_issue(ticket)
-        raise idli.IdliException("Failed to assign ticket.")
+        return self.__update(issue_id, message, { 'owner' : user, 'status' : 'assigned', 'action' : 'reassign',
+                                                  'action_reassign_reassign_owner' : user }, "Failed to assign ticket.")
+
+    # Update a ticket and read back its change log in one system.multicall, so that every
+    # change costs one round trip. Trac checks 'action' against the ticket's workflow and
+    # refuses the update if it is not allowed, which saves asking getActions first.
+    def __update(self, issue_id, message, attributes, error):
+        multicall = xmlrpc.client.MultiCall(self.connection())
+        multicall.ticket.update(int(issue_id), message, attributes)
+        multicall.ticket.changeLog(int(issue_id))
+        results = multicall()
+        try:
+            ticket = results[0]
+        except xmlrpc.client.Fault as e:
+            if e.faultCode == 403: # Permissions; catch_socket_errors explains those
+                raise
+            raise idli.IdliException(error + "\n\n" + str(e.faultString))
+        return self.__issue_and_comments(ticket, results[1])
+
+    def __issue_and_comments(self, ticket, changes):
+        issue = self.__convert_issue(ticket)
+        comments = [ self.__convert_comment(c, issue) for c in changes if c[2] == 'comment' ]
+        issue.num_comments = len(comments)
+        return (issue, comments)
 
     ##Minor utilities
     def ticket_api(self):
         return self.connection().ticket
 
     def connection(self):
-        if (self.__connection is None):
-            self.__connection = xmlrpc.client.ServerProxy(trac_xml_url())
-        return self.__connection
+        # ServerProxy holds a single HTTP connection, so each thread gets its own.
+        if getattr(self.__local, "connection", None) is None:
+            url = trac_xml_url()
+            self.__local.connection = xmlrpc.client.ServerProxy(url, transport=trac_transport(url))
+        return self.__local.connection
 
     def path(self):
-        return self.get_config("path")
+        return self.settings.path
 
     def server(self):
-        return self.get_config("server")
+        return self.settings.server
 
     def username(self):
-        return self.get_config("user")
+        return self.settings.user
 
     def password(self):
-        return self.get_config("password")
+        return self.settings.password
 
     def __convert_comment(self, c, issue):
         return idli.IssueComment(issue, str(c[1]), "", str(c[4]), date=c[0])
@@ -119,12 +252,9 @@ class TracBackend(idli.Backend):
         status = True
         if i['status'] == "closed":
             status = False
+        tags = [k for k in i.get('keywords', '').replace(",", " ").split() if k]
         return idli.Issue(i["summary"], i["description"], str(issue_id), i['reporter'],
-                          status, num_comments = 0, create_time=self.__convert_date(t[1]),
-                          last_modified = self.__convert_date(t[2]), owner=owner)
-
-    def __convert_date(self, d):
-        return datetime(*(d.timetuple()[0:6]))
+                          status, num_comments = 0, create_time=t[1], last_modified=t[2], owner=owner, tags=tags)
 
     def __ticket_status(self, t):
         if t['status'] == "closed":
@@ -132,17 +262,15 @@ class TracBackend(idli.Backend):
         return True
 
 def __http_protocol():
-    try:
-        use_https = cfg.get_config_value(CONFIG_SECTION, "use_https")
-        if (use_https.lower() == "true"):
-            return "https://"
-        else:
-            return "http://"
-    except IdliMissingConfigException as e:
+    if (cfg.section(CONFIG_SECTION, trac_config_defaults).use_https.lower() == "true"):
+        return "https://"
+    else:
         return "http://"
 
 def trac_server_url():
-    return __http_protocol() + cfg.get_config_value(CONFIG_SECTION, "server")+"/"+cfg.get_config_value(CONFIG_SECTION, "path")
+    settings = cfg.section(CONFIG_SECTION, trac_config_defaults)
+    return __http_protocol() + settings.server+"/"+settings.path
 
 def trac_xml_url():
-    return __http_protocol()+cfg.get_config_value(CONFIG_SECTION, "user")+":"+cfg.get_config_value(CONFIG_SECTION, "password")+"@"+cfg.get_config_value(CONFIG_SECTION, "server")+"/"+cfg.get_config_value(CONFIG_SECTION, "path")+trac_suffix_url
+    settings = cfg.section(CONFIG_SECTION, trac_config_defaults)
+    return __http_protocol()+settings.user+":"+settings.password+"@"+settings.server+"/"+settings.path+trac_suffix_url
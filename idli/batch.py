@@ -0,0 +1,184 @@
+import json
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import idli
+import idli.concurrency
+
+# Operations understood by `idli batch`, and the fields each one requires.
+OPERATIONS = { "comment" : ("id", "body"),
+               "tag" : ("id", "tags"),
+               "resolve" : ("id",),
+               "assign" : ("id", "user"),
+               "add" : ("title", "body"),
+               }
+
+def read_operations(stream):
+    """Yield (line number, operation) for each non-blank line of a JSON lines stream.
+
+    Lines which cannot be used are yielded as (line number, IdliException)."""
+    for n, line in enumerate(stream, 1):
+        line = line.strip()
+        if line == "":
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            yield (n, idli.IdliException("Invalid JSON: " + str(e)))
+            continue
+        if not isinstance(op, dict):
+            yield (n, idli.IdliException("Each line must be a JSON object."))
+            continue
+        if not (op.get("op") in OPERATIONS):
+            yield (n, idli.IdliException("Unknown op " + repr(op.get("op")) + ". Known ops: " + ", ".join(sorted(OPERATIONS)) + "."))
+            continue
+        missing = [f for f in OPERATIONS[op["op"]] if not (f in op)]
+        if missing:
+            yield (n, idli.IdliException("Missing field(s) for " + op["op"] + ": " + ", ".join(missing) + "."))
+            continue
+        if "id" in op:
+            op["id"] = str(op["id"])
+        yield (n, op)
+
+def operation_key(n, op):
+    """Operations with the same key run one after another: those on the same issue share one."""
+    if isinstance(op, dict) and ("id" in op):
+        return ("id", op["id"])
+    return ("line", n)
+
+def run_operation(backend, op):
+    """Perform a single operation. Returns the id of the issue it affected."""
+    kind = op["op"]
+    if kind == "comment":
+        backend.add_comment(op["id"], op["body"])
+    elif kind == "tag":
+        tags = op["tags"]
+        if isinstance(tags, str):
+            tags = [t for t in tags.split(",") if t]
+        backend.tag_issue(op["id"], tags, bool(op.get("remove", False)))
+    elif kind == "resolve":
+        backend.resolve_issue(op["id"], status=op.get("state", "closed"), message=op.get("message", ""))
+    elif kind == "assign":
+        backend.assign_issue(op["id"], user=op["user"], message=op.get("message", ""))
+    elif kind == "add":
+        tags = op.get("tags", [])
+        if isinstance(tags, str):
+            tags = [t for t in tags.split(",") if t]
+        issue, comments = backend.add_issue(op["title"], op["body"], tags=tags)
+        return issue.id
+    return op["id"]
+
+def run_batch(backend, numbered, workers=idli.concurrency.DEFAULT_WORKERS):
+    """Run numbered operations through one backend, yielding a result dict per operation.
+
+    Operations start as they are read, up to 2 * workers ahead of the results,
+    so the input may be a stream. Operations on the same issue run one after
+    another in the order given; the rest run in parallel. Results are yielded
+    in input order, each as soon as it and those before it are done."""
+    if workers <= 1:
+        for (n, op) in numbered:
+            yield __run_one(backend, n, op)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    lock = threading.Lock()
+    chains = {} # Key to the operations waiting for the one of that key now running
+    results = queue.Queue() # Futures of the results in input order, then None
+    slots = threading.Semaphore(2 * workers)
+    stopped = threading.Event()
+
+    def run_chain(key):
+        while True:
+            with lock:
+                if not chains[key]:
+                    del chains[key]
+                    return
+                (n, op, future) = chains[key].popleft()
+            future.set_result(__run_one(backend, n, op))
+
+    # The input is read in a thread of its own, so that results are printed while it waits for more.
+    def read():
+        try:
+            for (n, op) in numbered:
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                future = Future()
+                results.put(future)
+                key = operation_key(n, op)
+                with lock:
+                    running = key in chains
+                    chains.setdefault(key, collections.deque()).append((n, op, future))
+                if not running:
+                    executor.submit(run_chain, key)
+        except Exception as e: # Reported where the results are read
+            failed = Future()
+            failed.set_exception(e)
+            results.put(failed)
+        finally:
+            results.put(None)
+
+    threading.Thread(target=read, name="idli-batch-input", daemon=True).start()
+    try:
+        while True:
+            future = results.get()
+            if future is None:
+                break
+            result = future.result()
+            slots.release()
+            yield result
+    finally:
+        stopped.set()
+        slots.release() # The reader may be waiting for a slot
+        with lock: # If the caller stopped early, don't start what is still waiting
+            for waiting in chains.values():
+                waiting.clear()
+        executor.shutdown(wait=True)
+
+def run_bulk(backend, op, issue_ids, workers=idli.concurrency.DEFAULT_WORKERS):
+    """Apply one operation (without an id) to each of issue_ids, yielding a result dict per issue.
+
+    The backend's bulk_update is tried first. If it has none, or the server will
+    not do it, the issues are changed separately, `workers` at a time."""
+    issue_ids = [str(i) for i in issue_ids]
+    if len(issue_ids) > 1:
+        started = time.monotonic()
+        try:
+            backend.bulk_update(issue_ids, op)
+        except idli.IdliNotImplementedException:
+            pass
+        else:
+            latency = round((time.monotonic() - started) * 1000.0, 1)
+            for n, issue_id in enumerate(issue_ids, 1):
+                yield { "line" : n, "op" : op["op"], "id" : issue_id, "status" : "ok", "latency_ms" : latency }
+            return
+    numbered = [ (n, dict(op, id=issue_id)) for (n, issue_id) in enumerate(issue_ids, 1) ]
+    for r in run_batch(backend, numbered, workers):
+        yield r
+
+def __run_one(backend, n, op):
+    result = { "line" : n }
+    if isinstance(op, Exception):
+        result["status"] = "error"
+        result["error"] = __error_message(op)
+        return result
+    result["op"] = op["op"]
+    if "id" in op:
+        result["id"] = op["id"]
+    started = time.monotonic()
+    try:
+        result["id"] = run_operation(backend, op)
+        result["status"] = "ok"
+    except Exception as e: # One failed operation must not stop the rest of the batch
+        result["status"] = "error"
+        result["error"] = __error_message(e)
+    result["latency_ms"] = round((time.monotonic() - started) * 1000.0, 1)
+    return result
+
+def __error_message(e):
+    if isinstance(e, idli.IdliException):
+        return str(e.value)
+    return str(e)
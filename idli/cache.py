@@ -0,0 +1,347 @@
+import os
+import json
+import sqlite3
+import datetime
+
+import idli
+import idli.config as cfg
+
+IDLI_CACHE_FILENAME = ".idli_cache"
+
+# Bump when the search index changes, to have it rebuilt from the cached issues.
+SEARCH_INDEX_VERSION = "1"
+
+# Overlap applied to the sync watermark, so that issues modified while a sync
+# was in flight are picked up again by the next one.
+SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+def cache_filename():
+    return os.path.join(os.path.dirname(cfg.local_config_filename()), IDLI_CACHE_FILENAME)
+
+class IssueCache(object):
+    """Persistent per-project store of issues and comments.
+
+    The cache lives next to the project's .idli file. It is only consulted
+    once `idli sync` has run at least once, so projects which never sync
+    behave exactly as before.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS issues (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            body TEXT,
+            creator TEXT,
+            status INTEGER,
+            num_comments INTEGER,
+            create_time TEXT,
+            last_modified TEXT,
+            owner TEXT,
+            tags TEXT,
+            comments_cached INTEGER DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS comments (
+            issue_id TEXT,
+            seq INTEGER,
+            creator TEXT,
+            title TEXT,
+            body TEXT,
+            date TEXT,
+            PRIMARY KEY (issue_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    # One document per issue, with the rowid of its row in issues, so that a word in the
+    # title and another in a comment still find the issue.
+    search_schema = "CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(title, body, comments)"
+
+    # Weights of the title, body and comments in BM25 ranking.
+    search_weights = (10.0, 1.0, 1.0)
+
+    # Updates keep an issue's rowid, which is also its search document's.
+    upsert_issue = ("INSERT INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                    + ", ".join([c + " = excluded." + c for c in ("title", "body", "creator", "status", "num_comments", "create_time",
+                                                                 "last_modified", "owner", "tags", "comments_cached")]))
+
+    def __init__(self, filename=None):
+        self.filename = filename or cache_filename()
+        self.__db = None
+        self.__fts = False
+
+    def db(self):
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.filename, check_same_thread=False) # The user directory's is shared by threads, under its lock
+            self.__db.executescript(self.schema)
+            try:
+                self.__db.execute(self.search_schema)
+                self.__fts = True
+            except sqlite3.OperationalError: # SQLite without FTS5; search falls back to LIKE
+                self.__fts = False
+            if self.__fts and (self.get_meta("search_index") != SEARCH_INDEX_VERSION):
+                self.__rebuild_search()
+        return self.__db
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def is_synced(self):
+        if (self.__db is None) and not self.exists(): # Don't create the file just to find out it is empty
+            return False
+        return self.get_meta("last_sync") is not None
+
+    def last_sync(self):
+        """The sync watermark, in the server's time, or None if the next sync must fetch everything."""
+        value = self.get_meta("last_sync")
+        if not value: # "" once synced without a watermark
+            return None
+        return datetime.datetime.fromisoformat(value)
+
+    def set_last_sync(self, when):
+        self.set_meta("last_sync", when.isoformat() if when is not None else "")
+
+    def clear(self):
+        with self.db():
+            for table in ("issues", "comments", "meta"):
+                self.db().execute("DELETE FROM " + table)
+            if self.__fts:
+                self.db().execute("DELETE FROM search")
+                self.db().execute("INSERT INTO meta (key, value) VALUES ('search_index', ?)", (SEARCH_INDEX_VERSION,))
+
+    def get_meta(self, key):
+        row = self.db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_meta(self, key, value):
+        with self.db():
+            self.db().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def store_issues(self, issues):
+        """Store issues, discarding any comments cached for them."""
+        count = 0
+        with self.db():
+            for issue in issues:
+                self.db().execute(self.upsert_issue, self.__issue_row(issue) + (0,))
+                self.db().execute("DELETE FROM comments WHERE issue_id = ?", (issue.id,))
+                self.__index(issue)
+                count += 1
+        return count
+
+    def store_issue(self, issue, comments):
+        with self.db():
+            self.db().execute(self.upsert_issue, self.__issue_row(issue) + (1,))
+            self.db().execute("DELETE FROM comments WHERE issue_id = ?", (issue.id,))
+            self.db().executemany("INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?)",
+                                  [ (issue.id, n, c.creator, c.title, c.body, self.__date_str(c.date)) for (n, c) in enumerate(comments) ])
+            self.__index(issue, "\n".join([c.body or "" for c in comments]))
+
+    def remove_issues_except(self, issue_ids):
+        """Remove every cached issue whose id is not in issue_ids. Returns how many were removed."""
+        keep = set([str(i) for i in issue_ids])
+        gone = [ r[0] for r in self.db().execute("SELECT id FROM issues") if not (r[0] in keep) ]
+        with self.db():
+            for issue_id in gone:
+                if self.__fts:
+                    self.db().execute("DELETE FROM search WHERE rowid = (SELECT rowid FROM issues WHERE id = ?)", (issue_id,))
+                self.db().execute("DELETE FROM comments WHERE issue_id = ?", (issue_id,))
+                self.db().execute("DELETE FROM issues WHERE id = ?", (issue_id,))
+        return len(gone)
+
+    def forget_comments(self, issue_id):
+        """Mark an issue's cached comments as stale, so that the next `idli show` asks the server."""
+        with self.db():
+            self.db().execute("UPDATE issues SET comments_cached = 0 WHERE id = ?", (str(issue_id),))
+
+    def apply_change(self, issue_id, op):
+        """Make a change the server has accepted to the cached issue, without fetching it again.
+
+        `op` is an operation as read by `idli batch`. Its comments are marked stale too.
+        Returns False for assignments, whose owner is named as the server decides: the
+        caller fetches those issues again instead."""
+        if op["op"] == "assign":
+            return False
+        issue_id = str(issue_id)
+        with self.db():
+            self.db().execute("UPDATE issues SET comments_cached = 0 WHERE id = ?", (issue_id,))
+            if op["op"] == "resolve":
+                self.db().execute("UPDATE issues SET status = ? WHERE id = ?", (int(op.get("state", "closed") == "open"), issue_id))
+            elif op["op"] == "tag":
+                row = self.db().execute("SELECT tags FROM issues WHERE id = ?", (issue_id,)).fetchone()
+                if row is not None:
+                    tags = op["tags"]
+                    if isinstance(tags, str):
+                        tags = [t for t in tags.split(",") if t]
+                    old_tags = json.loads(row[0])
+                    if op.get("remove"):
+                        new_tags = [t for t in old_tags if not (t in tags)]
+                    else:
+                        new_tags = old_tags + [t for t in tags if not (t in old_tags)]
+                    self.db().execute("UPDATE issues SET tags = ? WHERE id = ?", (json.dumps(new_tags), issue_id))
+            elif op["op"] == "comment":
+                self.db().execute("UPDATE issues SET num_comments = num_comments + 1 WHERE id = ?", (issue_id,))
+        return True
+
+    def issue_list(self, state=True, owner=None, tag=None):
+        query = "SELECT * FROM issues WHERE status = ?"
+        params = [ int(state) ]
+        if owner is not None:
+            query += " AND owner = ?"
+            params.append(owner)
+        if tag is not None:
+            query += " AND EXISTS (SELECT 1 FROM json_each(issues.tags) WHERE value = ?)"
+            params.append(tag)
+        query += " ORDER BY CAST(id AS INTEGER), id"
+        return [ self.__row_issue(r) for r in self.db().execute(query, params) ]
+
+    def query_issues(self, state=True, query=None, username=None):
+        """Cached issues matching an idli.query.Query. Exact owner and tag matches are done by SQLite."""
+        owner, tag = None, None
+        remainder = []
+        for c in (query.conditions if query else []):
+            if c.field == "owner" and c.op == "=" and owner is None:
+                owner = username if c.value == "me" else c.value
+            elif c.field == "tag" and c.op == "=" and tag is None:
+                tag = c.value
+            else:
+                remainder.append(c)
+        for i in self.issue_list(state, owner=owner, tag=tag):
+            if all([c.matches(i, username) for c in remainder]):
+                yield i
+
+    def search(self, text, state=None, owner=None, tag=None, limit=20):
+        """Cached issues containing every word of text, best match first, and facet counts.
+
+        Words ending in * match any word they begin. Returns (issues, facets), where
+        facets maps "state", "owner" and "tag" to [(value, count)], most common first,
+        counted over every match rather than only the first `limit`."""
+        words = [w for w in text.split() if w.strip('*"')]
+        if not words:
+            raise idli.IdliException("Nothing to search for.")
+        db = self.db()
+        filters, params = [], []
+        if state is not None:
+            filters.append("issues.status = ?")
+            params.append(int(state))
+        if owner is not None:
+            filters.append("issues.owner = ?")
+            params.append(owner)
+        if tag is not None:
+            filters.append("EXISTS (SELECT 1 FROM json_each(issues.tags) WHERE value = ?)")
+            params.append(tag)
+        with db: # Ends the transaction the temporary table's rows open
+            return self.__search(db, words, filters, params, limit)
+
+    def __search(self, db, words, filters, params, limit):
+        if self.__fts:
+            expression = " ".join([self.__search_term(w) for w in words])
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS hits (rowid INTEGER PRIMARY KEY, rank REAL)")
+            db.execute("DELETE FROM hits")
+            db.execute("INSERT INTO hits SELECT rowid, bm25(search, ?, ?, ?) FROM search WHERE search MATCH ?", self.search_weights + (expression,))
+            source = "hits CROSS JOIN issues ON issues.rowid = hits.rowid" # Walk the hits, not every issue
+            order = "hits.rank"
+        else:
+            source = "issues"
+            order = "CAST(issues.id AS INTEGER) DESC"
+            for w in words:
+                filters.append("(issues.title || ' ' || issues.body || ' ' || COALESCE((SELECT group_concat(body, ' ') FROM comments WHERE issue_id = issues.id), '')) LIKE ?")
+                params.append("%" + w.strip('*"') + "%")
+        where = (" WHERE " + " AND ".join(filters)) if filters else ""
+        issues = [ self.__row_issue(r) for r in db.execute("SELECT issues.* FROM " + source + where + " ORDER BY " + order + " LIMIT ?", params + [limit]) ]
+        facets = {}
+        facets["state"] = [ ("open" if r[0] else "closed", r[1]) for r in
+                            db.execute("SELECT issues.status, COUNT(*) FROM " + source + where + " GROUP BY issues.status ORDER BY 2 DESC", params) ]
+        facets["owner"] = db.execute("SELECT issues.owner, COUNT(*) FROM " + source + where + (" AND " if where else " WHERE ")
+                                     + "issues.owner IS NOT NULL GROUP BY issues.owner ORDER BY 2 DESC, 1 LIMIT 5", params).fetchall()
+        facets["tag"] = db.execute("SELECT t.value, COUNT(*) FROM " + source + ", json_each(issues.tags) t" + where
+                                   + " GROUP BY t.value ORDER BY 2 DESC, 1 LIMIT 5", params).fetchall()
+        return (issues, facets)
+
+    def __search_term(self, word):
+        # Quote each word so that FTS5 syntax in the search text is taken literally.
+        prefix = word.endswith("*")
+        term = '"' + word.strip('*"').replace('"', '""') + '"'
+        return term + ("*" if prefix else "")
+
+    def __index(self, issue, comments=None):
+        """Update the issue's search document. comments is their text, or None to keep what was indexed before."""
+        if not self.__fts:
+            return
+        rowid = self.db().execute("SELECT rowid FROM issues WHERE id = ?", (issue.id,)).fetchone()[0]
+        if comments is None:
+            row = self.db().execute("SELECT comments FROM search WHERE rowid = ?", (rowid,)).fetchone()
+            comments = row[0] if row is not None else ""
+        self.db().execute("INSERT OR REPLACE INTO search (rowid, title, body, comments) VALUES (?, ?, ?, ?)",
+                          (rowid, issue.title or "", issue.body or "", comments))
+
+    def __rebuild_search(self):
+        with self.__db:
+            self.__db.execute("DELETE FROM search")
+            self.__db.execute("""INSERT INTO search (rowid, title, body, comments)
+                                 SELECT rowid, COALESCE(title, ''), COALESCE(body, ''),
+                                        COALESCE((SELECT group_concat(body, char(10)) FROM comments WHERE issue_id = issues.id), '')
+                                 FROM issues""")
+            self.__db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('search_index', ?)", (SEARCH_INDEX_VERSION,))
+
+    def get_issue(self, issue_id):
+        """Return (issue, comments), or None unless both are cached."""
+        row = self.db().execute("SELECT * FROM issues WHERE id = ? AND comments_cached = 1", (str(issue_id),)).fetchone()
+        if row is None:
+            return None
+        issue = self.__row_issue(row)
+        comments = [ idli.IssueComment(issue, c[0], c[1], c[2], date=self.__parse_date(c[3]))
+                     for c in self.db().execute("SELECT creator, title, body, date FROM comments WHERE issue_id = ? ORDER BY seq", (issue.id,)) ]
+        return (issue, comments)
+
+    def __issue_row(self, issue):
+        return (issue.id, issue.title, issue.body, issue.creator, int(issue.status), issue.num_comments,
+                self.__date_str(issue.create_time), self.__date_str(issue.last_modified), issue.owner, json.dumps(list(issue.tags or [])))
+
+    def __row_issue(self, r):
+        return idli.Issue(r[1], r[2], r[0], r[3], status=bool(r[4]), num_comments=r[5],
+                          create_time=self.__parse_date(r[6]), last_modified=self.__parse_date(r[7]),
+                          owner=r[8], tags=json.loads(r[9]))
+
+    def __date_str(self, d):
+        if d is None:
+            return None
+        if isinstance(d, datetime.datetime):
+            return d.isoformat()
+        return str(d)
+
+    def __parse_date(self, s):
+        if s is None:
+            return None
+        try:
+            return datetime.datetime.fromisoformat(s)
+        except ValueError:
+            return s
+
+def sync(backend, cache):
+    """Fetch issues modified since the last sync and store them in the cache, and
+    remove those deleted on the server where that can be found out.
+
+    Returns the number of issues updated."""
+    since = cache.last_sync()
+    issues = backend.issues_since(since)
+    count = cache.store_issues(issues)
+    if since is None: # Everything was fetched
+        cache.remove_issues_except([i.id for i in issues])
+    else:
+        try:
+            cache.remove_issues_except(backend.issue_ids())
+        except idli.IdliNotImplementedException:
+            pass # Deleted issues stay until idli sync --full
+    # The watermark only ever comes from the server's timestamps, since our clock may not agree
+    # with its clock. Without any, the old watermark stands.
+    modified = [ i.last_modified for i in issues if isinstance(i.last_modified, datetime.datetime) ]
+    watermark = since
+    if modified:
+        watermark = max(modified) - SYNC_OVERLAP
+        if since is not None:
+            watermark = max(watermark, since)
+    cache.set_last_sync(watermark)
+    return count
@@ -0,0 +1,81 @@
+"""Thin client for a running `idli serve` daemon.
+
+This module is imported before anything else by the idli script, so it must
+stay cheap to import: no argparse, no backends, no configuration files."""
+import os
+import sys
+import json
+import socket
+
+IDLI_SOCKET_FILENAME = ".idli_socket"
+
+# Only read-only commands which never open an editor are sent to the daemon.
+DAEMON_COMMANDS = ("list", "show")
+
+CONNECT_TIMEOUT = 0.5
+
+# Options of show which take a value, which is not an issue ID.
+SHOW_VALUE_OPTIONS = ("--workers", "--format")
+
+def socket_filename():
+    return os.getenv("IDLI_SOCKET") or os.path.join(os.getenv("HOME"), IDLI_SOCKET_FILENAME)
+
+def daemon_command(argv):
+    """The name of the command argv would run, if the daemon may run it; otherwise None."""
+    if len(argv) == 0:
+        return "list"
+    if argv[0] == "show" and ("-" in argv or not show_ids(argv[1:])):
+        return None # Issue IDs are read from standard input, which the daemon cannot see
+    if argv[0] in DAEMON_COMMANDS:
+        return argv[0]
+    return None
+
+def show_ids(args):
+    """The issue IDs among the arguments of show, without the values of its options."""
+    ids = []
+    value = False
+    for a in args:
+        if value:
+            value = False
+        elif a.startswith("--") and (len(a) > 2) and not ("=" in a):
+            value = len([o for o in SHOW_VALUE_OPTIONS if o.startswith(a)]) > 0 # argparse allows abbreviations
+        elif not a.startswith("-"):
+            ids.append(a)
+    return ids
+
+def daemon_running(filename=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(filename or socket_filename())
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def try_daemon(argv):
+    """Run argv through the daemon. Returns its exit status, or None if the command must run in-process."""
+    if os.getenv("IDLI_NO_DAEMON") or os.getenv("IDLI_TRACE") or (daemon_command(argv) is None): # Traces are taken in-process
+        return None
+    filename = socket_filename()
+    if not os.path.exists(filename):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(filename)
+        sock.settimeout(None) # Listing a large project may take a while
+        request = { "argv" : list(argv), "cwd" : os.getenv("PWD") or os.getcwd() }
+        if sys.stdout.isatty(): # Tables are sized to our terminal, not the daemon's
+            request["columns"] = os.get_terminal_size(sys.stdout.fileno()).columns
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        response = json.loads(sock.makefile("rb").readline().decode("utf-8"))
+    except (OSError, ValueError): # No daemon, or it went away: these commands are safe to run again here
+        return None
+    finally:
+        sock.close()
+    sys.stdout.write(response.get("stdout", ""))
+    sys.stderr.write(response.get("stderr", ""))
+    sys.stdout.flush()
+    return response.get("status", 0)
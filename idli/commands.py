@@ -1,13 +1,20 @@
 import idli
+import idli.trace
 import idli.util as util
 import idli.config as config
 
 import argparse
+import itertools
+import sys
 
 commands = {}
 
 main_parser = argparse.ArgumentParser(description="Command line bug reporting tool")
 
+main_parser.add_argument('--trace', action='store_true', default=False, help="Print how long each phase and each request took. IDLI_TRACE=1 does the same.")
+main_parser.add_argument('--trace-file', dest='trace_file', default=None, help="Write the trace to this file instead: JSON lines if it ends in .jsonl, otherwise a Chrome trace.")
+main_parser.add_argument('--cache-stats', dest='cache_stats', action='store_true', default=False, help="Afterwards, print how many HTTP requests the response cache answered and how much it saved.")
+
 command_parsers = main_parser.add_subparsers(title = "Commands", dest="command", help="Command to run.")
 
 class Command(object):
@@ -22,6 +29,105 @@ class Command(object):
         self.args = args
         self.backend = backend or get_backend_or_fail()(self.args)
 
+    _issue_cache = None
+    def issue_cache(self):
+        if self._issue_cache is None:
+            from idli.cache import IssueCache
+            self._issue_cache = IssueCache()
+        return self._issue_cache
+
+    def use_cache(self):
+        """True if the project has been synced and the user did not ask for --fresh data."""
+        return self.issue_cache().is_synced() and not getattr(self.args, "fresh", False)
+
+    def remember_issue(self, issue, comments):
+        """Write an issue fetched from the server through to the cache, if the project uses one."""
+        if self.issue_cache().is_synced():
+            self.issue_cache().store_issue(issue, comments)
+
+    def find_issues(self, state, query):
+        """Issues in `state` ("open" or "closed") matching an idli.query.Query, from the cache if it may be used."""
+        if self.use_cache():
+            username = None
+            if "me" in [c.value for c in query.conditions]:
+                username = self.backend.username()
+            return self.issue_cache().query_issues(state == "open", query, username)
+        return self.backend.query_issues(state, query, limit=getattr(self.args, "limit", None))
+
+    def target_ids(self, state):
+        """The IDs a mutation applies to: those given, separated by commas, or those of the
+        `state` issues matching --where."""
+        import idli.query
+        if self.args.where is not None:
+            if self.args.id is not None:
+                raise idli.IdliException("Give either issue IDs or --where, not both.")
+            return [i.id for i in self.find_issues(state, idli.query.parse(self.args.where))]
+        if self.args.id is None:
+            raise idli.IdliException("No issue ID given.")
+        return [i for i in self.args.id.split(",") if i]
+
+    def is_bulk(self, ids):
+        return (self.args.where is not None) or (len(ids) != 1)
+
+    def run_bulk(self, op, ids, done, suffix=""):
+        """Apply a batch operation to many issues and print a summary, e.g. "Resolved 57 of 60 issues."."""
+        import idli.batch
+        import idli.concurrency
+        if not ids:
+            print("No issues to change.")
+            return
+        workers = self.args.workers or idli.concurrency.DEFAULT_WORKERS
+        synced = self.issue_cache().is_synced()
+        failed = []
+        stale = []
+        for result in idli.batch.run_bulk(self.backend, op, ids, workers):
+            if result["status"] == "ok":
+                if synced and not self.issue_cache().apply_change(result["id"], op):
+                    stale.append(result["id"])
+            else:
+                failed.append(result)
+        print(done + " " + str(len(ids) - len(failed)) + " of " + str(len(ids)) + " issues" + suffix + ".")
+        for r in failed:
+            print("  " + str(r["id"]) + ": " + r["error"])
+        self.refetch_issues(stale, workers)
+
+    def refetch_issues(self, ids, workers=None):
+        """Fetch changed issues again, `workers` at a time, and store them in the cache.
+        Those which cannot be fetched are marked stale."""
+        import idli.concurrency
+        def fetch(issue_id):
+            try:
+                return self.backend.get_issue(issue_id)
+            except idli.IdliException:
+                return None
+        for issue_id, result in zip(ids, idli.concurrency.bounded_map(fetch, ids, workers or idli.concurrency.DEFAULT_WORKERS)):
+            if result is None:
+                self.issue_cache().forget_comments(issue_id)
+            else:
+                self.issue_cache().store_issue(*result)
+
+    def show_changed_issue(self, issue_id, op, result, message=None):
+        """Print an issue after changing it, unless --quiet was given.
+
+        `op` describes the change, as an operation of `idli batch` does. `result`
+        is whatever the backend's mutation returned; the issue is only fetched
+        again if that does not describe it, and with --quiet only if the cache
+        cannot be updated without it."""
+        if getattr(self.args, "quiet", False):
+            if result is not None:
+                self.remember_issue(*result)
+            elif self.issue_cache().is_synced() and not self.issue_cache().apply_change(issue_id, op):
+                self.refetch_issues([issue_id])
+            return
+        if result is None:
+            result = self.backend.get_issue(issue_id)
+        issue, comments = result
+        self.remember_issue(issue, comments)
+        if message is not None:
+            print(message)
+            print()
+        util.print_issue(issue, comments)
+
 __date_format = "<%Y/%m/%d %H:%M>"
 
 class ConfigureCommand(Command):
@@ -69,63 +175,151 @@ init_parser = __register_command(InitializeCommand, help="Initialize a project")
 init_parser.add_argument('--no-verify', help="do not verify TLS certificates", action="store_true")
 init_subparser = init_parser.add_subparsers(dest="backend_name")
 
+# Output formats of list, search and show.
+format_option = ('format', { 'type' : str, 'default' : "table", 'choices' : ["table", "jsonl", "csv", "tsv"], 'help' : 'Output format. table (the default) is for people, sized to the terminal; jsonl, csv and tsv are for other programs.' } )
+
 class ListCommand(Command):
     name = "list"
     options = [ ('state', { 'type' : str, 'default' : "open", 'choices' : ["open", "closed"], 'help' : 'State of issues to list (open or closed). Defaults to open if unspecified.' } ),
                 ('limit', { 'type' : int, 'default' : None, 'help' : "Number of issues to list" } ),
                 ('tag', { 'type' : str, 'default' : None, 'help' : "Tag to search for" } ),
+                ('where', { 'type' : str, 'default' : None, 'help' : 'Conditions issues must meet, e.g. "owner=me and tag=db and created>2026-01-01". Fields: id, owner, creator, tag, title, body, created, modified. Operators: = != < <= > >= and ~ (contains).' } ),
+                format_option,
                 ]
     flags = [ ("mine", 'Display only issues for which I am the owner.'),
+              ("fresh", 'Ignore the local cache and ask the server.'),
               ]
 
-    date_format = "%Y/%m/%d"
-
     def run(self):
-        filtered = self.args.mine or self.args.tag
-        issues = []
-        if filtered:
-            issues = self.backend.filtered_issue_list(self.args.state, self.args.mine, self.args.tag)
-        else:
-            issues = self.backend.issue_list(self.args.state)
-        self.print_issue_list(issues, self.args.limit)
+        import idli.query
+        query = idli.query.parse(self.args.where) & idli.query.from_flags(self.args.mine, self.args.tag)
+        self.print_issue_list(self.find_issues(self.args.state, query), self.args.limit)
 
-    def __truncate_ljust_string(self, s, l, no_truncate=False):
-        s = str(s)
-        if len(s) <= l or no_truncate:
-            return s.ljust(l)
-        else:
-            return s[0:l-3]+"..."
+    def print_issue_list(self, issues, limit=None):
+        """Print list of issues to stdout, in --format. Issues may be any iterable, and are printed as they arrive."""
+        import idli.output
+        with idli.output.Writer() as out:
+            rows = idli.output.issue_list_format(self.args.format, out, idli.output.terminal_width(out.stream))
+            for n, i in enumerate(itertools.islice(issues, limit)):
+                with idli.trace.span("render"):
+                    rows.row(i)
+                if n == 0: # Show the first row straight away, even when stdout is a pipe
+                    out.flush()
 
-    def __format_issue_line(self, id, date, title, creator, owner, num_comments, is_title_line=False):
-        if date.__class__ == str:
-            date_str = date
-        else:
-            date_str = date.strftime(self.date_format)
-        return id.ljust(6) + " " + self.__truncate_ljust_string(date_str,10) + "  " + self.__truncate_ljust_string(title, 35) + "  " + self.__truncate_ljust_string(creator,12) + "  " + self.__truncate_ljust_string(owner, 12) + "  " + self.__truncate_ljust_string(num_comments, 5, is_title_line)
+list_parser = __register_command(ListCommand, help="Print a list of issues")
 
-    def __state(self):
-        if (self.args.state == "open"):
-            return True
-        if (self.args.state == "closed"):
-            return False
+class SearchCommand(ListCommand):
+    name = "search"
+    options = [ ('state', { 'type' : str, 'default' : "all", 'choices' : ["open", "closed", "all"], 'help' : 'State of issues to search. Defaults to all.' } ),
+                ('owner', { 'type' : str, 'default' : None, 'help' : 'Only issues owned by this user ("me" for yourself).' } ),
+                ('tag', { 'type' : str, 'default' : None, 'help' : 'Only issues with this tag.' } ),
+                ('limit', { 'type' : int, 'default' : 20, 'help' : 'Number of issues to list. Defaults to 20.' } ),
+                format_option,
+                ]
+    required = [ ('text', { 'type' : str, 'nargs' : '+', 'help' : 'Words to search for in titles, bodies and comments. A word ending in * matches any word it begins.' } ), ]
+    flags = []
 
-    def print_issue_list(self, issues, limit=None):
-        """Print list of issues to stdout."""
-        print(self.__format_issue_line("ID", "date", "title", "creator", "owner", "# comments", True))
-        if (limit is None):
-            limit = len(issues)
-        for i in issues[0:limit]:
-            print(self.__format_issue_line(i.id, i.create_time, i.title, i.creator, i.owner or "", i.num_comments))
+    def run(self):
+        if not self.issue_cache().is_synced():
+            raise idli.IdliException("Search uses the local cache, which is empty. Run `idli sync` first.")
+        state = { "open" : True, "closed" : False, "all" : None }[self.args.state]
+        owner = self.args.owner
+        if owner == "me":
+            owner = self.backend.username()
+        issues, facets = self.issue_cache().search(" ".join(self.args.text), state=state, owner=owner, tag=self.args.tag, limit=self.args.limit)
+        self.print_issue_list(issues)
+        if self.args.format != "table": # Nothing but issues for other programs
+            return
+        print()
+        for name in ("state", "owner", "tag"):
+            if facets[name]:
+                print(name + ": " + ", ".join([str(value) + " " + str(count) for (value, count) in facets[name]]))
 
-list_parser = __register_command(ListCommand, help="Print a list of issues")
+search_parser = __register_command(SearchCommand, help="Search the issues in the local cache.")
 
 class ViewIssueCommand(Command):
     name = "show"
-    required = [('id', { 'type' : str, 'help' : 'issue ID' }), ]
+    required = [('ids', { 'type' : str, 'nargs' : '*', 'metavar' : 'id', 'help' : 'Issue IDs, separated by spaces or commas. Read from standard input if none are given, or "-".' }), ]
+    options = [ ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to fetch at once.' } ),
+                format_option,
+                ]
+    flags = [ ("fresh", 'Ignore the local cache and ask the server.'),
+              ]
 
     def run(self):
-        issue, comments = self.backend.get_issue(self.args.id)
-        util.print_issue(issue, comments)
+        import idli.output
+        import idli.concurrency
+        ids = self.issue_ids()
+        out = idli.output.Writer()
+        if self.args.format == "table":
+            rows = None
+        else:
+            rows = idli.output.IssueRecords(out, self.args.format, idli.output.FIELDS + ("body",))
+        if len(ids) == 1: # Errors are reported as they always were
+            self.print_issue(out, rows, *self.fetch(ids[0]))
+            out.flush()
+            return
+        # Cached issues are read here, since the cache may only be used from this thread.
+        cached = {}
+        if self.use_cache():
+            for issue_id in ids:
+                cached[issue_id] = self.issue_cache().get_issue(issue_id)
+        def fetch(issue_id):
+            if cached.get(issue_id) is not None:
+                return (cached[issue_id], True)
+            try:
+                return (self.backend.get_issue(issue_id), False)
+            except idli.IdliException as e:
+                return (e, False)
+        workers = self.args.workers or idli.concurrency.DEFAULT_WORKERS
+        for n, (issue_id, (result, from_cache)) in enumerate(zip(ids, idli.concurrency.bounded_map(fetch, ids, workers))):
+            if isinstance(result, idli.IdliException):
+                self.print_error(out, rows, n, issue_id, result.value)
+            else:
+                if not from_cache:
+                    self.remember_issue(*result)
+                self.print_issue(out, rows, *result, n=n)
+            out.flush() # Each issue is shown as soon as it and those before it have arrived
+
+    def print_issue(self, out, rows, issue, comments, n=0):
+        if rows is not None:
+            rows.row(issue, comments)
+            return
+        if n > 0:
+            out.line("-" * 40)
+        util.print_issue(issue, comments, out)
+
+    def print_error(self, out, rows, n, issue_id, message):
+        if rows is None:
+            if n > 0:
+                out.line("-" * 40)
+            out.line(message)
+            out.line()
+        elif self.args.format == "jsonl": # As batch reports failures
+            import json
+            out.line(json.dumps({ "id" : issue_id, "error" : message }))
+        else:
+            out.flush()
+            sys.stderr.write(str(issue_id) + ": " + message + "\n")
+
+    def issue_ids(self):
+        """The IDs given as arguments, or read from standard input, in order."""
+        words = self.args.ids
+        if (not words) or (words == ["-"]):
+            words = sys.stdin.read().split()
+        ids = [i for w in words for i in w.split(",") if i]
+        if not ids:
+            raise idli.IdliException("No issue IDs given.")
+        return ids
+
+    def fetch(self, issue_id):
+        result = None
+        if self.use_cache():
+            result = self.issue_cache().get_issue(issue_id)
+        if result is None:
+            result = self.backend.get_issue(issue_id)
+            self.remember_issue(*result)
+        return result
 
 view_issue_parser = __register_command(ViewIssueCommand, help="Display an issue")
 
@@ -135,11 +329,17 @@ class AddIssueCommand(Command):
                 ('body', { 'type' : str, 'default' : None, 'help' : 'Body of issue.' } ),
                 ('tags', { 'type' : str, 'default' : '', 'help' : 'List of tags for issue. A string, with tags separated by commas. E.g., "--tags=widgets,frobnicator"' }),
                 ]
+    flags = [ ("quiet", 'Only print the ID of the new issue.'),
+              ]
 
     def run(self):
         title, body = self.get_title_body()
         tags = [t for t in self.args.tags.split(",") if t] # Filter out any empty strings
         issue = self.backend.add_issue(title, body, tags=tags)
+        self.remember_issue(issue[0], issue[1])
+        if self.args.quiet:
+            print(issue[0].id)
+            return
         print("Issue added!")
         print()
         util.print_issue(issue[0], issue[1])
@@ -160,19 +360,18 @@ class AddCommentCommand(Command):
     required = [('id', { 'type' : str, 'help' : 'issue ID' }), ]
     options = [ ('body', { 'type' : str, 'default' : None, 'help' : 'Body of issue.' } ),
                 ]
+    flags = [ ("quiet", 'Do not print the issue afterwards.'),
+              ]
 
     def run(self):
-        issue = self.backend.get_issue(self.args.id) # Will raise error message if issue cannot be found
         message = self.args.body
         if (message is None):
+            self.backend.check_issue_exists(self.args.id) # Will raise error message if issue cannot be found
             message, exit_status = util.get_string_from_editor("# Type your comment here.", prefix='idli-comment-')
             if (exit_status != 0):
                 raise idli.IdliException("Operation cancelled.")
-        self.backend.add_comment(self.args.id, message)
-        print("Comment added!")
-        print()
-        issue, comments = self.backend.get_issue(self.args.id)
-        util.print_issue(issue, comments)
+        result = self.backend.add_comment(self.args.id, message)
+        self.show_changed_issue(self.args.id, { "op" : "comment" }, result, "Comment added!")
 
 add_comment_parser = __register_command(AddCommentCommand, help="Comment on an issue")
 
@@ -180,79 +379,269 @@ class ResolveIssueCommand(Command):
     name = "resolve"
     options = [ ('state', { 'type':str, 'default': "closed", 'choices' : ["open", "closed"], 'help':'State of issues to list (open or closed)' } ),
                 ('message', { 'type' : str, 'default' : None, 'help':'Resolution message.' } ),
+                ('where', { 'type' : str, 'default' : None, 'help' : 'Change every issue not yet in the new state matching these conditions, as for list --where, instead of the given IDs.' } ),
+                ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to change at once.' } ),
                 ]
-    required = [ ('id', { 'type' :str, 'help' : "ID of issue." } ), ]
+    required = [ ('id', { 'type' :str, 'nargs' : '?', 'default' : None, 'help' : "ID of issue, or several separated by commas." } ), ]
+    flags = [ ("quiet", 'Do not print the issue afterwards.'),
+              ]
 
     def run(self):
-        message = self.args.message
+        ids = self.target_ids("open" if self.args.state == "closed" else "closed")
         message = self.args.message
         if (message is None):
+            if not self.is_bulk(ids):
+                self.backend.check_issue_exists(ids[0])
             message, exit_status = util.get_string_from_editor("Issue resolved.\n# More details go here.", prefix='idli-resolve-')
             if (exit_status != 0):
                 raise idli.IdliException("Operation cancelled.")
-        issue = self.backend.resolve_issue(self.args.id, status = self.args.state, message = message)
-        issue, comments = self.backend.get_issue(self.args.id)
-        print("Issue state changed to " + str(self.args.state))
-        print()
-        util.print_issue(issue, comments)
+        if self.is_bulk(ids):
+            self.run_bulk({ "op" : "resolve", "state" : self.args.state, "message" : message }, ids, "Resolved" if self.args.state == "closed" else "Reopened")
+            return
+        result = self.backend.resolve_issue(ids[0], status = self.args.state, message = message)
+        self.show_changed_issue(ids[0], { "op" : "resolve", "state" : self.args.state }, result, "Issue state changed to " + str(self.args.state))
 
 resolve_issue_parser = __register_command(ResolveIssueCommand, help="Resolve an issue")
 
 class TagIssueCommand(Command):
     name = "tag"
-    required = [ ('id', { 'type' : str, 'help' : "ID of issue." } ),
-                 ('tags', { 'type' : str, 'help' : 'List of tags for issue. A string, with tags separated by commas. E.g., "widgets,frobnicator"' }),
+    options = [ ('where', { 'type' : str, 'default' : None, 'help' : 'Change every open issue matching these conditions, as for list --where, instead of the given IDs.' } ),
+                ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to change at once.' } ),
+                ]
+    required = [ ('id', { 'type' : str, 'help' : "ID of issue, or several separated by commas. Omitted with --where." } ),
+                 ('tags', { 'type' : str, 'nargs' : '?', 'default' : None, 'help' : 'List of tags for issue. A string, with tags separated by commas. E.g., "widgets,frobnicator"' }),
                  ]
     flags = [ ("remove", 'If this flag is set, the tags will be removed instead of added.'),
+              ("quiet", 'Do not print the issue afterwards.'),
               ]
 
     def run(self):
-        issue, comments = self.backend.get_issue(self.args.id) # This will raise an error if the issue does not exist.
+        if self.args.tags is None: # With --where, the only argument is the tags
+            if self.args.where is None:
+                raise idli.IdliException("No tags given.")
+            self.args.id, self.args.tags = None, self.args.id
         tags = [t for t in (self.args.tags).split(",") if t] # Remove empty tags
 
+        ids = self.target_ids("open")
+        if self.is_bulk(ids):
+            self.run_bulk({ "op" : "tag", "tags" : tags, "remove" : self.args.remove }, ids, "Untagged" if self.args.remove else "Tagged")
+            return
+
         if self.args.remove: #If user asked to remove nonexistent tag, raise an error.
+            issue, comments = self.backend.get_issue(ids[0]) # This will raise an error if the issue does not exist.
             for t in tags:
                 if not (t in issue.tags):
-                    raise idli.IdliException("The issue " + str(self.args.id) + " does not have the tag " + t + ". No action performed. Tags available: " + ", ".join(issue.tags))
-                tags = [t for t in tags if not (t in issue.tags)]
+                    raise idli.IdliException("The issue " + str(ids[0]) + " does not have the tag " + t + ". No action performed. Tags available: " + ", ".join(issue.tags))
 
-        #Now actually tag the issue.
-        self.backend.tag_issue(self.args.id, tags, self.args.remove)
-        issue,comments = self.backend.get_issue(self.args.id)
-        util.print_issue(issue, comments)
+        #Now actually tag the issue. A missing issue is reported by the server.
+        result = self.backend.tag_issue(ids[0], tags, self.args.remove)
+        self.show_changed_issue(ids[0], { "op" : "tag", "tags" : tags, "remove" : self.args.remove }, result)
 
 tag_issue_parser = __register_command(TagIssueCommand, help="Tag an issue")
 
 
 class AssignIssueCommand(Command):
     name = "assign"
-    options = [ ('message', { 'type' : str, 'default' : None, 'help' : 'Resolution message.' } ), ]
-    required = [ ('id', { 'type' : str, 'help' : "ID of issue."}),
-                 ('user', { 'type': str, 'help' :"username."})
+    options = [ ('message', { 'type' : str, 'default' : None, 'help' : 'Resolution message.' } ),
+                ('where', { 'type' : str, 'default' : None, 'help' : 'Change every open issue matching these conditions, as for list --where, instead of the given IDs.' } ),
+                ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to change at once.' } ),
+                ]
+    required = [ ('id', { 'type' : str, 'help' : "ID of issue, or several separated by commas. Omitted with --where."}),
+                 ('user', { 'type': str, 'nargs' : '?', 'default' : None, 'help' :"username."})
                  ]
+    flags = [ ("quiet", 'Do not print the issue afterwards.'),
+              ]
 
     def run(self):
+        if self.args.user is None: # With --where, the only argument is the user
+            if self.args.where is None:
+                raise idli.IdliException("No user given.")
+            self.args.id, self.args.user = None, self.args.id
+        ids = self.target_ids("open")
         message = self.args.message
         if (message is None):
+            if not self.is_bulk(ids):
+                self.backend.check_issue_exists(ids[0])
             message, exit_status = util.get_string_from_editor("Please resolve this issue.", prefix='idli-assign-')
             if (exit_status != 0):
                 raise idli.IdliException("Operation cancelled.")
-        issue = self.backend.assign_issue(self.args.id, user=self.args.user, message = message)
-        issue, comments = self.backend.get_issue(self.args.id)
-        print("Issue " + self.args.id + " assigned to " + str(self.args.user))
-        print()
-        util.print_issue(issue, comments)
+        if self.is_bulk(ids):
+            self.run_bulk({ "op" : "assign", "user" : self.args.user, "message" : message }, ids, "Assigned", " to " + self.args.user)
+            return
+        result = self.backend.assign_issue(ids[0], user=self.args.user, message = message)
+        self.show_changed_issue(ids[0], { "op" : "assign", "user" : self.args.user }, result, "Issue " + ids[0] + " assigned to " + str(self.args.user))
 
 assign_issue_parser = __register_command(AssignIssueCommand, help="Assign issue to user.")
 
-def run_command():
-    parsed = main_parser.parse_args()
+class SyncCommand(Command):
+    name = "sync"
+    flags = [ ("full", 'Discard the local cache and download every issue again.'),
+              ]
+
+    def run(self):
+        import idli.cache
+        cache = self.issue_cache()
+        if self.args.full:
+            cache.clear()
+        count = idli.cache.sync(self.backend, cache)
+        print("Synced " + str(count) + " issues to " + cache.filename)
+
+sync_parser = __register_command(SyncCommand, help="Update the local issue cache.")
+
+class ExportCommand(Command):
+    name = "export"
+    required = [ ('file', { 'type' : str, 'nargs' : '?', 'default' : '-', 'help' : 'Archive to write, as JSON lines; compressed if the name ends in .zst. Standard output if omitted or "-".' } ), ]
+    options = [ ('state', { 'type' : str, 'default' : "all", 'choices' : ["open", "closed", "all"], 'help' : 'State of issues to export. Defaults to all.' } ),
+                ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to fetch at once.' } ),
+                ]
+
+    def run(self):
+        import idli.archive
+        import idli.concurrency
+        states = { "open" : (True,), "closed" : (False,), "all" : (True, False) }[self.args.state]
+        out = idli.archive.open_archive(self.args.file, "w")
+        try:
+            issues, comments = idli.archive.export_issues(self.backend, out, states, self.args.workers or idli.concurrency.DEFAULT_WORKERS)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        summary = "Exported " + str(issues) + " issues and " + str(comments) + " comments"
+        if self.args.file == "-":
+            sys.stderr.write(summary + ".\n")
+        else:
+            print(summary + " to " + self.args.file + ".")
+
+export_parser = __register_command(ExportCommand, help="Write every issue, with its comments, to an archive.")
+
+class ImportCommand(Command):
+    name = "import"
+    required = [ ('file', { 'type' : str, 'help' : 'Archive written by idli export, or "-" for standard input.' } ), ]
+    options = [ ('map', { 'type' : str, 'default' : None, 'help' : 'File of old and new issue IDs, tab separated. Defaults to the archive name plus .idmap.' } ),
+                ('checkpoint', { 'type' : str, 'default' : None, 'help' : 'File recording progress, so that an interrupted import resumes. Defaults to the map name plus .checkpoint.' } ),
+                ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of issues to import at once.' } ),
+                ]
+
+    def run(self):
+        import idli.archive
+        import idli.concurrency
+        map_filename = self.args.map
+        if map_filename is None:
+            if self.args.file == "-":
+                raise idli.IdliException("Give --map when reading the archive from standard input.")
+            map_filename = self.args.file + ".idmap"
+        stream = idli.archive.open_archive(self.args.file, "r")
+        progress = None
+        counts = { "ok" : 0, "skipped" : 0, "error" : 0 }
+        try:
+            records = idli.archive.read_archive(stream)
+            progress = idli.archive.ImportProgress(map_filename, self.args.checkpoint or (map_filename + ".checkpoint"))
+            for result in idli.archive.import_issues(self.backend, records, progress, self.args.workers or idli.concurrency.DEFAULT_WORKERS):
+                counts[result["status"]] += 1
+                for w in result["warnings"]:
+                    print("  " + result["id"] + ": " + w)
+                if result["status"] == "error":
+                    print("  " + result["id"] + ": " + result["error"])
+        finally:
+            if progress is not None:
+                progress.close()
+            if stream is not sys.stdin:
+                stream.close()
+        print("Imported " + str(counts["ok"]) + " issues (" + str(counts["skipped"]) + " already imported, " + str(counts["error"]) + " failed). IDs are mapped in " + map_filename + ".")
+        if counts["error"]:
+            print("Run the same command again to retry the failed issues.")
+
+import_parser = __register_command(ImportCommand, help="Recreate the issues of an archive written by idli export.")
+
+class BatchCommand(Command):
+    name = "batch"
+    required = [ ('file', { 'type' : str, 'nargs' : '?', 'default' : '-', 'help' : 'File of JSON lines to run, one operation per line. Reads standard input if omitted or "-".' } ), ]
+    options = [ ('workers', { 'type' : int, 'default' : None, 'help' : 'Number of operations to run at once. Operations on the same issue always run in order.' } ), ]
+
+    def run(self):
+        import json
+        import idli.batch
+        import idli.concurrency
+        workers = self.args.workers or idli.concurrency.DEFAULT_WORKERS
+        if self.args.file == "-":
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(self.args.file)
+            except IOError as e:
+                raise idli.IdliException("Could not read " + self.args.file + ": " + str(e))
+        try:
+            for result in idli.batch.run_batch(self.backend, idli.batch.read_operations(stream), workers):
+                print(json.dumps(result))
+                sys.stdout.flush()
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+batch_parser = __register_command(BatchCommand, help="Run a stream of JSON operations.")
+
+class ServeCommand(Command):
+    name = "serve"
+    options = [ ('socket', { 'type' : str, 'default' : None, 'help' : 'Unix socket to listen on. Defaults to $IDLI_SOCKET, or ~/.idli_socket.' } ), ]
+
+    def __init__(self, args, backend = None):
+        self.args = args # The daemon serves every project, so it has no backend of its own
+
+    def run(self):
+        import idli.server
+        idli.server.serve(self.args.socket)
+
+serve_parser = __register_command(ServeCommand, help="Run a daemon which answers list and show quickly.")
+
+# Options of idli itself, and whether each takes a value (which is not a command name).
+GLOBAL_OPTIONS = { "--trace" : False, "--trace-file" : True, "--cache-stats" : False }
+
+def command_name(argv):
+    """The command argv names, i.e. its first argument which is neither an option of idli nor the value of one."""
+    value = False
+    for a in argv:
+        if value:
+            value = False
+        elif a.startswith("--") and (len(a) > 2) and not ("=" in a):
+            if a in GLOBAL_OPTIONS:
+                value = GLOBAL_OPTIONS[a]
+            else: # argparse allows abbreviations
+                value = len([o for o in GLOBAL_OPTIONS if o.startswith(a) and GLOBAL_OPTIONS[o]]) > 0
+        elif not a.startswith("-"):
+            return a
+    return None
+
+def run_command(argv=None, backend=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if command_name(argv) in ("init", "config"): # Only these need the full list of backends
+        from idli.backends import add_backend_arguments
+        add_backend_arguments()
+    parsed = main_parser.parse_args(argv)
+    if (parsed.trace or parsed.trace_file) and not idli.trace.enabled():
+        idli.trace.start(parsed.trace_file)
     cmd_arg = parsed.command
     if not cmd_arg:
         cmd_arg = 'list'
     command = commands[cmd_arg]
-    command_runner = command(parsed)
     try:
-        result = command_runner.run()
+        with idli.trace.span("backend"):
+            command_runner = command(parsed, backend)
+        with idli.trace.span("command " + cmd_arg):
+            command_runner.run()
     except idli.IdliException as e:
         print(e.value)
+    finally:
+        idli.trace.finish()
+        if parsed.cache_stats:
+            print_cache_stats()
+
+def print_cache_stats():
+    import idli.httpcache
+    cache = idli.httpcache.get_cache()
+    if cache is None:
+        sys.stderr.write("The HTTP response cache is turned off ([transport] http_cache).\n")
+        return
+    sys.stderr.write("\nHTTP response cache " + cache.filename + ": " + str(cache.num_entries()) + " responses, "
+                     + idli.httpcache.format_bytes(cache.size()) + "\n")
+    sys.stderr.write(idli.httpcache.format_stats("this command", cache.session) + "\n")
+    sys.stderr.write(idli.httpcache.format_stats("all commands", cache.totals()) + "\n")
@@ -0,0 +1,50 @@
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 8
+
+def bounded_map(func, items, workers=DEFAULT_WORKERS):
+    """Like map(func, items), but runs up to `workers` calls at once in threads.
+
+    Results are yielded in the order of `items`, each as soon as it and all
+    earlier results are available. Only a bounded window of items is read
+    ahead, so `items` may be a generator of any length."""
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for f in pending:
+            f.cancel()
+        executor.shutdown(wait=True)
+
+__shared_executor = None
+__shared_lock = threading.Lock()
+
+def shared_executor():
+    """One executor for the whole process, for small pieces of work started from any thread."""
+    global __shared_executor
+    with __shared_lock:
+        if __shared_executor is None:
+            __shared_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="idli-shared")
+        return __shared_executor
+
+def both(first, second):
+    """(first(), second()), with the two calls made at once.
+
+    second() runs in the shared executor and first() in this thread, so no pool
+    is made for the pair, and callers may themselves be workers of a pool."""
+    future = shared_executor().submit(second)
+    result = first()
+    return (result, future.result())
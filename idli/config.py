@@ -1,6 +1,9 @@
 from configparser import ConfigParser, NoSectionError
+import io
 import os
 import argparse
+import tempfile
+import contextlib
 import idli
 
 IDLI_PROJECT_FILENAME = ".idli"
@@ -13,57 +16,191 @@ class IdliMissingConfigException(idli.IdliException):
         return repr(self.value)
 
 def global_config_filename():
-    return os.path.join(os.getenv("HOME"), IDLI_CONFIG_FILENAME)
+    return __snapshot.global_filename
 
 def local_config_filename():
-    pwd = os.getenv("PWD")
-    cfg_filename = os.path.join(pwd, IDLI_PROJECT_FILENAME)
-    while (not os.path.exists(cfg_filename)) and (pwd != "/"):
-        pwd = os.path.split(pwd)[0]
-        cfg_filename = os.path.join(pwd, IDLI_PROJECT_FILENAME)
-    if (pwd == "/"):
-        return os.path.join(os.getenv("PWD"), IDLI_PROJECT_FILENAME)
-    else:
-        return os.path.join(pwd, IDLI_PROJECT_FILENAME)
+    return __snapshot.local_filename
+
+def find_local_config(pwd):
+    """The .idli file in pwd or the nearest directory above it, or pwd/.idli if there is none."""
+    directory = pwd
+    while not os.path.exists(os.path.join(directory, IDLI_PROJECT_FILENAME)):
+        if directory == "/":
+            return os.path.join(pwd, IDLI_PROJECT_FILENAME)
+        directory = os.path.split(directory)[0]
+    return os.path.join(directory, IDLI_PROJECT_FILENAME)
 
 def global_config_file():
     open(global_config_filename(),'w').close() # Equivalent to touching the file, make sure it exists first
     return open(global_config_filename(),'r+')
 
-global_cfg = ConfigParser()
-local_cfg = ConfigParser()
+class ConfigSection(object):
+    """One section of the configuration, with local values overriding global ones,
+    read as attributes: section.base_url. Missing names raise IdliMissingConfigException."""
+    def __init__(self, name, values):
+        self._name = name
+        self.__dict__.update(values)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        raise IdliMissingConfigException(self._name, name)
+
+class ConfigSnapshot(object):
+    """Both configuration files as they were when the snapshot was taken.
+
+    The project's .idli file is looked up once, when the snapshot is made."""
+    def __init__(self, pwd, home):
+        self.global_filename = os.path.join(home, IDLI_CONFIG_FILENAME)
+        self.local_filename = find_local_config(pwd)
+        self.stamp = (_file_stamp(self.global_filename), _file_stamp(self.local_filename))
+        self.global_cfg = _parse(*self.stamp[0])
+        self.local_cfg = _parse(*self.stamp[1])
+        self.__sections = {}
+        self.__copied = set() # Files whose parser is our own copy, not the one shared through _parsed
+
+    def get(self, section, name):
+        if (self.local_cfg.has_option(section, name)): #Local should override global
+            return self.local_cfg.get(section, name)
+        if (self.global_cfg.has_option(section, name)):
+            return self.global_cfg.get(section, name)
+        raise IdliMissingConfigException(section, name)
+
+    def section(self, name, defaults={}):
+        key = (name, tuple(sorted(defaults.items()))) # Callers may want different defaults for one section
+        if not (key in self.__sections):
+            values = dict(defaults)
+            for c in (self.global_cfg, self.local_cfg):
+                if c.has_section(name):
+                    values.update(c.items(name))
+            self.__sections[key] = ConfigSection(name, values)
+        return self.__sections[key]
+
+    def set(self, section, name, value, global_val=True):
+        """Change a value in memory. Returns the name of the file which must be written."""
+        filename = self.global_filename if global_val else self.local_filename
+        if not (filename in self.__copied): # The parsed file is shared; it only changes once written
+            if global_val:
+                self.global_cfg = _copy(self.global_cfg)
+            else:
+                self.local_cfg = _copy(self.local_cfg)
+            self.__copied.add(filename)
+        cfg = self.global_cfg if global_val else self.local_cfg
+        if (not cfg.has_section(section)):
+            cfg.add_section(section)
+        cfg.set(section, name, value)
+        self.__sections = {}
+        return filename
+
+    def write(self, filename):
+        """Replace filename with our copy of it, atomically."""
+        cfg = self.global_cfg if filename == self.global_filename else self.local_cfg
+        fd, temp = tempfile.mkstemp(prefix=os.path.basename(filename) + ".", dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, "w") as f:
+                cfg.write(f)
+            if os.path.exists(filename):
+                os.chmod(temp, os.stat(filename).st_mode & 0o777)
+            else: # mkstemp makes the file private; give it the mode open() would have
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temp, 0o666 & ~umask)
+            os.replace(temp, filename)
+        except:
+            os.unlink(temp)
+            raise
+        # Remember what we wrote, so that the next load need not parse it again.
+        stamp = _file_stamp(filename)
+        _parsed[filename] = (stamp[1], cfg)
+        self.__copied.discard(filename) # Shared now
+        self.stamp = tuple([ stamp if s[0] == filename else s for s in self.stamp ])
+
+def _file_stamp(filename):
+    try:
+        return (filename, os.stat(filename).st_mtime_ns)
+    except OSError:
+        return (filename, None)
+
+def _copy(cfg):
+    f = io.StringIO()
+    cfg.write(f)
+    f.seek(0)
+    result = ConfigParser()
+    result.read_file(f)
+    return result
+
+# Parsed files by name, with the modification time they were parsed at.
+_parsed = {}
+
+def _parse(filename, mtime):
+    entry = _parsed.get(filename)
+    if (entry is not None) and (entry[0] == mtime):
+        return entry[1]
+    result = ConfigParser()
+    if mtime is not None:
+        try:
+            result.read_file(open(filename, "r"))
+        except IOError as e:
+            pass # If config files don't exist, don't worry about it yet
+    _parsed[filename] = (mtime, result)
+    return result
+
+__snapshot = None
+global_cfg = None
+local_cfg = None
+
+def snapshot():
+    return __snapshot
 
 def get_config_value(section, name):
-    if (local_cfg.has_option(section, name)): #Local should override global
-        return local_cfg.get(section, name)
-    if (global_cfg.has_option(section, name)):
-        return global_cfg.get(section, name)
-    raise IdliMissingConfigException(section, name)
+    return __snapshot.get(section, name)
+
+def section(name, defaults={}):
+    return __snapshot.section(name, defaults)
+
+__pending = None
+
+@contextlib.contextmanager
+def batch():
+    """Write the files changed by set_config_value calls in the block once each, at its end."""
+    global __pending
+    if __pending is not None: # Already batching
+        yield
+        return
+    __pending = []
+    try:
+        yield
+        for filename in __pending:
+            __snapshot.write(filename)
+    finally:
+        __pending = None
 
 def set_config_value(section, name, value, global_val=True):
-    cfg = global_cfg #Get local or global value
-    if (not global_val):
-        cfg = local_cfg
+    global global_cfg, local_cfg
+    filename = __snapshot.set(section, name, value, global_val)
+    global_cfg, local_cfg = __snapshot.global_cfg, __snapshot.local_cfg
+    if __pending is None:
+        __snapshot.write(filename)
+    elif not (filename in __pending):
+        __pending.append(filename)
 
-    if (not cfg.has_section(section)): # Set value
-        cfg.add_section(section)
-    cfg.set(section, name, value)
+def config_stamp():
+    """Identify the current contents of both configuration files, by name and modification time."""
+    return (_file_stamp(__snapshot.global_filename), _file_stamp(__snapshot.local_filename))
 
-    if (global_val): # Save file
-        cfg.write(open(global_config_filename(), 'w'))
-    else:
-        cfg.write(open(local_config_filename(), 'w'))
+def load_config():
+    """(Re)read the configuration files, skipping any which have not changed since they were last read.
+
+    The local file is looked up from $PWD, so long-running processes call this whenever
+    they start work on another project."""
+    global __snapshot, global_cfg, local_cfg
+    import idli.trace
+    with idli.trace.span("config"):
+        __snapshot = ConfigSnapshot(os.getenv("PWD"), os.getenv("HOME"))
+        global_cfg, local_cfg = __snapshot.global_cfg, __snapshot.local_cfg
 
 #Try to load configuration files. This need not succeed.
-try:
-    global_cfg.readfp(open(global_config_filename(), "r+"))
-except IOError as e:
-    pass # If config files don't exist, don't worry about it yet
-try:
-    local_cfg.readfp(open(local_config_filename(), 'r+'))
-except IOError as e:
-    pass # If config files don't exist, don't worry about it yet
+load_config()
 
 if __name__=="__main__":
     pass
-
@@ -0,0 +1,173 @@
+"""Decoding of what servers send: JSON bodies, and the dates inside them.
+
+orjson, if it is installed, decodes whole bodies; otherwise the json module does.
+Long lists of issues are better decoded with ArrayStream, which yields them one
+at a time as the body arrives, so that neither the whole body nor the whole
+parsed tree need be held at once."""
+import json
+import codecs
+import datetime
+import functools
+
+try:
+    import orjson
+except ImportError: # Optional; json gives the same results, more slowly
+    orjson = None
+
+# Bytes read from the network at a time by streaming decoders.
+CHUNK_SIZE = 64 * 1024
+
+def loads(body):
+    """Decode a whole JSON body, given as bytes or str."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+@functools.lru_cache(maxsize=16384)
+def parse_date(datestr):
+    """A naive datetime in UTC, from the variants of ISO 8601 which servers send:
+
+        2011-02-03T04:05:06Z          (Redmine)
+        2011/02/03 04:05:06 -0800     (Github)
+        2011-02-03 04:05:06+00:00     (Bitbucket)
+
+    Fractional seconds are allowed, and a time without an offset is taken to be in UTC.
+    Raises ValueError for anything else."""
+    result = None
+    text = datestr
+    if (text[4:5] == "/") and (text[7:8] == "/"): # Github's, which is ISO 8601 but for the separators
+        text = text[0:4] + "-" + text[5:7] + "-" + text[8:19] + text[19:].lstrip()
+    if (text[4:5] == "-") and (len(text) >= 19): # Which has a time; fromisoformat would take a date alone
+        try:
+            result = datetime.datetime.fromisoformat(text)
+        except ValueError: # Before Python 3.11 it does not accept "Z", for one
+            pass
+    if result is None:
+        result = _parse_fields(datestr)
+    offset = result.utcoffset()
+    if offset is not None:
+        result = (result - offset).replace(tzinfo=None)
+    return result
+
+def _parse_fields(datestr):
+    try:
+        # The fields are at fixed positions, whichever separators are used.
+        if not (datestr[4] in "-/" and datestr[7] == datestr[4] and datestr[10] in "T " and datestr[13] == datestr[16] == ":"):
+            raise ValueError
+        result = datetime.datetime(int(datestr[0:4]), int(datestr[5:7]), int(datestr[8:10]),
+                                   int(datestr[11:13]), int(datestr[14:16]), int(datestr[17:19]))
+        rest = datestr[19:]
+        if rest.startswith("."):
+            digits = len(rest) - len(rest[1:].lstrip("0123456789"))
+            result = result.replace(microsecond=int((rest[1:digits] + "000000")[0:6]))
+            rest = rest[digits:]
+        rest = rest.strip()
+        if rest and not (rest in ("Z", "z")):
+            if not (rest[0] in "+-"):
+                raise ValueError
+            offset = rest[1:].replace(":", "")
+            if not (len(offset) in (2, 4) and offset.isdigit()):
+                raise ValueError
+            delta = datetime.timedelta(hours=int(offset[0:2]), minutes=int(offset[2:4] or 0))
+            result = (result - delta) if rest[0] == "+" else (result + delta)
+        return result
+    except (IndexError, ValueError):
+        raise ValueError("Unrecognised date: " + repr(datestr))
+
+class ArrayStream(object):
+    """The items of one array in a JSON object, decoded as the body arrives.
+
+    chunks is the body, as bytes or str or an iterable of pieces of either, such
+    as requests' response.iter_content(). Iterating yields the items of the array
+    named key; once they are exhausted, the object's other members are in rest
+    and the number of bytes read in size. Other members are decoded whole, so
+    this is for bodies whose bulk is the one array."""
+    def __init__(self, chunks, key):
+        if isinstance(chunks, (bytes, str)):
+            chunks = [chunks]
+        self.key = key
+        self.rest = {}
+        self.size = 0
+        self.__chunks = iter(chunks)
+        self.__text = codecs.getincrementaldecoder("utf-8")()
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ""
+        self.__pos = 0
+        self.__eof = False
+
+    def __iter__(self):
+        self.__expect("{")
+        while True:
+            if self.__peek() == "}":
+                self.__pos += 1
+                while self.__read(): # Read to the end, so that the source knows the body is complete
+                    pass
+                return
+            name = self.__value()
+            self.__expect(":")
+            if name == self.key:
+                for item in self.__items():
+                    yield item
+            else:
+                self.rest[name] = self.__value()
+            if self.__peek() == ",":
+                self.__pos += 1
+
+    def __items(self):
+        self.__expect("[")
+        while True:
+            c = self.__peek()
+            if c == "]":
+                self.__pos += 1
+                return
+            if c == ",":
+                self.__pos += 1
+            yield self.__value()
+
+    def __value(self):
+        self.__peek()
+        while True:
+            try:
+                (value, end) = self.__decoder.raw_decode(self.__buffer, self.__pos)
+            except ValueError:
+                if not self.__read():
+                    raise
+                continue
+            # A number or literal which ends the buffer may go on in the next chunk.
+            if (end == len(self.__buffer)) and not (self.__buffer[self.__pos] in "{[\"") and self.__read():
+                continue
+            self.__pos = end
+            return value
+
+    def __expect(self, c):
+        if self.__peek() != c:
+            raise ValueError("Malformed response: expected '" + c + "'")
+        self.__pos += 1
+
+    def __peek(self):
+        # The next non-whitespace character, which is not consumed.
+        while True:
+            while (self.__pos < len(self.__buffer)) and self.__buffer[self.__pos].isspace():
+                self.__pos += 1
+            if self.__pos < len(self.__buffer):
+                return self.__buffer[self.__pos]
+            if not self.__read():
+                raise ValueError("Unexpected end of the response")
+
+    def __read(self):
+        # Append the next chunk to the buffer, dropping what has been decoded. False at the end of the body.
+        if self.__eof:
+            return False
+        for chunk in self.__chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            self.size += len(chunk)
+            text = self.__text.decode(chunk)
+            if text:
+                self.__buffer = self.__buffer[self.__pos:] + text
+                self.__pos = 0
+                return True
+        self.__eof = True
+        self.__buffer = self.__buffer[self.__pos:] + self.__text.decode(b"", True)
+        self.__pos = 0
+        return True
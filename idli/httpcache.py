@@ -0,0 +1,274 @@
+"""On-disk cache of HTTP responses, revalidated with conditional requests.
+
+GET responses which carry an ETag or Last-Modified header are kept in
+~/.idli_http_cache, keyed by method, URL, query parameters and a hash of the
+credentials used (never the credentials themselves). The next request for the
+same key sends If-None-Match/If-Modified-Since, and a 304 reply is answered
+with the stored body. Nothing is ever served without asking the server, so the
+cache can not return stale data; it only saves downloading unchanged bodies.
+
+Bodies are stored once per SHA-256 of their content, so identical replies to
+different URLs share storage. When the bodies outgrow the configured size the
+least recently used responses are evicted. Streamed bodies pass through
+temporary files on their way in and out, so that caching them does not mean
+holding them in memory."""
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+import idli.config as cfg
+
+IDLI_HTTP_CACHE_FILENAME = ".idli_http_cache"
+CONFIG_SECTION = "transport"
+DEFAULT_MAX_SIZE = 50 # Megabytes
+
+# Bytes copied at a time between streamed bodies and the database.
+BLOB_CHUNK_SIZE = 64 * 1024
+
+def http_cache_filename():
+    return os.path.join(os.getenv("HOME"), IDLI_HTTP_CACHE_FILENAME)
+
+class HttpCache(object):
+    schema = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            url TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            digest TEXT,
+            size INTEGER,
+            used REAL
+        );
+        CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+        CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest);
+        CREATE TABLE IF NOT EXISTS bodies (
+            digest TEXT PRIMARY KEY,
+            size INTEGER,
+            body BLOB
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        );
+    """
+
+    # The body is the last column of bodies, so that SQLite can make room for a
+    # streamed one with zeroblob() without writing it out in memory first. Caches
+    # made before then are emptied rather than converted.
+    SCHEMA_VERSION = 2
+
+    # Counters kept for --cache-stats.
+    STATS = ("requests", "hits", "stored", "bytes_saved", "bytes_downloaded", "evicted")
+
+    def __init__(self, filename=None, max_size=DEFAULT_MAX_SIZE * 1024 * 1024):
+        self.filename = filename or http_cache_filename()
+        self.max_size = max_size
+        self.session = dict([(name, 0) for name in self.STATS]) # This process's share of the counters
+        self.__db = None
+        self.__lock = threading.Lock() # Requests are made from many threads
+
+    def db(self):
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.filename, check_same_thread=False, timeout=10)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            if self.__db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self.__db.executescript("DROP TABLE IF EXISTS responses; DROP TABLE IF EXISTS bodies;")
+            self.__db.executescript(self.schema)
+            self.__db.execute("PRAGMA user_version = " + str(self.SCHEMA_VERSION))
+        return self.__db
+
+    def key(self, method, url, params=None, auth=None):
+        identity = hashlib.sha256(json.dumps(auth, default=str).encode("utf-8")).hexdigest() if auth else ""
+        return hashlib.sha256(json.dumps([method.upper(), url, sorted((params or {}).items()), identity], default=str).encode("utf-8")).hexdigest()
+
+    def validators(self, key):
+        """Headers which make a request for key conditional, or {} if nothing is cached."""
+        with self.__lock:
+            row = self.db().execute("SELECT etag, last_modified FROM responses WHERE key = ?", (key,)).fetchone()
+        headers = {}
+        if row is not None:
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def body(self, key):
+        """The stored body for key, after the server answered 304; None if it has gone since."""
+        with self.__lock:
+            db = self.db()
+            row = db.execute("SELECT b.body FROM responses r JOIN bodies b ON b.digest = r.digest WHERE r.key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            body = bytes(row[0])
+            db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self.__count(db, requests=1, hits=1, bytes_saved=len(body))
+            db.commit()
+        return body
+
+    def store(self, key, url, response_headers, body):
+        """Remember a 200 response, if the server gave it a validator. Returns nothing."""
+        etag = response_headers.get("ETag")
+        last_modified = response_headers.get("Last-Modified")
+        no_store = "no-store" in (response_headers.get("Cache-Control") or "")
+        with self.__lock:
+            db = self.db()
+            self.__count(db, requests=1, bytes_downloaded=len(body))
+            if ((etag is None) and (last_modified is None)) or no_store:
+                db.commit()
+                return
+            digest = hashlib.sha256(body).hexdigest()
+            db.execute("INSERT OR IGNORE INTO bodies (digest, size, body) VALUES (?, ?, ?)", (digest, len(body), sqlite3.Binary(body)))
+            db.execute("INSERT OR REPLACE INTO responses (key, url, etag, last_modified, digest, size, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (key, url, etag, last_modified, digest, len(body), time.time()))
+            self.__count(db, stored=1)
+            self.__evict(db)
+            db.commit()
+
+    def store_stream(self, key, url, response_headers, chunks):
+        """Yield the chunks of a streamed 200 response, remembering it as store() does
+        once the whole body has been read.
+
+        The body is copied to a temporary file as it passes, rather than held in
+        memory. A body which is not read to the end is not stored."""
+        cacheable = (response_headers.get("ETag") or response_headers.get("Last-Modified")) and not ("no-store" in (response_headers.get("Cache-Control") or ""))
+        spool = tempfile.TemporaryFile() if cacheable else None
+        digest = hashlib.sha256()
+        size = 0
+        complete = False
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if spool is not None:
+                    spool.write(chunk)
+                    digest.update(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if complete and (spool is not None):
+                self.__store_file(key, url, response_headers, digest.hexdigest(), spool, size)
+            else:
+                self.count_uncached(size)
+            if spool is not None:
+                spool.close()
+
+    def __store_file(self, key, url, response_headers, digest, spool, size):
+        with self.__lock:
+            db = self.db()
+            self.__count(db, requests=1, bytes_downloaded=size)
+            spool.seek(0)
+            cursor = db.execute("INSERT OR IGNORE INTO bodies (digest, size, body) VALUES (?, ?, zeroblob(?))", (digest, size, size))
+            if cursor.rowcount == 1:
+                if hasattr(db, "blobopen"): # Python 3.11 writes blobs a piece at a time
+                    with db.blobopen("bodies", "body", cursor.lastrowid) as blob:
+                        for chunk in iter(lambda: spool.read(BLOB_CHUNK_SIZE), b""):
+                            blob.write(chunk)
+                else:
+                    db.execute("UPDATE bodies SET body = ? WHERE digest = ?", (sqlite3.Binary(spool.read()), digest))
+            db.execute("INSERT OR REPLACE INTO responses (key, url, etag, last_modified, digest, size, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (key, url, response_headers.get("ETag"), response_headers.get("Last-Modified"), digest, size, time.time()))
+            self.__count(db, stored=1)
+            self.__evict(db)
+            db.commit()
+
+    def body_file(self, key):
+        """As body(), but a temporary file holding the body, for streamed responses."""
+        with self.__lock:
+            db = self.db()
+            row = db.execute("SELECT b.rowid, b.size FROM responses r JOIN bodies b ON b.digest = r.digest WHERE r.key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            result = tempfile.TemporaryFile()
+            if hasattr(db, "blobopen"):
+                with db.blobopen("bodies", "body", row[0], readonly=True) as blob:
+                    for chunk in iter(lambda: blob.read(BLOB_CHUNK_SIZE), b""):
+                        result.write(chunk)
+            else:
+                result.write(bytes(db.execute("SELECT body FROM bodies WHERE rowid = ?", (row[0],)).fetchone()[0]))
+            result.seek(0)
+            db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self.__count(db, requests=1, hits=1, bytes_saved=row[1])
+            db.commit()
+        return result
+
+    def count_uncached(self, num_bytes):
+        """Count a GET whose reply could not be cached, e.g. an error."""
+        with self.__lock:
+            db = self.db()
+            self.__count(db, requests=1, bytes_downloaded=num_bytes)
+            db.commit()
+
+    def size(self):
+        with self.__lock:
+            return self.db().execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def num_entries(self):
+        with self.__lock:
+            return self.db().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def totals(self):
+        """The counters for every process which has used this cache."""
+        with self.__lock:
+            result = dict([(name, 0) for name in self.STATS])
+            result.update(dict(self.db().execute("SELECT name, value FROM stats").fetchall()))
+            return result
+
+    def clear(self):
+        with self.__lock:
+            db = self.db()
+            db.executescript("DELETE FROM responses; DELETE FROM bodies; DELETE FROM stats;")
+            db.commit()
+
+    def __count(self, db, **counts):
+        for (name, n) in counts.items():
+            self.session[name] += n
+            db.execute("INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def __evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Drop the least recently used responses until what is left fits in 90% of the limit.
+        evicted = 0
+        for (key, digest, size) in db.execute("SELECT key, digest, size FROM responses ORDER BY used").fetchall():
+            if total <= self.max_size * 0.9:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            evicted += 1
+            if db.execute("SELECT 1 FROM responses WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                db.execute("DELETE FROM bodies WHERE digest = ?", (digest,))
+                total -= size
+        self.__count(db, evicted=evicted)
+
+def format_stats(name, counts):
+    """One line summarising counts, e.g. for --cache-stats."""
+    requests = counts["requests"]
+    ratio = (100.0 * counts["hits"] / requests) if requests else 0.0
+    return (name + ": " + str(counts["hits"]) + " of " + str(requests) + " GET requests answered from the cache (%.0f%%), " % ratio
+            + format_bytes(counts["bytes_saved"]) + " not downloaded, " + format_bytes(counts["bytes_downloaded"]) + " downloaded")
+
+def format_bytes(n):
+    for unit in ("bytes", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return (str(n) if unit == "bytes" else "%.1f" % n) + " " + unit
+        n = n / 1024.0
+
+__cache = None
+__cache_lock = threading.Lock()
+
+def get_cache():
+    """The process-wide HttpCache, or None if [transport] http_cache is false."""
+    global __cache
+    with __cache_lock:
+        if __cache is None:
+            settings = cfg.section(CONFIG_SECTION, { "http_cache" : "true", "http_cache_size" : str(DEFAULT_MAX_SIZE) })
+            if settings.http_cache.lower() in ("false", "no", "0"):
+                __cache = False
+            else:
+                __cache = HttpCache(max_size=float(settings.http_cache_size) * 1024 * 1024)
+        return __cache or None
@@ -0,0 +1,99 @@
+"""Per-project cache of what a server tells us about itself: statuses,
+priorities, trackers, labels and so on.
+
+Values are kept in a `.idli_metadata` file next to the project's .idli file,
+never in the configuration. Nothing is read or fetched until a command asks
+for it. A value older than `max_age` is still returned at once, while a fresh
+copy is fetched in the background for next time (stale-while-revalidate)."""
+import os
+import json
+import time
+import tempfile
+import threading
+
+import idli.config as cfg
+
+IDLI_METADATA_FILENAME = ".idli_metadata"
+METADATA_MAX_AGE = 60*60
+# How long a fallback, used because the server could not be asked, is kept before asking again.
+FALLBACK_MAX_AGE = 5*60
+
+def metadata_filename():
+    return os.path.join(os.path.dirname(cfg.local_config_filename()), IDLI_METADATA_FILENAME)
+
+class MetadataCache(object):
+    """Values are stored per `section` (the backend's config section), so that
+    a project which changes backend does not see the old backend's metadata."""
+    def __init__(self, section, filename=None, max_age=METADATA_MAX_AGE):
+        self.section = section
+        self.filename = filename or metadata_filename()
+        self.max_age = max_age
+        self.__lock = threading.Lock()
+        self.__revalidating = set()
+
+    def get(self, kind, fetch, fallback=None):
+        """Return the cached value of `kind`, calling fetch() for it if there is none.
+
+        Errors from fetch() propagate only if nothing is cached. If a `fallback` is
+        given it is returned instead, and cached for FALLBACK_MAX_AGE seconds so
+        that the next commands do not wait for the same failure."""
+        entry = self.__read().get(self.section, {}).get(kind)
+        if entry is None:
+            try:
+                value = fetch()
+            except Exception:
+                if fallback is None:
+                    raise
+                self.put(kind, fallback, FALLBACK_MAX_AGE)
+                return fallback
+            self.put(kind, value)
+            return value
+        if entry["fetched"] + entry.get("max_age", self.max_age) < time.time():
+            self.__revalidate(kind, fetch, ("max_age" in entry) and fallback)
+        return entry["value"]
+
+    def put(self, kind, value, max_age=None):
+        """Cache value as `kind`, for max_age seconds if given, or else for this cache's max_age."""
+        entry = { "value" : value, "fetched" : time.time() }
+        if max_age is not None:
+            entry["max_age"] = max_age
+        with self.__lock:
+            data = self.__read()
+            data.setdefault(self.section, {})[kind] = entry
+            self.__write(data)
+
+    def __revalidate(self, kind, fetch, fallback):
+        with self.__lock:
+            if kind in self.__revalidating:
+                return
+            self.__revalidating.add(kind)
+        # Not a daemon thread: a short command waits for the refresh on its way out, after its output.
+        threading.Thread(target=self.__refresh, args=(kind, fetch, fallback), name="idli-metadata-" + kind).start()
+
+    def __refresh(self, kind, fetch, fallback):
+        try:
+            self.put(kind, fetch())
+        except Exception: # Keep the stale value; the next command tries again
+            if fallback: # Still failing: keep the fallback for another while
+                self.put(kind, fallback, FALLBACK_MAX_AGE)
+        finally:
+            with self.__lock:
+                self.__revalidating.discard(kind)
+
+    def __read(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def __write(self, data):
+        # Write a temporary file and rename it over the old one, so that readers never see half a file.
+        fd, temp = tempfile.mkstemp(prefix=IDLI_METADATA_FILENAME + ".", dir=os.path.dirname(self.filename))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(temp, self.filename)
+        except:
+            os.unlink(temp)
+            raise
@@ -0,0 +1,206 @@
+"""Rendering of issues, for people (table) and for other programs (jsonl, csv, tsv).
+
+Everything is written through a Writer, which gathers lines and writes them in
+large blocks rather than one at a time."""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import threading
+
+try:
+    import orjson
+except ImportError: # Optional; json writes the same records, more slowly
+    orjson = None
+
+FORMATS = ("table", "jsonl", "csv", "tsv")
+
+# Characters gathered before they are written.
+BUFFER_SIZE = 64 * 1024
+
+# Lines are never held back for longer than this (seconds), so slow sources still show up as they arrive.
+FLUSH_INTERVAL = 0.1
+
+# The columns of csv and tsv output. Bodies are only written by show.
+FIELDS = ("id", "state", "created", "modified", "title", "creator", "owner", "num_comments", "tags")
+
+class Writer(object):
+    """Buffered output to stream, which is looked up when the Writer is made, so
+    contextlib.redirect_stdout works. Use it as a context manager, or call flush()
+    at the end.
+
+    Nothing written waits longer than interval to be flushed, even if nothing more
+    is written: while the source of the rows is blocked, a timer flushes them."""
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE, interval=FLUSH_INTERVAL):
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.__parts = []
+        self.__size = 0
+        self.__flushed = time.monotonic()
+        self.__timer = None
+        self.__lock = threading.Lock()
+
+    def write(self, text):
+        with self.__lock:
+            self.__parts.append(text)
+            self.__size += len(text)
+            due = (self.__size >= self.buffer_size) or (time.monotonic() - self.__flushed >= self.interval)
+            if (not due) and (self.__timer is None):
+                self.__timer = threading.Timer(self.interval, self.__timed_flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+        if due:
+            self.flush()
+
+    def line(self, text=""):
+        self.write(text + "\n")
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __timed_flush(self):
+        # Only what is pending is flushed, so a timer which fires after the last flush() touches nothing.
+        with self.__lock:
+            self.__timer = None
+            if self.__parts:
+                self.__flush()
+
+    def __flush(self):
+        if self.__parts:
+            self.stream.write("".join(self.__parts))
+            self.__parts, self.__size = [], 0
+        self.stream.flush()
+        self.__flushed = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+def terminal_width(stream):
+    """The number of columns of the terminal stream writes to, or None if it is not a terminal.
+
+    $COLUMNS wins, as it does for shutil.get_terminal_size()."""
+    columns = os.getenv("COLUMNS", "")
+    if columns.isdigit() and int(columns) > 0:
+        return int(columns)
+    try:
+        if stream.isatty():
+            return os.get_terminal_size(stream.fileno()).columns
+    except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+        pass
+    return None
+
+def issue_list_format(name, writer, width=None):
+    """The object which writes rows of an issue list in format name, having written any header."""
+    if name == "table":
+        return IssueTable(writer, width)
+    return IssueRecords(writer, name, FIELDS)
+
+class IssueTable(object):
+    """One line per issue. The title gets whatever the terminal has room for."""
+    FIXED_WIDTH = 54 # Every column but the title, and the spaces between them
+    DEFAULT_TITLE_WIDTH = 35
+    MIN_TITLE_WIDTH = 20
+
+    def __init__(self, writer, width=None):
+        self.writer = writer
+        self.title_width = self.DEFAULT_TITLE_WIDTH
+        if width is not None:
+            self.title_width = max(self.MIN_TITLE_WIDTH, width - self.FIXED_WIDTH - 1)
+        self.template = "%-6s %-10s  %-" + str(self.title_width) + "s  %-12s  %-12s  %-5s\n"
+        writer.write(self.template % ("ID", "date", "title", "creator", "owner", "# comments"))
+
+    def row(self, issue, comments=None):
+        # Rows are formatted in one go; only values which are too long go through fit().
+        (title, creator, owner, day) = (str(issue.title), str(issue.creator), str(issue.owner or ""), issue.create_time)
+        if len(title) > self.title_width:
+            title = fit(title, self.title_width)
+        if len(creator) > 12:
+            creator = fit(creator, 12)
+        if len(owner) > 12:
+            owner = fit(owner, 12)
+        if day is None:
+            day = ""
+        elif not isinstance(day, str):
+            day = "%04d/%02d/%02d" % (day.year, day.month, day.day) # As strftime("%Y/%m/%d"), in a fraction of the time
+        elif len(day) > 10:
+            day = fit(day, 10)
+        self.writer.write(self.template % (issue.id, day, title, creator, owner, fit(issue.num_comments, 5)))
+
+class IssueRecords(object):
+    """One JSON object (jsonl) or row (csv, tsv) per issue. Rows given comments also carry the
+    body; JSON objects carry the comments too."""
+    def __init__(self, writer, name, fields):
+        self.writer = writer
+        self.fields = fields
+        self.csv = None
+        if name in ("csv", "tsv"):
+            self.csv = csv.writer(writer, delimiter=("," if name == "csv" else "\t"), lineterminator="\n")
+            self.csv.writerow(fields)
+
+    def row(self, issue, comments=None):
+        record = issue_record(issue, comments)
+        if self.csv is None:
+            self.writer.write(dumps(record) + "\n")
+        else:
+            record["tags"] = ",".join(record["tags"])
+            self.csv.writerow([ "" if record.get(f) is None else record.get(f) for f in self.fields ])
+
+def dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record).decode("utf-8")
+    return json.dumps(record)
+
+def issue_record(issue, comments=None):
+    """An issue as a dict of JSON types. With comments, its body and comments are included."""
+    record = { "id" : issue.id, "state" : "open" if issue.status else "closed",
+               "created" : format_date(issue.create_time), "modified" : format_date(issue.last_modified),
+               "title" : issue.title, "creator" : issue.creator, "owner" : issue.owner,
+               "num_comments" : issue.num_comments, "tags" : list(issue.tags or []) }
+    if comments is not None:
+        record["body"] = issue.body
+        record["comments"] = [ { "creator" : c.creator, "date" : format_date(c.date), "body" : c.body } for c in comments ]
+    return record
+
+def format_issue(issue, comments):
+    """An issue and its comments, as show prints them."""
+    lines = [ "ID: " + issue.id, "Title: " + issue.title, "Creator: " + issue.creator,
+              "Create time: " + str(issue.create_time), "Open: " + str(issue.status) ]
+    if not (issue.owner is None):
+        lines.append("Owner: " + str(issue.owner))
+    if (issue.tags):
+        lines.append("Tags: " + ", ".join(issue.tags))
+    lines += [ "", issue.body, "" ]
+
+    if len(comments) > 0:
+        lines.append("Comments:")
+    for c in comments:
+        lines.append("")
+        if (c.title != "") and (not (c.title is None)):
+            lines.append("    Comment: " + str(c.title.__class__))
+        lines.append("    Author: " + c.creator)
+        lines.append("    Date: " + str(c.date))
+        lines.append("")
+        lines.append("    " + c.body.replace("\n", "\n    "))
+    return "\n".join(lines) + "\n"
+
+def fit(s, width):
+    """s padded or cut to width characters."""
+    s = str(s)
+    if len(s) <= width:
+        return s.ljust(width)
+    return s[0:width-3] + "..."
+
+def format_date(d):
+    if d is None:
+        return None
+    if isinstance(d, str):
+        return d
+    return d.isoformat()
@@ -0,0 +1,128 @@
+import re
+import datetime
+
+import idli
+
+# Issue attributes which can appear in a --where expression.
+FIELDS = { "id" : "id",
+           "owner" : "owner",
+           "creator" : "creator",
+           "tag" : "tags",
+           "title" : "title",
+           "body" : "body",
+           "created" : "create_time",
+           "modified" : "last_modified",
+           }
+DATE_FIELDS = ("created", "modified")
+
+# Longest operators first, so that ">=" is not read as ">".
+OPERATORS = (">=", "<=", "!=", "=", ">", "<", "~")
+
+__condition_re = re.compile(r'^\s*(\w+)\s*(' + "|".join([re.escape(o) for o in OPERATORS]) + r')\s*(.*?)\s*$')
+__and_re = re.compile(r'\s+and\s+', re.IGNORECASE)
+
+class Condition(object):
+    """A single comparison, e.g. owner=me or created>2026-01-01."""
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def matches(self, issue, username=None):
+        value = self.value
+        if (value == "me") and (self.field in ("owner", "creator")):
+            value = username
+        actual = getattr(issue, FIELDS[self.field])
+        if self.field == "tag":
+            if self.op == "=":
+                return value in (actual or [])
+            if self.op == "!=":
+                return not (value in (actual or []))
+            if self.op == "~":
+                return any([value.lower() in t.lower() for t in (actual or [])])
+            return False
+        if actual is None:
+            return self.op == "!="
+        if self.op == "~":
+            return str(value).lower() in str(actual).lower()
+        if self.field == "id":
+            actual, value = int(actual), int(value)
+        if not isinstance(actual, datetime.datetime) and (self.field in DATE_FIELDS):
+            return False
+        if self.op == "=":
+            return actual == value
+        if self.op == "!=":
+            return actual != value
+        if self.op == ">":
+            return actual > value
+        if self.op == "<":
+            return actual < value
+        if self.op == ">=":
+            return actual >= value
+        if self.op == "<=":
+            return actual <= value
+        return False
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, datetime.datetime):
+            value = value.strftime("%Y-%m-%d")
+        return self.field + self.op + str(value)
+
+class Query(object):
+    """A conjunction of Conditions. An empty query matches everything."""
+    def __init__(self, conditions=None):
+        self.conditions = list(conditions or [])
+
+    def matches(self, issue, username=None):
+        for c in self.conditions:
+            if not c.matches(issue, username):
+                return False
+        return True
+
+    def __and__(self, other):
+        return Query(self.conditions + other.conditions)
+
+    def __bool__(self):
+        return len(self.conditions) > 0
+
+    def __str__(self):
+        return " and ".join([str(c) for c in self.conditions])
+
+def parse(text):
+    """Parse an expression such as 'owner=me and tag=db and created>2026-01-01'."""
+    conditions = []
+    if (text is None) or (text.strip() == ""):
+        return Query()
+    for part in __and_re.split(text.strip()):
+        m = __condition_re.match(part)
+        if m is None:
+            raise idli.IdliException("Could not understand the condition '" + part + "'. Conditions look like owner=me, tag=db or created>2026-01-01.")
+        field, op, value = m.group(1).lower(), m.group(2), m.group(3)
+        if not (field in FIELDS):
+            raise idli.IdliException("Unknown field '" + field + "' in '" + part + "'. Known fields: " + ", ".join(sorted(FIELDS)) + ".")
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        if field in DATE_FIELDS:
+            value = __parse_date(value, part)
+        elif (field == "id") and (op != "~") and not value.isdigit(): # Compared as numbers
+            raise idli.IdliException("Could not understand the issue ID '" + value + "' in '" + part + "'. IDs are numbers.")
+        conditions.append(Condition(field, op, value))
+    return Query(conditions)
+
+def from_flags(mine=False, tag=None):
+    """The Query equivalent of the --mine and --tag options."""
+    conditions = []
+    if mine:
+        conditions.append(Condition("owner", "=", "me"))
+    if tag:
+        conditions.append(Condition("tag", "=", tag))
+    return Query(conditions)
+
+def __parse_date(value, part):
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise idli.IdliException("Could not understand the date '" + value + "' in '" + part + "'. Use YYYY-MM-DD.")
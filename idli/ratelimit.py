@@ -0,0 +1,325 @@
+"""Client side rate limiting of the requests made to each host.
+
+Every host gets a limit on the number of requests in flight and, if a rate is
+configured, a token bucket. Like TCP's congestion window, the limit grows by
+about one per round of successful requests and halves whenever the server
+pushes back with 429 or 503 (AIMD).
+
+Servers say how much they allow through Retry-After and the rate limit headers
+GitHub and others send (X-RateLimit-Remaining and X-RateLimit-Reset, or the
+unprefixed RateLimit-* ones). Requests are paused until the server is ready
+again, and counted against the remaining budget, so that once it is used up
+nothing is sent until the window resets.
+
+What servers have said is kept in ~/.idli_ratelimit, so that idli processes
+running side by side, and the next invocation, share one budget."""
+import os
+import json
+import atexit
+import time
+import tempfile
+import threading
+import contextlib
+import email.utils
+import urllib.parse
+
+try:
+    import fcntl
+except ImportError: # Not on Windows, where processes share the file without a lock
+    fcntl = None
+
+import idli
+import idli.trace
+import idli.config as cfg
+
+IDLI_RATELIMIT_FILENAME = ".idli_ratelimit"
+CONFIG_SECTION = "transport"
+
+# Statuses with which a server says it is overloaded.
+PUSHBACK_STATUS_CODES = (429, 503)
+
+# How long to pause after a 429 which does not say how long to wait.
+DEFAULT_PAUSE = 1.0
+
+# Server state is written at most this often, unless requests are being refused.
+SAVE_INTERVAL = 1.0
+
+def ratelimit_filename():
+    return os.path.join(os.getenv("HOME"), IDLI_RATELIMIT_FILENAME)
+
+class RateLimitExceeded(idli.IdliException):
+    def __init__(self, host, until):
+        self.value = "The rate limit of " + host + " is used up until " + time.strftime("%H:%M:%S", time.localtime(until)) + ". Try again then."
+        self.host = host
+        self.until = until
+
+class LimitStore(object):
+    """The server state of every host, in a JSON file shared by idli processes.
+
+    Changes are read, merged and written under a lock on a file next to it, so
+    that processes add to what the others have learned rather than replace it."""
+    def __init__(self, filename=None):
+        self.filename = filename or ratelimit_filename()
+        self.__lock = threading.Lock()
+        self.__seen = {} # The stamp of the file when each host's state was last read
+
+    def load(self, host):
+        self.__seen[host] = self.__stamp()
+        state = self.__read().get(host, {})
+        if not self.__current(state, time.time()):
+            return {}
+        return state
+
+    def load_if_changed(self, host):
+        """As load(), but None if the file has not changed since host's state was last read.
+        Cheap enough to call before every request."""
+        if self.__stamp() == self.__seen.get(host):
+            return None
+        return self.load(host)
+
+    def save(self, host, state):
+        """Merge state into the stored state of host, returning the result."""
+        with self.__locked():
+            now = time.time()
+            data = dict([(h, s) for (h, s) in self.__read().items() if self.__current(s, now)])
+            data[host] = merge_state(data.get(host, {}), state)
+            try:
+                self.__write(data)
+            except (IOError, OSError): # Limiting still works within this process
+                pass
+            self.__seen[host] = self.__stamp()
+            return data[host]
+
+    @contextlib.contextmanager
+    def __locked(self):
+        with self.__lock:
+            lock_file = None
+            try:
+                lock_file = open(self.filename + ".lock", "a")
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            except (IOError, OSError): # Without the lock, processes may lose each other's changes
+                pass
+            try:
+                yield
+            finally:
+                if lock_file is not None:
+                    lock_file.close() # Which releases the lock
+
+    def __stamp(self):
+        try:
+            st = os.stat(self.filename)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def __current(self, state, now):
+        return max(state.get("blocked_until") or 0, state.get("reset") or 0) > now
+
+    def __read(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def __write(self, data):
+        fd, temp = tempfile.mkstemp(prefix=IDLI_RATELIMIT_FILENAME + ".", dir=os.path.dirname(self.filename))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, sort_keys=True)
+            os.replace(temp, self.filename)
+        except:
+            os.unlink(temp)
+            raise
+
+class HostLimiter(object):
+    """Paces the requests made to one host.
+
+    Threads call acquire() before each request and release() with its status and
+    headers after it. Coroutines, which must not block, call reserve() and sleep
+    for as long as it says, then call update()."""
+    def __init__(self, host, rate=None, burst=10, max_concurrency=10, max_wait=60.0, store=None):
+        self.host = host
+        self.rate = rate # Requests per second we allow ourselves; None for as many as the server will take
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.store = store
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.refilled = time.time()
+        self.saved = 0
+        self.dirty = False
+        self.server = store.load(host) if store else {}
+        self.__cond = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request may be sent. Every acquire() must be followed by release()."""
+        started = time.time()
+        with self.__cond:
+            while self.in_flight >= int(self.limit):
+                self.__cond.wait()
+            self.in_flight += 1
+        try:
+            delay = self.reserve()
+        except RateLimitExceeded:
+            self.release()
+            raise
+        waited = time.time() - started + delay
+        if waited > 0.001:
+            with idli.trace.span("rate limit", "ratelimit", host=self.host, wait_ms=round(waited * 1000.0, 1),
+                                 concurrency=int(self.limit), remaining=self.server.get("remaining")):
+                time.sleep(delay)
+
+    def release(self, status=None, headers=None):
+        with self.__cond:
+            self.in_flight -= 1
+            self.__cond.notify_all()
+        if status is not None:
+            self.update(status, headers)
+
+    def reserve(self):
+        """Take a token, returning how many seconds to wait before sending the request.
+
+        Raises RateLimitExceeded rather than wait longer than max_wait."""
+        with self.__cond:
+            if self.store is not None: # Other processes may have heard from the server since
+                shared = self.store.load_if_changed(self.host)
+                if shared is not None:
+                    self.server = merge_state(self.server, shared)
+            now = time.time()
+            delay = max((self.server.get("blocked_until") or 0) - now, 0)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    delay = max(delay, -self.tokens / self.rate)
+            if (self.server.get("reset") or 0) <= now: # A new window, with a budget we know nothing about
+                self.server.pop("remaining", None)
+            if self.server.get("remaining") is not None:
+                # Count our own requests against the budget until the server says otherwise.
+                self.server["remaining"] = max(self.server["remaining"] - 1, 0)
+                if (self.server["remaining"] == 0) and ((self.server.get("reset") or 0) > now):
+                    self.server["blocked_until"] = max(self.server.get("blocked_until") or 0, self.server["reset"])
+            if delay > self.max_wait:
+                if self.rate:
+                    self.tokens += 1
+                raise RateLimitExceeded(self.host, now + delay)
+            return delay
+
+    def update(self, status, headers=None):
+        """Learn from a response: adjust the limit on requests in flight, and read the rate limit headers."""
+        headers = headers or {}
+        now = time.time()
+        with self.__cond:
+            if status in PUSHBACK_STATUS_CODES:
+                self.limit = max(1.0, self.limit / 2)
+            elif status < 500:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self.__cond.notify_all()
+            pause = parse_retry_after(headers.get("Retry-After"), now)
+            if (pause is None) and (status == 429) and (header(headers, "Remaining") is None):
+                pause = DEFAULT_PAUSE
+            if (pause is not None) and (status in PUSHBACK_STATUS_CODES):
+                self.server["blocked_until"] = max(self.server.get("blocked_until") or 0, now + pause)
+            remaining = header(headers, "Remaining")
+            if remaining is not None:
+                try:
+                    remaining, reset = int(remaining), parse_reset(header(headers, "Reset"), now)
+                    if (reset == self.server.get("reset")) and (self.server.get("remaining") is not None):
+                        # Replies arrive out of order; within a window the budget only goes down.
+                        remaining = min(remaining, self.server["remaining"])
+                    self.server["remaining"], self.server["reset"] = remaining, reset
+                except (TypeError, ValueError):
+                    self.server.pop("remaining", None)
+                    self.server.pop("reset", None)
+                if (self.server.get("remaining") == 0) and (self.server.get("reset") is not None):
+                    self.server["blocked_until"] = max(self.server.get("blocked_until") or 0, self.server["reset"])
+            if (self.store is None) or ((remaining is None) and (pause is None)):
+                return
+            if (status not in PUSHBACK_STATUS_CODES) and (now - self.saved < SAVE_INTERVAL):
+                self.dirty = True # Written by flush() on the way out
+                return
+        self.flush()
+
+    def flush(self):
+        """Write what the server has said to the store, for other processes to use."""
+        with self.__cond:
+            self.saved, self.dirty = time.time(), False
+            state = dict(self.server)
+        shared = self.store.save(self.host, state)
+        with self.__cond:
+            self.server = merge_state(self.server, shared)
+
+def merge_state(ours, theirs):
+    """What two processes know about one server, combined.
+
+    The later pause wins, and of two budgets for the same window the smaller,
+    since each process has counted only its own requests against it."""
+    result = dict(ours)
+    blocked_until = max(ours.get("blocked_until") or 0, theirs.get("blocked_until") or 0)
+    if blocked_until:
+        result["blocked_until"] = blocked_until
+    if (theirs.get("reset") or 0) > (ours.get("reset") or 0): # A later window
+        result["reset"] = theirs["reset"]
+        if theirs.get("remaining") is None:
+            result.pop("remaining", None)
+        else:
+            result["remaining"] = theirs["remaining"]
+    elif (theirs.get("reset") == ours.get("reset")) and (theirs.get("remaining") is not None):
+        result["remaining"] = min(theirs["remaining"], ours["remaining"]) if ours.get("remaining") is not None else theirs["remaining"]
+    return result
+
+def header(headers, name):
+    """The X-RateLimit-<name> or RateLimit-<name> header, if there is one."""
+    value = headers.get("X-RateLimit-" + name)
+    if value is None:
+        value = headers.get("RateLimit-" + name)
+    return value
+
+def parse_retry_after(value, now):
+    """Seconds to wait, from a Retry-After header of seconds or an HTTP date; None if there is none."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - now, 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def parse_reset(value, now):
+    """The time a rate limit window resets. Servers send either the epoch time (GitHub) or seconds from now."""
+    value = float(value)
+    if value > 1000000000:
+        return value
+    return now + value
+
+__limiters = {}
+__limiters_lock = threading.Lock()
+__store = None
+
+def flush():
+    for limiter in list(__limiters.values()):
+        if limiter.dirty:
+            limiter.flush()
+
+def limiter_for(url):
+    """The process-wide HostLimiter for the host of url, configured from the [transport] section."""
+    global __store
+    host = urllib.parse.urlsplit(url).netloc
+    with __limiters_lock:
+        if not (host in __limiters):
+            if __store is None:
+                __store = LimitStore()
+                atexit.register(flush)
+            settings = cfg.section(CONFIG_SECTION, { "rate" : "0", "burst" : "10", "pool_size" : "10", "max_wait" : "60" })
+            __limiters[host] = HostLimiter(host, rate=float(settings.rate) or None, burst=int(settings.burst),
+                                           max_concurrency=int(settings.pool_size), max_wait=float(settings.max_wait),
+                                           store=__store)
+        return __limiters[host]
@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import json
+import signal
+import argparse
+import traceback
+import contextlib
+import socketserver
+
+import idli
+import idli.client
+import idli.config as cfg
+
+class IdliServer(socketserver.UnixStreamServer):
+    """Runs idli commands sent by idli.client, keeping a warm backend per project.
+
+    Requests are handled one at a time, since the configuration and the
+    status mapping are process-wide."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.__backends = {}
+        old_umask = os.umask(0o077) # Only our user may talk to the daemon
+        try:
+            socketserver.UnixStreamServer.__init__(self, filename, IdliRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def execute(self, argv, cwd, columns=None):
+        """Run argv as if from directory cwd, for a terminal columns wide (None if the output is not a terminal).
+        Returns a response dict with stdout, stderr and status."""
+        import idli.commands
+        out, err = io.StringIO(), io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err), terminal_columns(columns):
+            try:
+                if idli.client.daemon_command(argv) is None:
+                    raise idli.IdliException("The daemon does not run this command.")
+                self.__enter_project(cwd)
+                idli.commands.run_command(argv, backend=self.__backend())
+            except idli.IdliException as e:
+                print(e.value)
+            except SystemExit as e: # argparse errors and --help
+                if isinstance(e.code, int):
+                    status = e.code
+                elif e.code is not None:
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        return { "stdout" : out.getvalue(), "stderr" : err.getvalue(), "status" : status }
+
+    def __enter_project(self, cwd):
+        os.chdir(cwd)
+        os.environ["PWD"] = cwd
+        cfg.load_config()
+
+    def __backend(self):
+        # A backend stays warm until somebody else edits the configuration files.
+        filename = cfg.local_config_filename()
+        entry = self.__backends.get(filename)
+        if (entry is not None) and (entry[0] == cfg.config_stamp()):
+            idli.set_status_mapping(entry[2])
+            return entry[1]
+        from idli.backends import get_backend_or_fail
+        backend = get_backend_or_fail()(argparse.Namespace())
+        cfg.load_config() # The backend may have written to the configuration
+        self.__backends[filename] = (cfg.config_stamp(), backend, idli.get_status_mapping())
+        return backend
+
+class IdliRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.execute(request["argv"], request["cwd"], request.get("columns"))
+        except (ValueError, KeyError) as e:
+            response = { "stdout" : "", "stderr" : "Bad request: " + str(e) + "\n", "status" : 1 }
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+@contextlib.contextmanager
+def terminal_columns(columns):
+    """Set $COLUMNS, which idli.output reads, for the duration of one request."""
+    saved = os.environ.pop("COLUMNS", None)
+    if columns:
+        os.environ["COLUMNS"] = str(columns)
+    try:
+        yield
+    finally:
+        os.environ.pop("COLUMNS", None)
+        if saved is not None:
+            os.environ["COLUMNS"] = saved
+
+def serve(filename=None):
+    filename = filename or idli.client.socket_filename()
+    if os.path.exists(filename):
+        if idli.client.daemon_running(filename):
+            raise idli.IdliException("An idli daemon is already listening on " + filename + ".")
+        os.unlink(filename) # Left behind by a daemon which did not shut down cleanly
+    server = IdliServer(filename)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Remove the socket on kill, too
+    sys.stdin = io.StringIO() # Not the client's; a command which reads it anyway must not hang the daemon
+    print("Listening on " + filename)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(filename)
@@ -0,0 +1,184 @@
+"""Timing spans for `idli --trace` and IDLI_TRACE.
+
+Code marks interesting work with
+
+    with idli.trace.span("http", method="GET", url=url) as s:
+        ...
+        s.set(status=200)
+
+When tracing is off span() returns a shared object which does nothing, so
+the cost is one function call."""
+import os
+import re
+import sys
+import json
+import time
+import threading
+import urllib.parse
+
+TRACE_ENV = "IDLI_TRACE"
+
+class NullSpan(object):
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+__null_span = NullSpan()
+
+class Span(object):
+    def __init__(self, recorder, name, category, attrs):
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.thread = threading.get_ident()
+        self.start = None
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def duration(self):
+        return self.end - self.start
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs.setdefault("error", exc_type.__name__)
+        self.recorder.add(self)
+        return False
+
+class Recorder(object):
+    """Collects finished spans and writes them out when tracing stops."""
+    def __init__(self, output=None):
+        self.output = output
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.__lock = threading.Lock()
+
+    def add(self, span):
+        with self.__lock:
+            self.spans.append(span)
+
+    def write(self):
+        if self.output is None:
+            self.write_summary(sys.stderr)
+        elif self.output.endswith(".jsonl"):
+            with open(self.output, "w") as f:
+                self.write_jsonl(f)
+        else:
+            with open(self.output, "w") as f:
+                self.write_chrome(f)
+
+    def write_jsonl(self, f):
+        for s in self.spans:
+            record = { "name" : s.name, "cat" : s.category, "thread" : s.thread,
+                       "start_ms" : round((s.start - self.origin) * 1000.0, 3),
+                       "duration_ms" : round(s.duration() * 1000.0, 3) }
+            record.update(self.__attrs(s))
+            f.write(json.dumps(record) + "\n")
+
+    def write_chrome(self, f):
+        """Chrome's trace event format; load the file in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = [ { "name" : s.name, "cat" : s.category, "ph" : "X", "pid" : pid, "tid" : s.thread,
+                     "ts" : round((s.start - self.origin) * 1e6, 1), "dur" : round(s.duration() * 1e6, 1),
+                     "args" : self.__attrs(s) } for s in self.spans ]
+        json.dump({ "traceEvents" : events, "displayTimeUnit" : "ms" }, f)
+
+    def write_summary(self, f):
+        rows = {}
+        for s in self.spans:
+            key = (s.category, self.__label(s))
+            row = rows.setdefault(key, [0, 0.0, 0.0, 0, 0])
+            row[0] += 1
+            row[1] += s.duration()
+            row[2] = max(row[2], s.duration())
+            row[3] += s.attrs.get("bytes", 0) or 0
+            if s.attrs.get("error") or ((s.attrs.get("status") or 200) >= 400):
+                row[4] += 1
+        f.write("\n" + "span".ljust(50) + "count".rjust(7) + "total ms".rjust(11) + "mean ms".rjust(10) + "max ms".rjust(10) + "bytes".rjust(11) + "errors".rjust(8) + "\n")
+        for (category, label), (count, total, longest, nbytes, errors) in sorted(rows.items(), key=lambda r: -r[1][1]):
+            name = (category + " " + label)[0:49]
+            f.write(name.ljust(50) + str(count).rjust(7) + ("%.1f" % (total * 1000.0)).rjust(11) + ("%.1f" % (total * 1000.0 / count)).rjust(10)
+                    + ("%.1f" % (longest * 1000.0)).rjust(10) + str(nbytes).rjust(11) + str(errors).rjust(8) + "\n")
+        f.write("wall time: %.1f ms\n" % ((time.perf_counter() - self.origin) * 1000.0))
+
+    def __label(self, s):
+        if "url" in s.attrs:
+            return str(s.attrs.get("method", "")) + " " + url_template(s.attrs["url"])
+        return s.name
+
+    def __attrs(self, s):
+        result = dict(s.attrs)
+        if "url" in result:
+            result["url"] = url_template(result["url"])
+        return result
+
+__recorder = None
+
+def enabled():
+    return __recorder is not None
+
+def span(name, category="phase", **attrs):
+    if __recorder is None:
+        return __null_span
+    return Span(__recorder, name, category, attrs)
+
+def start(output=None):
+    """Start recording. Spans are summarised on stderr, or written to `output` as
+    JSON lines (*.jsonl) or a Chrome trace (anything else) when tracing stops."""
+    global __recorder
+    if __recorder is None:
+        __recorder = Recorder(output)
+    return __recorder
+
+def start_if_requested(argv):
+    """Start recording if argv asks for --trace/--trace-file, or IDLI_TRACE is set.
+
+    IDLI_TRACE=1 prints a summary; any other value names an output file."""
+    output = None
+    requested = False
+    for n, arg in enumerate(argv):
+        if arg == "--trace":
+            requested = True
+        elif arg.startswith("--trace-file="):
+            requested, output = True, arg[len("--trace-file="):]
+        elif (arg == "--trace-file") and (n + 1 < len(argv)):
+            requested, output = True, argv[n + 1]
+        elif not arg.startswith("-"): # Only options before the command are ours
+            break
+    env = os.getenv(TRACE_ENV)
+    if env and (env.lower() not in ("0", "false", "no")):
+        requested = True
+        if (output is None) and (env.lower() not in ("1", "true", "yes")):
+            output = env
+    if requested:
+        start(output)
+    return requested
+
+def finish():
+    """Stop recording and write out what was recorded."""
+    global __recorder
+    recorder, __recorder = __recorder, None
+    if recorder is not None:
+        recorder.write()
+
+__number_re = re.compile(r'/\d+(?=[/.?]|$)')
+
+def url_template(url):
+    """Strip the query string and replace numeric path segments, so that calls can be grouped."""
+    parts = urllib.parse.urlsplit(url)
+    path = __number_re.sub("/{id}", parts.path)
+    if parts.netloc:
+        return parts.scheme + "://" + parts.netloc + path
+    return path
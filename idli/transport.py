@@ -0,0 +1,235 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import idli
+import idli.trace
+import idli.ratelimit
+import idli.httpcache
+import idli.config as cfg
+
+CONFIG_SECTION = "transport"
+
+# Only these methods are retried once a request may have reached the server.
+# Connection failures are retried for every method, since nothing was sent.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+RETRY_STATUS_CODES = (502, 503, 504)
+
+class HttpRequestException(Exception):
+    def __init__(self, value, status_code, body = None):
+        super(HttpRequestException, self).__init__(value)
+        self.value = value
+        self.status_code = status_code
+        self.body = body
+
+    def __str__(self):
+        result = "HttpError: " + str(self.status_code) + ", " + str(self.value)
+        if self.body:
+            result += ", " + str(self.body)
+        return result
+
+class Transport(object):
+    """A pooled, keep-alive HTTP client shared by the REST backends."""
+
+    def __init__(self, pool_size=10, timeout=30.0, retries=3, backoff=0.5):
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=IDEMPOTENT_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method, url, params=None, data=None, headers=None, auth=None, verify=True, stream=False):
+        """Send a request, returning the response if it succeeded and raising HttpRequestException if not.
+
+        With stream=True a successful body is left to be read, e.g. with
+        response.iter_content(). The HTTP cache copies it, or replays it, as it is read."""
+        cache = idli.httpcache.get_cache() if method.upper() == "GET" else None
+        if cache is None:
+            return self.__send(method, url, params, data, headers, auth, verify, stream)
+        key = cache.key(method, url, params, auth)
+        validators = cache.validators(key)
+        response = self.__send(method, url, params, data, dict(headers or {}, **validators), auth, verify, stream)
+        if response.status_code == 304:
+            body = cache.body_file(key) if stream else cache.body(key)
+            if body is None: # Evicted by another process since we asked
+                return self.__send(method, url, params, data, headers, auth, verify, stream)
+            response.status_code = 200
+            if stream:
+                response.raw = StreamedBody(lambda size: file_chunks(body, size), body.close)
+                response._content, response._content_consumed = False, False # Read it from raw again
+            else:
+                response._content = body
+        elif response.status_code == 200:
+            if stream:
+                raw = response.raw
+                response.raw = StreamedBody(lambda size: cache.store_stream(key, url, response.headers, raw.stream(size, decode_content=True)), raw.close)
+            else:
+                cache.store(key, url, response.headers, response.content)
+        else:
+            cache.count_uncached(len(response.content))
+        return response
+
+    def __send(self, method, url, params, data, headers, auth, verify, stream=False):
+        limiter = idli.ratelimit.limiter_for(url)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            response = None
+            try:
+                with idli.trace.span("http", "http", method=method.upper(), url=url) as span:
+                    response = self.session.request(method.upper(), url, params=params, data=data, headers=headers,
+                                                    auth=auth, verify=verify, timeout=self.timeout, stream=stream)
+                    # elapsed runs from sending the request to parsing the response headers
+                    span.set(status=response.status_code, headers_ms=round(response.elapsed.total_seconds() * 1000.0, 1),
+                             concurrency=int(limiter.limit))
+                    if (not stream) or (response.status_code != 200): # Only successful bodies are streamed
+                        span.set(bytes=len(response.content))
+            finally:
+                if response is None:
+                    limiter.release()
+                else:
+                    limiter.release(response.status_code, response.headers)
+            # A 429 means the request was refused, so it is safe to send again whatever the method.
+            # acquire() waits for as long as the server asked.
+            if (response.status_code == 429) and (attempt < self.retries):
+                attempt += 1
+                continue
+            break
+        if response.status_code == 304: # We asked whether our copy is current, and it is
+            return response
+        if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
+            raise HttpRequestException("HTTP error", response.status_code, response.content)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("head", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("put", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+class StreamedBody(object):
+    """Stands in for response.raw, so that response.iter_content() reads the chunks
+    open_chunks(chunk_size) yields rather than those the connection does."""
+    def __init__(self, open_chunks, close):
+        self.__open_chunks = open_chunks
+        self.close = close
+
+    def stream(self, chunk_size, decode_content=True):
+        return self.__open_chunks(chunk_size)
+
+def file_chunks(f, size):
+    try:
+        for chunk in iter(lambda: f.read(size or idli.httpcache.BLOB_CHUNK_SIZE), b""):
+            yield chunk
+    finally:
+        f.close()
+
+class AsyncTransport(object):
+    """Native asyncio counterpart of Transport, built on httpx (an optional dependency)."""
+
+    def __init__(self, pool_size=10, timeout=30.0, retries=3, backoff=0.5):
+        import httpx
+        self.__httpx = httpx
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.__clients = {}
+
+    def client(self, verify=True):
+        # httpx fixes certificate verification per client, so keep one of each.
+        if not (verify in self.__clients):
+            httpx = self.__httpx
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self.__clients[verify] = httpx.AsyncClient(limits=limits, timeout=self.timeout, verify=verify,
+                                                       transport=httpx.AsyncHTTPTransport(retries=self.retries, verify=verify),
+                                                       headers={ "Accept-Encoding" : "gzip, deflate" })
+        return self.__clients[verify]
+
+    async def request(self, method, url, params=None, data=None, headers=None, auth=None, verify=True):
+        import asyncio
+        method = method.upper()
+        if isinstance(data, dict): # Form fields, as requests would send them
+            body = { "data" : data }
+        else:
+            body = { "content" : data }
+        limiter = idli.ratelimit.limiter_for(url)
+        attempt = 0
+        while True:
+            delay = limiter.reserve()
+            if delay > 0:
+                with idli.trace.span("rate limit", "ratelimit", host=limiter.host, wait_ms=round(delay * 1000.0, 1)):
+                    await asyncio.sleep(delay)
+            try:
+                with idli.trace.span("http", "http", method=method, url=url) as span:
+                    response = await self.client(verify).request(method, url, params=params, headers=headers, auth=auth, **body)
+                    span.set(status=response.status_code, bytes=len(response.content))
+            except self.__httpx.TransportError as e:
+                raise HttpRequestException("Connection failed: " + str(e), None)
+            limiter.update(response.status_code, response.headers)
+            if (response.status_code == 429) and (attempt < self.retries): # Refused, so safe to send again
+                attempt += 1
+                continue
+            if (method in IDEMPOTENT_METHODS) and (response.status_code in RETRY_STATUS_CODES) and (attempt < self.retries):
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+                continue
+            if (response.status_code - (response.status_code % 100)) != 200: #200 responses are all legitimate
+                raise HttpRequestException("HTTP error", response.status_code, response.content)
+            return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("get", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("post", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("put", url, **kwargs)
+
+    async def aclose(self):
+        for c in self.__clients.values():
+            await c.aclose()
+        self.__clients = {}
+
+__transport = None
+
+def get_transport():
+    """Return the process-wide transport, creating it from the [transport] config section."""
+    global __transport
+    if __transport is None:
+        __transport = Transport(pool_size=int(__config_value("pool_size", 10)),
+                                timeout=float(__config_value("timeout", 30)),
+                                retries=int(__config_value("retries", 3)),
+                                backoff=float(__config_value("backoff", 0.5)))
+    return __transport
+
+def get_async_transport():
+    """Return a new AsyncTransport configured like get_transport().
+
+    Each event loop needs its own connection pool, so this is not shared.
+    Raises ImportError if httpx is not installed."""
+    return AsyncTransport(pool_size=int(__config_value("pool_size", 10)),
+                          timeout=float(__config_value("timeout", 30)),
+                          retries=int(__config_value("retries", 3)),
+                          backoff=float(__config_value("backoff", 0.5)))
+
+def __config_value(name, default):
+    try:
+        return cfg.get_config_value(CONFIG_SECTION, name)
+    except cfg.IdliMissingConfigException:
+        return default
@@ -0,0 +1,167 @@
+"""Cached directory of a project's users, for turning whatever was typed after
+`idli assign` into a user.
+
+The directory lives in the project's cache file (see idli.cache), next to the
+issues. Exact matches on id, mail, login or name are answered from indexes.
+Anything else is a partial match: a substring of mail, login or name through a
+trigram index, or a prefix of them when the text is too short for trigrams.
+
+Entries expire after `users_ttl` seconds (a day by default). Backends which can
+search their users on the server, such as redmine, fill the directory a few
+users at a time as they are looked up; the others download the whole list
+when the directory is empty or has expired."""
+import time
+import sqlite3
+import threading
+
+import idli
+import idli.cache
+
+USERS_TTL = 24*60*60
+
+# Text shorter than this is matched by prefix, since trigrams need three characters.
+TRIGRAM_LENGTH = 3
+
+__directory_lock = threading.Lock()
+
+def directory(backend):
+    """The backend's UserDirectory, made on first use and then shared by all its threads."""
+    with __directory_lock:
+        if getattr(backend, "_user_directory", None) is None:
+            backend._user_directory = UserDirectory(backend)
+        return backend._user_directory
+
+class UserDirectory(object):
+    schema = """
+        CREATE TABLE IF NOT EXISTS users (
+            key INTEGER PRIMARY KEY,
+            id TEXT UNIQUE,
+            mail TEXT COLLATE NOCASE,
+            login TEXT COLLATE NOCASE,
+            name TEXT COLLATE NOCASE,
+            fetched REAL
+        );
+        CREATE INDEX IF NOT EXISTS users_mail ON users (mail);
+        CREATE INDEX IF NOT EXISTS users_login ON users (login);
+        CREATE INDEX IF NOT EXISTS users_name ON users (name);
+    """
+    trigram_schema = "CREATE VIRTUAL TABLE IF NOT EXISTS users_trigrams USING fts5(mail, login, name, tokenize='trigram')"
+
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache or idli.cache.IssueCache()
+        self.ttl = float(backend.get_config("users_ttl", USERS_TTL))
+        self.__db = None
+        self.__trigrams = True
+        self.__lock = threading.Lock() # Bulk assign looks users up from many threads
+        self.__found = {}
+
+    def db(self):
+        if self.__db is None:
+            self.__db = self.cache.db()
+            self.__db.executescript(self.schema)
+            try:
+                self.__db.execute(self.trigram_schema)
+            except sqlite3.OperationalError: # SQLite older than 3.34, or built without FTS5
+                self.__trigrams = False
+        return self.__db
+
+    def find(self, text):
+        """Return the one user `text` refers to. Raises an IdliException if there is none, or several."""
+        text = str(text)
+        with self.__lock:
+            if not (text in self.__found):
+                try:
+                    self.__found[text] = self.__find(text)
+                except idli.IdliException as e: # Not found, or ambiguous: the next thread needn't ask again
+                    self.__found[text] = e
+            result = self.__found[text]
+        if isinstance(result, idli.IdliException):
+            raise result
+        return result
+
+    def __find(self, text):
+        user = self.__exact(text)
+        if user is not None:
+            return user
+        if self.is_complete():
+            return choose(self.__partial(text), text)
+        try:
+            users = self.backend.search_users(text)
+        except idli.IdliNotImplementedException:
+            self.refresh()
+            return choose(self.__partial(text), text)
+        self.store(users)
+        return choose(users, text)
+
+    def is_complete(self):
+        """True if the whole user list was downloaded less than `ttl` seconds ago."""
+        refreshed = self.cache.get_meta("users_refreshed") if self.cache.exists() else None
+        return (refreshed is not None) and (float(refreshed) > self.__expiry())
+
+    def refresh(self):
+        """Replace the directory with the backend's full user list."""
+        users = self.backend.users_list()
+        with self.db():
+            self.db().execute("DELETE FROM users")
+            if self.__trigrams:
+                self.db().execute("DELETE FROM users_trigrams")
+        self.store(users)
+        self.cache.set_meta("users_refreshed", str(time.time()))
+
+    def store(self, users):
+        now = time.time()
+        with self.db():
+            for u in users:
+                old = self.db().execute("SELECT key FROM users WHERE id = ?", (u.id,)).fetchone()
+                if old is not None:
+                    self.db().execute("DELETE FROM users WHERE key = ?", old)
+                    if self.__trigrams:
+                        self.db().execute("DELETE FROM users_trigrams WHERE rowid = ?", old)
+                key = self.db().execute("INSERT INTO users (id, mail, login, name, fetched) VALUES (?, ?, ?, ?, ?)",
+                                        (u.id, u.mail, u.shortname, u.longname, now)).lastrowid
+                if self.__trigrams:
+                    self.db().execute("INSERT INTO users_trigrams (rowid, mail, login, name) VALUES (?, ?, ?, ?)",
+                                      (key, u.mail, u.shortname, u.longname))
+
+    def __expiry(self):
+        return time.time() - self.ttl
+
+    def __exact(self, text):
+        if not self.cache.exists(): # Don't create the cache file just to find it empty
+            return None
+        row = self.db().execute("SELECT id, mail, login, name FROM users WHERE (id = ? OR mail = ? OR login = ? OR name = ?) AND fetched > ? "
+                                "ORDER BY CAST(id AS INTEGER), id LIMIT 1", (text, text, text, text, self.__expiry())).fetchone()
+        if row is None:
+            return None
+        return idli.User(*row)
+
+    def __partial(self, text):
+        if self.__trigrams and (len(text) >= TRIGRAM_LENGTH):
+            query = ("SELECT u.id, u.mail, u.login, u.name FROM users_trigrams t JOIN users u ON u.key = t.rowid "
+                     "WHERE users_trigrams MATCH ? AND u.fetched > ?")
+            params = ('"' + text.replace('"', '""') + '"', self.__expiry())
+        else:
+            # The NOCASE indexes serve prefix LIKEs; without trigrams longer text is a scan.
+            pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            if len(text) >= TRIGRAM_LENGTH:
+                pattern = "%" + pattern
+            query = ("SELECT id, mail, login, name FROM users WHERE (mail LIKE ? ESCAPE '\\' OR login LIKE ? ESCAPE '\\' "
+                     "OR name LIKE ? ESCAPE '\\') AND fetched > ?")
+            params = (pattern, pattern, pattern, self.__expiry())
+        return [ idli.User(*row) for row in self.db().execute(query, params) ]
+
+def choose(users, text):
+    """The user in `users` matching `text` exactly by id, mail, login or name, or else the only user there is."""
+    text = str(text)
+    for u in users:
+        if text in (u.id, u.mail, u.shortname, u.longname):
+            return u
+    if len(users) == 1:
+        return users[0]
+    if len(users) == 0:
+        raise idli.IdliException("No user matching '" + text + "'")
+    names = sorted([u.shortname for u in users])
+    if len(names) > 10:
+        names = names[0:10] + [ "and " + str(len(names) - 10) + " more" ]
+    raise idli.IdliException("Multiple users matching '" + text + "': " + ", ".join(names))
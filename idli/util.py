@@ -29,30 +29,13 @@ def static_method(meth):
         return meth(*args, **kwargs)
     return smeth
 
-def print_issue(issue, comments):
-    print("ID: " + issue.id)
-    print("Title: " + issue.title)
-    print("Creator: " + issue.creator)
-    print("Create time: " + str(issue.create_time))
-    print("Open: " + str(issue.status))
-    if not (issue.owner is None):
-        print("Owner: " + str(issue.owner))
-    if (issue.tags):
-        print("Tags: " + ", ".join(issue.tags))
-    print()
-    print(issue.body)
-    print()
-
-    if len(comments) > 0:
-        print("Comments:")
-    for c in comments:
-        print()
-        if (c.title != "") and (not (c.title is None)):
-            print("    Comment: " + str(c.title.__class__))
-        print("    Author: " + c.creator)
-        print("    Date: " + str(c.date))
-        print()
-        print("    " + c.body.replace("\n", "\n    "))
+def print_issue(issue, comments, out=None):
+    """Print an issue and its comments to out (a file, or an idli.output.Writer), or stdout."""
+    import sys
+    import idli.trace
+    import idli.output
+    with idli.trace.span("render"):
+        (out or sys.stdout).write(idli.output.format_issue(issue, comments))
 
 if __name__ == "__main__":
     result, es = get_string_from_editor("test\n\ntest 2 \n")
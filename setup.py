@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 
 try:
@@ -45,5 +45,18 @@ setup(name='idli',
       package_dir = { 'idli' : 'idli' },
       packages = ['idli', 'idli.backends'],
       scripts = ['scripts/idli',],
+      # Optional modules: pip install idli[async] for native asyncio backends,
+      # idli[fast] for faster JSON decoding and encoding, idli[zstd] for .zst archives.
+      extras_require = { 'async' : ['httpx'],
+                         'fast' : ['orjson'],
+                         'zstd' : ['zstandard'],
+                         },
+      # Third party backends register themselves in this group too; see "Adding new backends" in README.rst.
+      # idli registers its own before reading the group, so these are never imported through it.
+      entry_points = { 'idli.backends' : [ 'github = idli.backends.github:GithubBackend',
+                                           'trac = idli.backends.trac:TracBackend',
+                                           'redmine = idli.backends.redmine:RedmineBackend',
+                                           'bitbucket = idli.backends.bitbucket:BitbucketBackend',
+                                           ] },
      )
 
@@ -0,0 +1,146 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import idli
+import idli.archive
+from idli.archive import ImportProgress
+
+class ImportingBackend(idli.Backend):
+    """Creates issues numbered from 100. It has no tags, knows no users, and fails to comment "fail"."""
+    def __init__(self):
+        self.calls = []
+        self.next_id = 100
+
+    def add_issue(self, title, body, tags=[]):
+        self.next_id += 1
+        self.calls.append(("create", str(self.next_id), title))
+        return (idli.Issue(title, body, self.next_id, "importer"), [])
+
+    def add_comment(self, issue_id, body):
+        if body.endswith("fail"):
+            raise idli.IdliException("Comment rejected.")
+        self.calls.append(("comment", issue_id, body.split("\n\n")[-1]))
+
+    def assign_issue(self, issue_id, user, message):
+        raise idli.IdliException("Unknown user " + user + ".")
+
+    def resolve_issue(self, issue_id, status="closed", message=None):
+        self.calls.append(("resolve", issue_id, status))
+
+def record(n, comments=(), state="open", tags=(), owner=None):
+    return { "id" : n, "title" : "Issue " + str(n), "body" : "Body", "creator" : "alice", "created" : "2011-02-03T04:05:06",
+             "state" : state, "tags" : list(tags), "owner" : owner,
+             "comments" : [ { "creator" : "bob", "date" : "2011-02-04T00:00:00", "body" : c } for c in comments ] }
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_filename = os.path.join(self.directory, "archive.map")
+        self.checkpoint_filename = os.path.join(self.directory, "archive.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def progress(self):
+        progress = ImportProgress(self.map_filename, self.checkpoint_filename)
+        self.addCleanup(progress.close)
+        return progress
+
+class ImportProgressTest(ArchiveTestCase):
+    def test_progress_is_reloaded(self):
+        progress = self.progress()
+        progress.created("1", "101")
+        progress.step_done("1", 1)
+        progress.step_done("1", 3)
+        progress.close()
+        progress = self.progress()
+        self.assertEqual(progress.new_ids, { "1" : "101" })
+        self.assertEqual(progress.done, { "1" : 3 })
+
+    def test_truncated_lines_are_ignored(self):
+        with open(self.map_filename, "w") as f:
+            f.write("1\t101\n2\t1")
+        with open(self.checkpoint_filename, "w") as f:
+            f.write('{"id": "1", "done": 2}\n{"id": "2", "do')
+        progress = self.progress()
+        self.assertEqual(progress.new_ids, { "1" : "101" })
+        self.assertEqual(progress.done, { "1" : 2 })
+        progress.created("2", "102")
+        progress.step_done("2", 1)
+        progress.close()
+        progress = self.progress()
+        self.assertEqual(progress.new_ids, { "1" : "101", "2" : "102" })
+        self.assertEqual(progress.done, { "1" : 2, "2" : 1 })
+
+class ImportStepsTest(unittest.TestCase):
+    def test_order(self):
+        steps = idli.archive.import_steps(record(1, comments=["a", "b"], state="closed", tags=["db"], owner="carol"))
+        self.assertEqual([kind for (kind, argument) in steps], ["create", "tag", "comment", "comment", "assign", "resolve"])
+        self.assertEqual(steps[-2], ("assign", "carol"))
+
+    def test_only_what_there_is(self):
+        self.assertEqual(idli.archive.import_steps(record(1)), [("create", None)])
+
+class ImportIssuesTest(ArchiveTestCase):
+    def import_issues(self, backend, records):
+        return list(idli.archive.import_issues(backend, records, self.progress(), workers=1))
+
+    def test_import(self):
+        backend = ImportingBackend()
+        results = self.import_issues(backend, [record(1, comments=["hello"], state="closed"), record(2)])
+        self.assertEqual([(r["id"], r["status"], r["new_id"]) for r in results], [("1", "ok", "101"), ("2", "ok", "102")])
+        self.assertEqual(backend.calls, [("create", "101", "Issue 1"), ("comment", "101", "hello"), ("resolve", "101", "closed"),
+                                         ("create", "102", "Issue 2")])
+
+    def test_tags_and_owners_are_best_effort(self):
+        backend = ImportingBackend()
+        results = self.import_issues(backend, [record(1, tags=["db"], owner="carol"), record(2, tags=["ui"], owner="dave")])
+        self.assertEqual([r["status"] for r in results], ["ok", "ok"])
+        # Missing tag support is reported once; each unknown user every time.
+        self.assertEqual(results[0]["warnings"], ["tag skipped: tag_issue is not implemented by this backend.",
+                                                  "assign skipped: Unknown user carol."])
+        self.assertEqual(results[1]["warnings"], ["assign skipped: Unknown user dave."])
+
+    def test_resumes_at_the_failed_step(self):
+        backend = ImportingBackend()
+        results = self.import_issues(backend, [record(1, comments=["one", "fail", "three"])])
+        self.assertEqual((results[0]["status"], results[0]["error"]), ("error", "Comment rejected."))
+        results = self.import_issues(backend, [record(1, comments=["one", "fixed", "three"]), record(2)])
+        self.assertEqual([r["status"] for r in results], ["ok", "ok"])
+        self.assertEqual(backend.calls, [("create", "101", "Issue 1"), ("comment", "101", "one"),
+                                         ("comment", "101", "fixed"), ("comment", "101", "three"), ("create", "102", "Issue 2")])
+        results = self.import_issues(backend, [record(1, comments=["one", "fixed", "three"])])
+        self.assertEqual((results[0]["status"], results[0]["new_id"]), ("skipped", "101"))
+
+    def test_created_but_not_checkpointed(self):
+        with open(self.map_filename, "w") as f:
+            f.write("1\t101\n")
+        backend = ImportingBackend()
+        results = self.import_issues(backend, [record(1, comments=["hello"])])
+        self.assertEqual(results[0]["new_id"], "101")
+        self.assertEqual(backend.calls, [("comment", "101", "hello")])
+
+class ReadArchiveTest(unittest.TestCase):
+    def test_records(self):
+        archive = io.StringIO(json.dumps({ "format" : "idli-export", "version" : 1 }) + "\n" + json.dumps(record(1)) + "\n\n")
+        self.assertEqual([r["id"] for r in idli.archive.read_archive(archive)], [1])
+
+    def test_bad_header(self):
+        for text in ("", "not json\n", '{"format": "something else"}\n', '["idli-export"]\n'):
+            self.assertRaises(idli.IdliException, idli.archive.read_archive, io.StringIO(text))
+
+    def test_newer_version(self):
+        archive = io.StringIO(json.dumps({ "format" : "idli-export", "version" : idli.archive.ARCHIVE_VERSION + 1 }) + "\n")
+        self.assertRaises(idli.IdliException, idli.archive.read_archive, archive)
+
+    def test_bad_line(self):
+        records = idli.archive.read_archive(io.StringIO('{"format": "idli-export"}\n{"id": 1}\n{"id": \n'))
+        self.assertEqual(next(records), { "id" : 1 })
+        self.assertRaises(idli.IdliException, next, records)
+
+if __name__ == "__main__":
+    unittest.main()
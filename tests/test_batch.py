@@ -0,0 +1,89 @@
+import io
+import time
+import threading
+import unittest
+
+import idli
+import idli.batch
+
+class RecordingBackend(idli.Backend):
+    """Records the order of changes to each issue. Issue "slow" takes a while, and "bad" fails."""
+    def __init__(self):
+        self.changes = []
+        self.lock = threading.Lock()
+
+    def add_comment(self, issue_id, body):
+        if issue_id == "slow":
+            time.sleep(0.05)
+        if issue_id == "bad":
+            raise idli.IdliException("No such issue.")
+        with self.lock:
+            self.changes.append((issue_id, body))
+
+def comment(issue_id, body):
+    return { "op" : "comment", "id" : issue_id, "body" : body }
+
+class ReadOperationsTest(unittest.TestCase):
+    def test_errors_are_yielded_in_place(self):
+        lines = ['{"op": "comment", "id": 3, "body": "x"}', '', 'nonsense', '[1]', '{"op": "fly"}', '{"op": "tag", "id": 3}']
+        result = list(idli.batch.read_operations(io.StringIO("\n".join(lines))))
+        self.assertEqual([n for (n, op) in result], [1, 3, 4, 5, 6])
+        self.assertEqual(result[0][1], comment("3", "x")) # ids become strings
+        for (n, op) in result[1:]:
+            self.assertTrue(isinstance(op, idli.IdliException))
+        self.assertTrue("tags" in result[-1][1].value)
+
+class RunBatchTest(unittest.TestCase):
+    def run_batch(self, operations, workers=4):
+        backend = RecordingBackend()
+        results = list(idli.batch.run_batch(backend, enumerate(operations, 1), workers))
+        return (backend, results)
+
+    def test_results_are_in_input_order(self):
+        operations = [comment("slow", "1"), comment("2", "2"), comment("bad", "3"), idli.IdliException("Invalid JSON"), comment("5", "5")]
+        backend, results = self.run_batch(operations)
+        self.assertEqual([r["line"] for r in results], [1, 2, 3, 4, 5])
+        self.assertEqual([r["status"] for r in results], ["ok", "ok", "error", "error", "ok"])
+        self.assertEqual(results[2]["error"], "No such issue.")
+
+    def test_operations_on_one_issue_keep_their_order(self):
+        operations = []
+        for n in range(20):
+            operations.append(comment("slow" if n % 5 == 0 else str(n % 3), str(n)))
+        for workers in (1, 4):
+            backend, results = self.run_batch(operations, workers)
+            for issue_id in ("slow", "0", "1", "2"):
+                expected = [op["body"] for op in operations if op["id"] == issue_id]
+                self.assertEqual([body for (i, body) in backend.changes if i == issue_id], expected)
+
+    def test_results_arrive_before_the_input_ends(self):
+        more = threading.Event()
+        def operations():
+            yield (1, comment("1", "first"))
+            more.wait(5)
+            yield (2, comment("2", "second"))
+        results = idli.batch.run_batch(RecordingBackend(), operations(), 4)
+        self.assertEqual(next(results)["line"], 1)
+        more.set()
+        self.assertEqual([r["line"] for r in results], [2])
+
+    def test_operation_key(self):
+        self.assertEqual(idli.batch.operation_key(1, comment("7", "x")), idli.batch.operation_key(9, comment("7", "y")))
+        self.assertNotEqual(idli.batch.operation_key(1, { "op" : "add" }), idli.batch.operation_key(2, { "op" : "add" }))
+
+class RunBulkTest(unittest.TestCase):
+    def test_falls_back_to_one_issue_at_a_time(self):
+        backend = RecordingBackend()
+        results = list(idli.batch.run_bulk(backend, { "op" : "comment", "body" : "x" }, [1, 2, 3]))
+        self.assertEqual([(r["id"], r["status"]) for r in results], [("1", "ok"), ("2", "ok"), ("3", "ok")])
+        self.assertEqual(sorted(backend.changes), [("1", "x"), ("2", "x"), ("3", "x")])
+
+    def test_uses_bulk_update(self):
+        backend = RecordingBackend()
+        backend.bulk_update = lambda ids, op: backend.changes.append((tuple(ids), op["op"]))
+        results = list(idli.batch.run_bulk(backend, { "op" : "resolve" }, ["1", "2"]))
+        self.assertEqual(backend.changes, [(("1", "2"), "resolve")])
+        self.assertEqual([r["status"] for r in results], ["ok", "ok"])
+
+if __name__ == "__main__":
+    unittest.main()
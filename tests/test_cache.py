@@ -0,0 +1,109 @@
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import idli
+import idli.cache
+
+def issue(n, modified=None, status=True, tags=[]):
+    return idli.Issue("Issue " + str(n), "Body of issue " + str(n), n, "user" + str(n), status=status,
+                      last_modified=modified, tags=list(tags))
+
+class FakeBackend(idli.Backend):
+    """Answers issues_since from a list, as a server would from its clock."""
+    def __init__(self, issues, ids=None):
+        self.issues = issues
+        self.ids = ids
+        self.asked = []
+
+    def issues_since(self, since=None):
+        self.asked.append(since)
+        return [i for i in self.issues if (since is None) or (i.last_modified is None) or (i.last_modified >= since)]
+
+    def issue_ids(self):
+        if self.ids is None:
+            return idli.Backend.issue_ids(self)
+        return self.ids
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = idli.cache.IssueCache(os.path.join(self.directory, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cached_ids(self):
+        return sorted([i.id for i in self.cache.issue_list(True) + self.cache.issue_list(False)])
+
+class SyncTest(CacheTestCase):
+    def test_watermark_comes_from_the_server(self):
+        newest = datetime.datetime(2020, 5, 1, 12, 0, 0)
+        backend = FakeBackend([issue(1, datetime.datetime(2020, 1, 1)), issue(2, newest)])
+        self.assertEqual(idli.cache.sync(backend, self.cache), 2)
+        self.assertEqual(self.cache.last_sync(), newest - idli.cache.SYNC_OVERLAP)
+
+    def test_watermark_never_goes_back(self):
+        backend = FakeBackend([issue(1, datetime.datetime(2020, 5, 1))])
+        idli.cache.sync(backend, self.cache)
+        first = self.cache.last_sync()
+        backend.issues = [issue(1, datetime.datetime(2020, 1, 1))]
+        idli.cache.sync(backend, self.cache)
+        self.assertEqual(self.cache.last_sync(), first)
+        self.assertEqual(backend.asked[-1], first)
+
+    def test_no_server_times_keeps_the_old_watermark(self):
+        backend = FakeBackend([issue(1)])
+        idli.cache.sync(backend, self.cache)
+        self.assertTrue(self.cache.is_synced())
+        self.assertEqual(self.cache.last_sync(), None)
+        idli.cache.sync(backend, self.cache)
+        self.assertEqual(backend.asked, [None, None])
+
+    def test_full_sync_drops_deleted_issues(self):
+        self.cache.store_issues([issue(9)])
+        idli.cache.sync(FakeBackend([issue(1), issue(2)]), self.cache)
+        self.assertEqual(self.cached_ids(), ["1", "2"])
+
+    def test_incremental_sync_drops_deleted_issues_if_the_backend_lists_ids(self):
+        modified = datetime.datetime(2020, 5, 1)
+        backend = FakeBackend([issue(1, modified), issue(2, modified)])
+        idli.cache.sync(backend, self.cache)
+        backend.issues, backend.ids = [issue(1, modified)], ["1"]
+        idli.cache.sync(backend, self.cache)
+        self.assertEqual(self.cached_ids(), ["1"])
+
+    def test_incremental_sync_keeps_issues_if_the_backend_cannot_list_ids(self):
+        modified = datetime.datetime(2020, 5, 1)
+        backend = FakeBackend([issue(1, modified), issue(2, modified)])
+        idli.cache.sync(backend, self.cache)
+        backend.issues = [issue(1, modified)]
+        idli.cache.sync(backend, self.cache)
+        self.assertEqual(self.cached_ids(), ["1", "2"])
+
+class ApplyChangeTest(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.cache.store_issue(issue(1, tags=["db"]), [])
+
+    def cached(self):
+        return self.cache.issue_list(True) + self.cache.issue_list(False)
+
+    def test_resolve(self):
+        self.assertTrue(self.cache.apply_change("1", { "op" : "resolve", "state" : "closed" }))
+        self.assertEqual(self.cache.issue_list(True), [])
+        self.assertEqual(self.cache.get_issue("1"), None) # Comments must be fetched again
+
+    def test_tag_and_untag(self):
+        self.cache.apply_change("1", { "op" : "tag", "tags" : "ui,db" })
+        self.assertEqual(self.cached()[0].tags, ["db", "ui"])
+        self.cache.apply_change("1", { "op" : "tag", "tags" : ["db"], "remove" : True })
+        self.assertEqual(self.cached()[0].tags, ["ui"])
+
+    def test_assign_is_left_to_the_caller(self):
+        self.assertFalse(self.cache.apply_change("1", { "op" : "assign", "user" : "bob" }))
+
+if __name__ == "__main__":
+    unittest.main()
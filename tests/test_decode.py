@@ -0,0 +1,67 @@
+import json
+import datetime
+import unittest
+
+import idli.decode
+from idli.decode import ArrayStream, parse_date
+
+class ParseDateTest(unittest.TestCase):
+    def test_server_formats(self):
+        expected = datetime.datetime(2011, 2, 3, 4, 5, 6)
+        self.assertEqual(parse_date("2011-02-03T04:05:06Z"), expected)
+        self.assertEqual(parse_date("2011-02-03 04:05:06+00:00"), expected)
+        self.assertEqual(parse_date("2011-02-03T04:05:06"), expected)
+        self.assertEqual(parse_date("2011/02/03 04:05:06 +0000"), expected)
+
+    def test_offsets_are_converted_to_utc(self):
+        self.assertEqual(parse_date("2011/02/03 04:05:06 -0800"), datetime.datetime(2011, 2, 3, 12, 5, 6))
+        self.assertEqual(parse_date("2011-02-03T01:05:06+02:30"), datetime.datetime(2011, 2, 2, 22, 35, 6))
+        self.assertEqual(parse_date("2011-02-03T04:05:06Z").tzinfo, None)
+
+    def test_fractional_seconds(self):
+        self.assertEqual(parse_date("2011-02-03T04:05:06.5Z"), datetime.datetime(2011, 2, 3, 4, 5, 6, 500000))
+        self.assertEqual(parse_date("2011-02-03T04:05:06.123456789Z"), datetime.datetime(2011, 2, 3, 4, 5, 6, 123456))
+
+    def test_fields_without_fromisoformat(self):
+        # The fallback parser, which older Pythons use for most of these.
+        self.assertEqual(idli.decode._parse_fields("2011-02-03T04:05:06.25Z"), datetime.datetime(2011, 2, 3, 4, 5, 6, 250000))
+        self.assertEqual(idli.decode._parse_fields("2011/02/03 04:05:06 -0800"), datetime.datetime(2011, 2, 3, 12, 5, 6))
+
+    def test_garbage(self):
+        for text in ("", "yesterday", "2011-02-03", "2011-02-03T04:05:06 EST", "2011-02-03T04:05:06+8", "2011-13-03T04:05:06Z"):
+            self.assertRaises(ValueError, parse_date, text)
+
+class ArrayStreamTest(unittest.TestCase):
+    body = json.dumps({ "total_count" : 3, "issues" : [ { "id" : 1, "subject" : "café" }, { "id" : 2, "tags" : [1, [2]] }, 30000 ],
+                        "offset" : 0 }, ensure_ascii=False).encode("utf-8")
+
+    def chunked(self, size):
+        return [self.body[n:n + size] for n in range(0, len(self.body), size)]
+
+    def test_items_and_rest(self):
+        for size in (1, 2, 3, 7, len(self.body)): # Splits "é", and the number, across chunks
+            stream = ArrayStream(self.chunked(size), "issues")
+            self.assertEqual(list(stream), [ { "id" : 1, "subject" : "café" }, { "id" : 2, "tags" : [1, [2]] }, 30000 ])
+            self.assertEqual(stream.rest, { "total_count" : 3, "offset" : 0 })
+            self.assertEqual(stream.size, len(self.body))
+
+    def test_str_body(self):
+        self.assertEqual(list(ArrayStream('{"values": [], "next": null}', "values")), [])
+        self.assertEqual(list(ArrayStream(' { "values" : [ "a" , "b" ] } ', "values")), ["a", "b"])
+
+    def test_missing_array(self):
+        stream = ArrayStream(b'{"message": "Not Found"}', "issues")
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.rest, { "message" : "Not Found" })
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, list, ArrayStream(b'[1, 2]', "issues"))
+        self.assertRaises(ValueError, list, ArrayStream([b'{"issues": [1, ', b'2'], "issues"))
+
+class LoadsTest(unittest.TestCase):
+    def test_bytes_and_str(self):
+        self.assertEqual(idli.decode.loads(b'{"a": [1, "\xc3\xa9"]}'), { "a" : [1, "é"] })
+        self.assertEqual(idli.decode.loads('{"a": null}'), { "a" : None })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import argparse
+import datetime
+import unittest
+
+import idli
+import idli.query
+from idli.backends.github import GithubBackend
+from idli.backends.redmine import RedmineBackend
+from idli.backends.trac import TracBackend
+
+def issue(**fields):
+    values = dict(title="Crash on start", body="It crashes.", id="7", creator="ann", owner="bob", tags=["db"],
+                  create_time=datetime.datetime(2026, 2, 1))
+    values.update(fields)
+    return idli.Issue(values.pop("title"), values.pop("body"), values.pop("id"), values.pop("creator"), **values)
+
+class ParseTest(unittest.TestCase):
+    def test_conditions(self):
+        query = idli.query.parse("owner=me AND tag!=db and created>=2026-01-01 and title~'a b'")
+        self.assertEqual([(c.field, c.op) for c in query.conditions],
+                         [("owner", "="), ("tag", "!="), ("created", ">="), ("title", "~")])
+        self.assertEqual(query.conditions[2].value, datetime.datetime(2026, 1, 1))
+        self.assertEqual(query.conditions[3].value, "a b")
+        self.assertEqual(str(query), "owner=me and tag!=db and created>=2026-01-01 and title~a b")
+
+    def test_empty(self):
+        self.assertFalse(idli.query.parse(" "))
+        self.assertTrue(idli.query.parse(None).matches(issue()))
+
+    def test_errors(self):
+        for text in ("owner", "color=red", "created>yesterday", "id=abc", "id>4x"):
+            self.assertRaises(idli.IdliException, idli.query.parse, text)
+
+    def test_id_substring_need_not_be_a_number(self):
+        self.assertTrue(idli.query.parse("id~7").matches(issue()))
+
+class MatchTest(unittest.TestCase):
+    def matches(self, text, **fields):
+        return idli.query.parse(text).matches(issue(**fields), username="bob")
+
+    def test_owner_me(self):
+        self.assertTrue(self.matches("owner=me"))
+        self.assertFalse(self.matches("owner=me", owner="carl"))
+
+    def test_tags(self):
+        self.assertTrue(self.matches("tag=db"))
+        self.assertTrue(self.matches("tag~D"))
+        self.assertFalse(self.matches("tag!=db"))
+
+    def test_ids_compare_as_numbers(self):
+        self.assertTrue(self.matches("id>10", id="12"))
+        self.assertFalse(self.matches("id>10", id="9"))
+
+    def test_dates(self):
+        self.assertTrue(self.matches("created>2026-01-15"))
+        self.assertFalse(self.matches("created<2026-01-15"))
+        self.assertFalse(self.matches("modified>2026-01-15")) # Unknown, so no match
+
+class PlanQueryTest(unittest.TestCase):
+    query = "owner=me and tag=db and created>2026-01-01 and title~crash and id=4"
+
+    def plan(self, backend):
+        filters, remainder = backend(argparse.Namespace()).plan_query(idli.query.parse(self.query))
+        return (filters, str(remainder))
+
+    def test_github_sends_one_label(self):
+        self.assertEqual(self.plan(GithubBackend),
+                         ({ "label" : "db" }, "owner=me and created>2026-01-01 and title~crash and id=4"))
+
+    def test_redmine_checks_inexact_filters_again(self):
+        self.assertEqual(self.plan(RedmineBackend),
+                         ({ "assigned_to_id" : "me", "created_on" : ">=2026-01-01", "subject" : "~crash", "issue_id" : "4" },
+                          "tag=db and created>2026-01-01 and title~crash"))
+
+    def test_trac(self):
+        self.assertEqual(self.plan(TracBackend),
+                         (["owner=$USER", "keywords~=db", "time=2026-01-01..", "summary~=crash", "id=4"],
+                          "tag=db and created>2026-01-01 and title~crash"))
+
+    def test_trac_keeps_values_it_cannot_quote(self):
+        filters, remainder = TracBackend(argparse.Namespace()).plan_query(idli.query.parse("owner=a&b"))
+        self.assertEqual((filters, str(remainder)), ([], "owner=a&b"))
+
+if __name__ == "__main__":
+    unittest.main()
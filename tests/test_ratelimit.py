@@ -0,0 +1,132 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import idli.ratelimit
+from idli.ratelimit import HostLimiter, LimitStore, RateLimitExceeded, merge_state
+
+class AdaptiveLimitTest(unittest.TestCase):
+    def test_pushback_halves_the_limit(self):
+        limiter = HostLimiter("example.com", max_concurrency=8)
+        limiter.update(429, { "Retry-After" : "0" })
+        self.assertEqual(limiter.limit, 4.0)
+        for n in range(5):
+            limiter.update(503)
+        self.assertEqual(limiter.limit, 1.0)
+
+    def test_success_raises_the_limit_slowly(self):
+        limiter = HostLimiter("example.com", max_concurrency=4)
+        limiter.limit = 2.0
+        limiter.update(200)
+        self.assertEqual(limiter.limit, 2.5)
+        for n in range(20):
+            limiter.update(200)
+        self.assertEqual(limiter.limit, 4.0)
+
+    def test_server_errors_leave_the_limit_alone(self):
+        limiter = HostLimiter("example.com", max_concurrency=4)
+        limiter.limit = 2.0
+        limiter.update(500)
+        self.assertEqual(limiter.limit, 2.0)
+
+class ReserveTest(unittest.TestCase):
+    def test_retry_after_pauses_requests(self):
+        limiter = HostLimiter("example.com", max_wait=60.0)
+        self.assertEqual(limiter.reserve(), 0)
+        limiter.update(429, { "Retry-After" : "30" })
+        self.assertTrue(29 < limiter.reserve() <= 30)
+
+    def test_too_long_a_pause_raises(self):
+        limiter = HostLimiter("example.com", max_wait=5.0)
+        limiter.update(429, { "Retry-After" : "30" })
+        self.assertRaises(RateLimitExceeded, limiter.reserve)
+
+    def test_429_without_headers_pauses_briefly(self):
+        limiter = HostLimiter("example.com")
+        limiter.update(429)
+        self.assertTrue(0 < limiter.reserve() <= idli.ratelimit.DEFAULT_PAUSE)
+
+    def test_exhausted_budget_waits_for_the_reset(self):
+        limiter = HostLimiter("example.com")
+        limiter.update(200, { "X-RateLimit-Remaining" : "1", "X-RateLimit-Reset" : "20" })
+        self.assertEqual(limiter.reserve(), 0) # The last request of the window
+        self.assertTrue(19 < limiter.reserve() <= 20)
+
+    def test_token_bucket(self):
+        limiter = HostLimiter("example.com", rate=10.0, burst=2)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertTrue(0.05 < limiter.reserve() <= 0.1)
+
+class HeaderTest(unittest.TestCase):
+    def test_parse_retry_after(self):
+        now = 1000000000.0
+        self.assertEqual(idli.ratelimit.parse_retry_after(None, now), None)
+        self.assertEqual(idli.ratelimit.parse_retry_after("120", now), 120.0)
+        self.assertEqual(idli.ratelimit.parse_retry_after("-5", now), 0.0)
+        self.assertEqual(idli.ratelimit.parse_retry_after("Sun, 09 Sep 2001 01:47:00 GMT", now), 20.0)
+        self.assertEqual(idli.ratelimit.parse_retry_after("soon", now), None)
+
+    def test_parse_reset(self):
+        self.assertEqual(idli.ratelimit.parse_reset("1700000000", 5.0), 1700000000.0)
+        self.assertEqual(idli.ratelimit.parse_reset("60", 5.0), 65.0)
+        self.assertRaises(TypeError, idli.ratelimit.parse_reset, None, 5.0)
+
+    def test_header_prefixes(self):
+        self.assertEqual(idli.ratelimit.header({ "X-RateLimit-Remaining" : "3" }, "Remaining"), "3")
+        self.assertEqual(idli.ratelimit.header({ "RateLimit-Remaining" : "4" }, "Remaining"), "4")
+        self.assertEqual(idli.ratelimit.header({}, "Remaining"), None)
+
+class MergeStateTest(unittest.TestCase):
+    def test_later_pause_wins(self):
+        self.assertEqual(merge_state({ "blocked_until" : 5 }, { "blocked_until" : 9 })["blocked_until"], 9)
+        self.assertEqual(merge_state({ "blocked_until" : 9 }, { "blocked_until" : 5 })["blocked_until"], 9)
+
+    def test_smaller_budget_in_one_window_wins(self):
+        merged = merge_state({ "reset" : 100, "remaining" : 40 }, { "reset" : 100, "remaining" : 30 })
+        self.assertEqual((merged["reset"], merged["remaining"]), (100, 30))
+        merged = merge_state({ "reset" : 100, "remaining" : 20 }, { "reset" : 100, "remaining" : 30 })
+        self.assertEqual(merged["remaining"], 20)
+
+    def test_later_window_replaces_budget(self):
+        merged = merge_state({ "reset" : 100, "remaining" : 0 }, { "reset" : 200, "remaining" : 50 })
+        self.assertEqual((merged["reset"], merged["remaining"]), (200, 50))
+        merged = merge_state({ "reset" : 100, "remaining" : 0 }, { "reset" : 200 })
+        self.assertEqual(merged, { "reset" : 200 })
+        merged = merge_state({ "reset" : 200, "remaining" : 5 }, { "reset" : 100, "remaining" : 50 })
+        self.assertEqual((merged["reset"], merged["remaining"]), (200, 5))
+
+class LimitStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, idli.ratelimit.IDLI_RATELIMIT_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pushback_is_shared_between_processes(self):
+        ours = HostLimiter("example.com", store=LimitStore(self.filename))
+        theirs = HostLimiter("example.com", store=LimitStore(self.filename))
+        self.assertEqual(theirs.reserve(), 0)
+        ours.update(429, { "Retry-After" : "30" })
+        self.assertTrue(29 < theirs.reserve() <= 30)
+
+    def test_expired_state_is_dropped(self):
+        store = LimitStore(self.filename)
+        store.save("old.example.com", { "blocked_until" : time.time() - 1 })
+        store.save("example.com", { "blocked_until" : time.time() + 30 })
+        self.assertEqual(store.load("old.example.com"), {})
+        self.assertTrue("blocked_until" in store.load("example.com"))
+        self.assertEqual(LimitStore(self.filename).load_if_changed("example.com")["blocked_until"],
+                         store.load("example.com")["blocked_until"])
+        self.assertEqual(store.load_if_changed("example.com"), None)
+
+    def test_unreadable_file_is_empty(self):
+        with open(self.filename, "w") as f:
+            f.write("{ not json")
+        self.assertEqual(LimitStore(self.filename).load("example.com"), {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import idli
+import idli.cache
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = idli.cache.IssueCache(os.path.join(self.directory, "cache"))
+        self.cache.store_issues([
+            idli.Issue("Crash on startup", "The database lock is held.", 1, "alice", owner="bob", tags=["db", "crash"]),
+            idli.Issue("Slow query", "Startup crash when the index is missing.", 2, "alice", owner="carol", tags=["db"]),
+            idli.Issue("Typo in docs", "Crashing is spelled wrong.", 3, "dave", status=False, owner="bob", tags=["docs"]),
+            idli.Issue("Unrelated", "Nothing to see.", 4, "dave"),
+        ])
+        issue = idli.Issue("Login fails", "With no password.", 5, "erin", owner="bob")
+        self.cache.store_issue(issue, [idli.IssueComment(issue, "alice", "", "It is a crash in the auth module.")])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def ids(self, text, **kwargs):
+        return [i.id for i in self.cache.search(text, **kwargs)[0]]
+
+    def test_title_outranks_body_and_comments(self):
+        self.assertEqual(self.ids("crash")[0], "1")
+        self.assertEqual(sorted(self.ids("crash")), ["1", "2", "5"])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.ids("startup crash"), ["1", "2"])
+        self.assertEqual(self.ids("auth crash"), ["5"])
+        self.assertEqual(self.ids("auth database"), [])
+
+    def test_prefix(self):
+        self.assertEqual(sorted(self.ids("crash*")), ["1", "2", "3", "5"])
+
+    def test_search_syntax_is_literal(self):
+        self.assertEqual(self.ids('crash OR nothing'), [])
+        self.assertEqual(self.ids('"crash'), self.ids("crash"))
+
+    def test_filters(self):
+        self.assertEqual(self.ids("crash*", state=False), ["3"])
+        self.assertEqual(sorted(self.ids("crash*", owner="bob")), ["1", "3", "5"])
+        self.assertEqual(self.ids("crash*", tag="docs"), ["3"])
+        self.assertEqual(self.ids("crash", limit=1), ["1"])
+
+    def test_facets_count_every_match(self):
+        (issues, facets) = self.cache.search("crash*", limit=1)
+        self.assertEqual(len(issues), 1)
+        self.assertEqual(facets["state"], [("open", 3), ("closed", 1)])
+        self.assertEqual(facets["owner"][0], ("bob", 3))
+        self.assertEqual(facets["tag"][0], ("db", 2))
+
+    def test_updates_are_reindexed(self):
+        self.cache.store_issues([idli.Issue("Renamed", "Nothing here.", 1, "alice")])
+        self.assertEqual(sorted(self.ids("crash")), ["2", "5"])
+        self.assertEqual(self.ids("renamed"), ["1"])
+
+    def test_no_transaction_is_left_open(self):
+        self.cache.search("crash")
+        self.assertFalse(self.cache.db().in_transaction)
+
+    def test_nothing_to_search_for(self):
+        self.assertRaises(idli.IdliException, self.cache.search, "  * ")
+
+if __name__ == "__main__":
+    unittest.main()